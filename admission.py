@@ -0,0 +1,174 @@
+"""
+Admission control for the prediction routes
+  - RateLimiter: token bucket per client (API key or IP), charged per review,
+    so one large batch costs as much as many single calls. Buckets live in
+    process memory, or in a SQLite file shared by every worker on the host.
+  - PriorityGate: caps concurrent inference per worker. Interactive calls go
+    ahead of queued batch work, and batch work is shed (503) while the queue
+    wait stays above a threshold.
+"""
+
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+class Overloaded(Exception):
+    """Raised when batch work is shed; retry_after is in seconds"""
+
+    def __init__(self, retry_after):
+        super().__init__('Server is overloaded, try again shortly')
+        self.retry_after = retry_after
+
+
+def _refill(tokens, updated, now, rate, burst):
+    return min(burst, tokens + (now - updated) * rate)
+
+
+class MemoryBuckets:
+    """Per-process buckets, least recently seen clients dropped past max_clients"""
+
+    def __init__(self, max_clients=10000):
+        self.max_clients = max_clients
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key, cost, rate, burst, now):
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (burst, now))
+            tokens = _refill(tokens, updated, now, rate, burst)
+            # A request larger than the burst is let through on a full bucket and leaves it in debt
+            allowed = tokens >= min(cost, burst)
+            if allowed:
+                tokens -= cost
+            self._buckets[key] = (tokens, now)
+            while len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+            return allowed, tokens
+
+
+class SQLiteBuckets:
+    """Buckets in a SQLite file, so all workers on a host share one limit per client"""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = self._conn()
+        conn.execute('CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)')
+        conn.commit()
+
+    def _conn(self):
+        # sqlite connections must not cross threads or forks
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def take(self, key, cost, rate, burst, now):
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT tokens, updated FROM buckets WHERE key = ?', (key,)).fetchone()
+            tokens = _refill(*(row or (burst, now)), now, rate, burst)
+            allowed = tokens >= min(cost, burst)
+            if allowed:
+                tokens -= cost
+            conn.execute('INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)', (key, tokens, now))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return allowed, tokens
+
+
+class RateLimiter:
+    """Reviews-per-second token buckets keyed by client"""
+
+    def __init__(self, rate, burst, backend='memory', path='cache/rate_limits.sqlite3'):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        if backend == 'sqlite':
+            self.buckets = SQLiteBuckets(path)
+        elif backend == 'memory':
+            self.buckets = MemoryBuckets()
+        else:
+            raise ValueError(f"Unknown rate limit backend: {backend}")
+        self.backend_name = backend
+        self.limited = 0
+        self._lock = threading.Lock()
+
+    def take(self, key, cost):
+        """Charge cost reviews to key; returns 0 when allowed, else seconds until a retry can succeed"""
+        allowed, tokens = self.buckets.take(key, max(cost, 1), self.rate, self.burst, time.time())
+        if allowed:
+            return 0
+        with self._lock:
+            self.limited += 1
+        return max(1, math.ceil((min(cost, self.burst) - tokens) / self.rate))
+
+    def stats(self):
+        return {'backend': self.backend_name, 'reviews_per_sec': self.rate, 'burst': self.burst, 'limited': self.limited}
+
+
+class PriorityGate:
+    """Concurrency limit for inference with interactive-first ordering and batch shedding"""
+
+    def __init__(self, slots, shed_after_ms=0.0):
+        self.slots = max(1, slots)
+        self.shed_after_ms = shed_after_ms
+        self.queue_wait_ms = 0.0  # moving average over admitted work
+        self.shed = 0
+        self._active = 0
+        self._waiting = {'interactive': 0, 'batch': 0}
+        self._cond = threading.Condition()
+
+    def check(self, priority):
+        """Raise Overloaded if work of this priority would be shed right now"""
+        with self._cond:
+            self._check(priority)
+
+    def _check(self, priority):
+        queued = self._waiting['interactive'] + self._waiting['batch']
+        if (priority == 'batch' and self.shed_after_ms and queued
+                and self.queue_wait_ms > self.shed_after_ms):
+            self.shed += 1
+            raise Overloaded(max(1, math.ceil(self.queue_wait_ms / 1000.0)))
+
+    @contextmanager
+    def enter(self, priority, shed=True):
+        """Hold an inference slot; batch waiters yield to interactive ones"""
+        started = time.perf_counter()
+        with self._cond:
+            if shed:
+                self._check(priority)
+            self._waiting[priority] += 1
+            try:
+                while self._active >= self.slots or (priority == 'batch' and self._waiting['interactive']):
+                    self._cond.wait()
+            finally:
+                self._waiting[priority] -= 1
+            self._active += 1
+            waited_ms = (time.perf_counter() - started) * 1000.0
+            self.queue_wait_ms = 0.8 * self.queue_wait_ms + 0.2 * waited_ms
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._active -= 1
+                self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return {'slots': self.slots, 'active': self._active, 'waiting': dict(self._waiting),
+                    'queue_wait_ms': self.queue_wait_ms, 'shed_after_ms': self.shed_after_ms, 'shed': self.shed}
@@ -1,10 +1,28 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify, stream_with_context
 from flask_cors import CORS
 import os
+import sys
 import json
-from transformers import AutoTokenizer, AutoModelForSequenceClassification, pipeline
+import hashlib
+import hmac
+import threading
+import time
+import atexit
+import gc
+from contextlib import nullcontext
 import firebase_admin
 from firebase_admin import credentials, storage
+from admission import Overloaded, PriorityGate, RateLimiter
+from batching import Coalescer, MicroBatcher
+from result_cache import ResultCache
+from jobs import JobManager
+import metrics
+import serialization
+from model_download import LocalBucket, cache_is_valid, download_model, read_version_marker
+from model_registry import MODEL_NAME_PATTERN, InvalidModelName, ModelRegistry, ModelSlot, UnknownModel, check_model_name
+from preprocessing import dedupe, normalize_review, tokenizer_lowercases
+from aspects import compile_aspects, load_aspects, rollup, split_segments, tag_aspects
+from vector_index import VectorIndex
 
 app = Flask(__name__)
 CORS(app)
@@ -13,16 +31,162 @@ CORS(app)
 FIREBASE_STORAGE_BUCKET = 'ordernpickapp.firebasestorage.app'
 FIREBASE_CREDS_PATH = 'firebase-credentials.json'
 STORAGE_FOLDER = 'SentimentAnalysis'
-LOCAL_MODEL_DIR = 'cached_model'
+LOCAL_MODEL_DIR = os.environ.get('LOCAL_MODEL_DIR', 'cached_model')
 
 # Required model files
 REQUIRED_FILES = ['config.json', 'model.safetensors', 'tokenizer.json', 
                   'tokenizer_config.json', 'special_tokens_map.json', 'vocab.txt']
 
+# Model download (MODEL_BUCKET_DIR points at a local folder laid out like the bucket)
+MODEL_BUCKET_DIR = os.environ.get('MODEL_BUCKET_DIR')
+MODEL_DOWNLOAD_WORKERS = int(os.environ.get('MODEL_DOWNLOAD_WORKERS', '8'))
+MODEL_DOWNLOAD_CHUNK_MB = float(os.environ.get('MODEL_DOWNLOAD_CHUNK_MB', '8'))
+VERIFY_MODEL_CACHE = os.environ.get('VERIFY_MODEL_CACHE', 'false').lower() == 'true'
+
+# Torch intra-op threads per process (gunicorn.conf.py splits the cores between workers)
+# and inter-op threads (0 keeps the torch defaults)
+TORCH_NUM_THREADS = int(os.environ.get('TORCH_NUM_THREADS', '0'))
+TORCH_INTEROP_THREADS = int(os.environ.get('TORCH_INTEROP_THREADS', '0'))
+
+# Run the torch backends through torch.compile (falls back to eager if compiling fails)
+TORCH_COMPILE = os.environ.get('TORCH_COMPILE', 'false').lower() == 'true'
+
+# Run representative batch shapes through each model before it is reported ready
+MODEL_WARMUP = os.environ.get('MODEL_WARMUP', 'true').lower() == 'true'
+
+# Back model weights with a shared memory mapping of model.safetensors
+MMAP_WEIGHTS = os.environ.get('MMAP_WEIGHTS', 'true').lower() == 'true'
+
+# Background bulk jobs (separate process pool, results stored under JOBS_DIR)
+JOBS_DIR = os.environ.get('JOBS_DIR', 'jobs')
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', '1'))
+JOB_TORCH_THREADS = int(os.environ.get('JOB_TORCH_THREADS', '1'))
+JOB_CHUNK_SIZE = int(os.environ.get('JOB_CHUNK_SIZE', '1000'))
+# How often the host's job runner looks for queued jobs
+JOB_POLL_SECONDS = float(os.environ.get('JOB_POLL_SECONDS', '1'))
+
+# Long reviews: tokens per sequence, and 'truncate' (keep the head) or 'head_tail'
+# (score the first and last MAX_SEQUENCE_LENGTH tokens and average them)
+MAX_SEQUENCE_LENGTH = int(os.environ.get('MAX_SEQUENCE_LENGTH', '512'))
+LONG_REVIEW_STRATEGY = os.environ.get('LONG_REVIEW_STRATEGY', 'truncate')
+
+# Padded tokens per forward pass (batch length x longest sequence)
+BATCH_TOKEN_BUDGET = int(os.environ.get('BATCH_TOKEN_BUDGET', '8192'))
+
+# Text normalization before tokenizing: whitespace, legacy (lowercase, letters only) or none.
+# Texts that normalize the same are scored once per request
+TEXT_NORMALIZATION = os.environ.get('TEXT_NORMALIZATION', 'whitespace')
+
+# Aspect mode: JSON file of aspect -> keywords (defaults: delivery, food_quality, price, packaging)
+ASPECT_KEYWORDS_PATH = os.environ.get('ASPECT_KEYWORDS_PATH')
+
+# Inference backend: torch, torch-int8 or onnx (exports are cached in LOCAL_MODEL_DIR + '_onnx')
+INFERENCE_BACKEND = os.environ.get('INFERENCE_BACKEND', 'torch')
+# Let ONNX Runtime prepack MatMul weights: faster on some CPUs, but keeps a second copy of them
+ONNX_PREPACK_WEIGHTS = os.environ.get('ONNX_PREPACK_WEIGHTS', 'false').lower() == 'true'
+
+# Sample reviews for the backend parity check
+PARITY_SAMPLE_REVIEWS = [
+    "The food was amazing and service was excellent!",
+    "Terrible service, my order arrived cold and late.",
+    "It was okay, nothing special.",
+    "Fast delivery but the packaging was damaged.",
+    "Great value for the price, will order again.",
+    "The rider was rude and the food was missing items.",
+    "Average taste, reasonable price.",
+    "Best burger I've had in months",
+]
+# Most texts one parity check may score
+PARITY_MAX_TEXTS = int(os.environ.get('PARITY_MAX_TEXTS', '256'))
+
+# Extra model versions are downloaded to MODEL_VERSIONS_DIR/<name>; registry.json there
+# holds the versions every worker should keep loaded and the active one
+DEFAULT_MODEL_NAME = 'default'
+MODEL_VERSIONS_DIR = os.environ.get('MODEL_VERSIONS_DIR', 'model_versions')
+MODEL_WATCH_SECONDS = float(os.environ.get('MODEL_WATCH_SECONDS', '5'))
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN')
+
+# Model loading: 'background' serves liveness at once and loads in a thread;
+# 'sync' loads before the module finishes importing (gunicorn preload, jobs, CLI);
+# 'none' leaves it to the caller (offline tools that load models themselves)
+MODEL_LOADING = os.environ.get('MODEL_LOADING', 'background')
+MODEL_LOAD_RETRY_SECONDS = float(os.environ.get('MODEL_LOAD_RETRY_SECONDS', '30'))
+MODEL_RETRY_AFTER = '5'
+
+# gzip/deflate for prediction responses when the client sends Accept-Encoding
+RESPONSE_COMPRESSION = os.environ.get('RESPONSE_COMPRESSION', 'true').lower() == 'true'
+COMPRESSION_MIN_BYTES = int(os.environ.get('COMPRESSION_MIN_BYTES', '1024'))
+COMPRESSION_LEVEL = int(os.environ.get('COMPRESSION_LEVEL', '5'))
+
+# Number of reviews per forward pass in batch requests
+BATCH_SIZE = int(os.environ.get('BATCH_SIZE', '32'))
+
+# Reviews buffered per batch in /api/batch-analyze-stream
+STREAM_BATCH_SIZE = int(os.environ.get('STREAM_BATCH_SIZE', str(BATCH_SIZE)))
+
+# Cross-request micro-batching for /api/analyze-sentiment
+MICROBATCH_ENABLED = os.environ.get('MICROBATCH_ENABLED', 'false').lower() == 'true'
+MICROBATCH_MAX_SIZE = int(os.environ.get('MICROBATCH_MAX_SIZE', '16'))
+MICROBATCH_MAX_WAIT_MS = float(os.environ.get('MICROBATCH_MAX_WAIT_MS', '5'))
+
+# Per-client rate limit in reviews per second (0 disables). Clients are keyed by X-API-Key,
+# else by IP; the sqlite backend shares the buckets between the workers on a host
+RATE_LIMIT_REVIEWS_PER_SEC = float(os.environ.get('RATE_LIMIT_REVIEWS_PER_SEC', '0'))
+RATE_LIMIT_BURST = float(os.environ.get('RATE_LIMIT_BURST', '100'))
+RATE_LIMIT_BACKEND = os.environ.get('RATE_LIMIT_BACKEND', 'memory')
+RATE_LIMIT_PATH = os.environ.get('RATE_LIMIT_PATH', 'cache/rate_limits.sqlite3')
+RATE_LIMIT_TRUST_PROXY = os.environ.get('RATE_LIMIT_TRUST_PROXY', 'false').lower() == 'true'
+
+# Concurrent inference calls per worker (0 = unlimited). Interactive calls go first, and
+# batch work is shed with 503 while the average queue wait is above SHED_QUEUE_MS (0 = never)
+INFERENCE_CONCURRENCY = int(os.environ.get('INFERENCE_CONCURRENCY', '0'))
+SHED_QUEUE_MS = float(os.environ.get('SHED_QUEUE_MS', '0'))
+
+# Concurrent requests for the same uncached text share one computation
+COALESCE_INFLIGHT = os.environ.get('COALESCE_INFLIGHT', 'true').lower() == 'true'
+
+# Embedding index of scored reviews, for near-duplicate reuse and /api/similar
+# (one per model version under EMBEDDING_INDEX_DIR; needs a torch backend)
+EMBEDDING_INDEX_ENABLED = os.environ.get('EMBEDDING_INDEX_ENABLED', 'false').lower() == 'true'
+EMBEDDING_INDEX_DIR = os.environ.get('EMBEDDING_INDEX_DIR', 'embedding_index')
+EMBEDDING_INDEX_MAX_ENTRIES = int(os.environ.get('EMBEDDING_INDEX_MAX_ENTRIES', '100000'))
+EMBEDDING_INDEX_SAVE_SECONDS = float(os.environ.get('EMBEDDING_INDEX_SAVE_SECONDS', '60'))
+# Reviews of at least NEAR_DUPLICATE_MIN_CHARS whose SimHash is within NEAR_DUPLICATE_BITS
+# (at most 3) of an indexed review get its result without inference. Off (-1) by default:
+# SimHash does not see negation, so "not great" can match a review that says "great"
+NEAR_DUPLICATE_BITS = int(os.environ.get('NEAR_DUPLICATE_BITS', '-1'))
+NEAR_DUPLICATE_MIN_CHARS = int(os.environ.get('NEAR_DUPLICATE_MIN_CHARS', '40'))
+
+# Prediction result cache (backend: memory or sqlite)
+RESULT_CACHE_ENABLED = os.environ.get('RESULT_CACHE_ENABLED', 'true').lower() == 'true'
+RESULT_CACHE_BACKEND = os.environ.get('RESULT_CACHE_BACKEND', 'memory')
+RESULT_CACHE_MAX_MB = float(os.environ.get('RESULT_CACHE_MAX_MB', '64'))
+RESULT_CACHE_TTL = float(os.environ.get('RESULT_CACHE_TTL', '0')) or None
+RESULT_CACHE_PATH = os.environ.get('RESULT_CACHE_PATH', 'cache/results.sqlite3')
+
+# Bump when the shape of prediction results changes so cached entries are not reused
+RESULT_FORMAT_VERSION = 2
+
+# Normalize raw model labels (model.config.id2label) to sentiment names
+SENTIMENT_MAP = {
+    'positive': 'positive', 'pos': 'positive', 'label_2': 'positive', '2': 'positive',
+    'negative': 'negative', 'neg': 'negative', 'label_0': 'negative', '0': 'negative',
+    'neutral': 'neutral', 'neu': 'neutral', 'label_1': 'neutral', '1': 'neutral'
+}
+
 # Global variables
 model = None
 tokenizer = None
-sentiment_pipeline = None
+inference_backend = None
+model_version = None
+model_load_seconds = None
+deduplicated_reviews = 0
+model_state = 'loading'
+model_error = None
+model_ready = threading.Event()
+
+class ModelNotReady(Exception):
+    """Raised when a prediction is requested before the model has loaded"""
 
 def get_firebase_credentials():
     """Get Firebase credentials from file or environment variable"""
@@ -53,123 +217,958 @@ def initialize_firebase():
         print(f"✗ Firebase error: {e}")
         return False
 
-def download_model_from_firebase():
+def get_model_bucket():
+    """Firebase Storage bucket, or a local folder when MODEL_BUCKET_DIR is set"""
+    if MODEL_BUCKET_DIR:
+        return LocalBucket(MODEL_BUCKET_DIR)
+    if not initialize_firebase():
+        return None
+    return storage.bucket()
+
+def download_model_from_firebase(folder=STORAGE_FOLDER, model_dir=LOCAL_MODEL_DIR):
     """Download model files from Firebase Storage"""
     try:
         print("\n=== Downloading Model ===")
-        os.makedirs(LOCAL_MODEL_DIR, exist_ok=True)
         
-        if not initialize_firebase():
+        bucket = get_model_bucket()
+        if bucket is None:
             return False
         
-        bucket = storage.bucket()
-        
-        for filename in REQUIRED_FILES:
-            remote_path = f"{STORAGE_FOLDER}/{filename}"
-            local_path = os.path.join(LOCAL_MODEL_DIR, filename)
-            print(f"  Downloading {filename}...")
-            blob = bucket.blob(remote_path)
-            blob.download_to_filename(local_path)
-            print(f"  ✓ {filename}")
+        manifest = download_model(bucket, folder, model_dir, REQUIRED_FILES,
+                                  workers=MODEL_DOWNLOAD_WORKERS,
+                                  chunk_size=int(MODEL_DOWNLOAD_CHUNK_MB * 1024 * 1024))
         
-        print("✓ All files downloaded\n")
+        print(f"✓ All files downloaded (version {manifest['version']})\n")
         return True
     except Exception as e:
         print(f"✗ Download failed: {e}")
         return False
 
-def load_resources():
-    """Load model and tokenizer"""
-    global model, tokenizer, sentiment_pipeline
+def ensure_model_files(folder, model_dir):
+    """Download the model into model_dir unless a valid copy is cached; returns False if unavailable"""
+    if cache_is_valid(model_dir, REQUIRED_FILES, verify_hashes=VERIFY_MODEL_CACHE):
+        print("Using cached model...")
+        return True
+    
+    print("Downloading from Firebase...")
+    if download_model_from_firebase(folder, model_dir):
+        return True
+    if all(os.path.isfile(os.path.join(model_dir, f)) for f in REQUIRED_FILES):
+        print("⚠ Using unverified local model files")
+        return True
+    print("✗ Model files unavailable")
+    return False
+
+def compute_model_version(model_dir=LOCAL_MODEL_DIR):
+    """Fingerprint the cached model files (MODEL_VERSION env var overrides for the default model)"""
+    if model_dir == LOCAL_MODEL_DIR and os.environ.get('MODEL_VERSION'):
+        return os.environ['MODEL_VERSION']
+    
+    marker = read_version_marker(model_dir)
+    if marker and marker.get('version'):
+        return marker['version']
+    
+    digest = hashlib.sha256()
+    with open(os.path.join(model_dir, 'config.json'), 'rb') as f:
+        digest.update(f.read())
+    
+    # Sample the head and tail of the weights instead of hashing the whole file
+    weights_path = os.path.join(model_dir, 'model.safetensors')
+    size = os.path.getsize(weights_path)
+    digest.update(str(size).encode())
+    with open(weights_path, 'rb') as f:
+        digest.update(f.read(1 << 20))
+        f.seek(max(0, size - (1 << 20)))
+        digest.update(f.read())
+    return digest.hexdigest()[:16]
+
+def special_tokens_template(tok):
+    """Special token ids the tokenizer puts before and after a text, e.g. [CLS] and [SEP]"""
+    with_special = tok('sentiment')['input_ids']
+    content = tok('sentiment', add_special_tokens=False)['input_ids']
+    for start in range(len(with_special) - len(content) + 1):
+        if with_special[start:start + len(content)] == content:
+            return with_special[:start], with_special[start + len(content):]
+    return [], []
+
+def model_label_names(config):
+    """Sentiment name for each class index, from the model's id2label"""
+    names = []
+    for i in range(config.num_labels):
+        raw = str(config.id2label.get(i, i)).lower()
+        names.append(SENTIMENT_MAP.get(raw, raw))
+    return names
+
+def model_dir_for(name):
+    """Local directory of a model version"""
+    if name == DEFAULT_MODEL_NAME:
+        return LOCAL_MODEL_DIR
+    return os.path.join(MODEL_VERSIONS_DIR, name)
+
+def load_model_slot(name, model_dir, backend=None):
+    """Load tokenizer, model and inference backend from model_dir into a ModelSlot"""
+    # Imported here so the web server can start before torch is loaded
+    from transformers import AutoTokenizer, AutoModelForSequenceClassification
+    from inference_backend import TorchBackend, create_backend
+    from mmap_weights import share_model_weights
+    backend = backend or INFERENCE_BACKEND
+    
+    print(f"Loading tokenizer ({name})...")
+    tok = AutoTokenizer.from_pretrained(model_dir, use_fast=True)
+    prefix, suffix = special_tokens_template(tok)
+    if not tok.is_fast:
+        print("⚠ No fast tokenizer available; batch tokenizing will be slower")
+    print("✓ Tokenizer loaded")
+    
+    print(f"Loading model ({name})...")
+    loaded = AutoModelForSequenceClassification.from_pretrained(model_dir)
+    loaded.eval()
+    print("✓ Model loaded")
+    
+    # Only the torch backend serves these weights; the others would just keep the file mapped
+    if MMAP_WEIGHTS and backend == 'torch':
+        try:
+            count = share_model_weights(loaded, os.path.join(model_dir, 'model.safetensors'))
+            print(f"✓ {count} weight tensors memory-mapped")
+        except Exception as e:
+            print(f"⚠ Could not memory-map weights: {e}")
+    
+    version = compute_model_version(model_dir)
+    print(f"✓ Model version {version}")
+    
+    print(f"Creating {backend} backend...")
+    try:
+        export_dir = os.path.join(f"{model_dir}_onnx", version)
+        runner = create_backend(backend, loaded, tok, export_dir, TORCH_NUM_THREADS, compile=TORCH_COMPILE,
+                                onnx_prepack=ONNX_PREPACK_WEIGHTS)
+    except Exception as e:
+        print(f"✗ {backend} backend failed ({e}), falling back to torch")
+        runner = TorchBackend(loaded)
+    print(f"✓ {runner.name} backend ready")
+    
+    # Only the torch backends run the torch model (torch-int8 quantizes it in place); the fp32
+    # reference for /api/backend-parity is reloaded from model_dir when needed
+    slot = ModelSlot(
+        name=name, version=version, model=getattr(runner, 'model', None), tokenizer=tok, backend=runner,
+        special_prefix=prefix, special_suffix=suffix, lowercase=tokenizer_lowercases(tok),
+        label_names=model_label_names(loaded.config),
+        max_sequence_length=min(MAX_SEQUENCE_LENGTH,
+                                getattr(loaded.config, 'max_position_embeddings', MAX_SEQUENCE_LENGTH)),
+        model_dir=model_dir,
+    )
+    del loaded
+    gc.collect()
+    if MODEL_WARMUP:
+        warm_up_model(slot)
+    return slot
+
+def warm_up_model(slot):
+    """Run representative batch shapes through the backend before it serves traffic
+    
+    The first forward passes pay for lazy initialization, allocator growth and,
+    with TORCH_COMPILE, compilation. Shapes go from 16 tokens up to the
+    sequence limit, each as a single review and as a full budgeted batch.
+    """
+    started = time.perf_counter()
+    filler = slot.tokenizer('good', add_special_tokens=False)['input_ids'][:1] or [slot.tokenizer.unk_token_id or 0]
+    fixed = len(slot.special_prefix) + len(slot.special_suffix)
+    
+    def run_shapes():
+        length = 16
+        while True:
+            length = min(length, slot.max_sequence_length)
+            row = slot.special_prefix + filler * max(0, length - fixed) + slot.special_suffix
+            for size in sorted({1, max(1, min(BATCH_SIZE, BATCH_TOKEN_BUDGET // length))}):
+                slot.backend.logits(slot.tokenizer.pad([{'input_ids': row}] * size, return_tensors='pt'))
+            if length >= slot.max_sequence_length:
+                return
+            length *= 4
     
     try:
+        run_shapes()
+    except Exception as e:
+        if getattr(slot.backend, 'compiled', None) is None:
+            raise
+        print(f"⚠ torch.compile failed ({e}), using eager mode")
+        slot.backend.disable_compile()
+        run_shapes()
+    slot.warmup_seconds = time.perf_counter() - started
+    print(f"✓ Warmed up in {slot.warmup_seconds:.1f}s")
+
+def load_model_version(name, spec):
+    """Registry loader: fetch, load and warm up one model version"""
+    print(f"\n=== Loading model version {name} ===")
+    folder = spec.get('folder') or (STORAGE_FOLDER if name == DEFAULT_MODEL_NAME else f"{STORAGE_FOLDER}/{name}")
+    if not ensure_model_files(folder, model_dir_for(name)):
+        raise Exception('Model files unavailable')
+    slot = load_model_slot(name, model_dir_for(name), spec.get('backend'))
+    # Always warm up before a version can receive traffic
+    if slot.warmup_seconds is None:
+        warm_up_model(slot)
+    return slot
+
+def _use_active_model(slot):
+    """Keep the module-level model globals pointing at the active version"""
+    global model, tokenizer, inference_backend, model_version
+    model, tokenizer, inference_backend, model_version = slot.model, slot.tokenizer, slot.backend, slot.version
+
+model_registry = ModelRegistry(os.path.join(MODEL_VERSIONS_DIR, 'registry.json'), DEFAULT_MODEL_NAME,
+                               on_activate=_use_active_model)
+
+def load_resources(backend=None):
+    """Load the default model and tokenizer; returns True once predictions can be served"""
+    global inference_backend, model_load_seconds
+    started = time.perf_counter()
+    
+    try:
+        import torch
+        
         print("\n=== Loading Model ===")
+        if TORCH_NUM_THREADS > 0:
+            torch.set_num_threads(TORCH_NUM_THREADS)
+        if TORCH_INTEROP_THREADS > 0:
+            try:
+                torch.set_num_interop_threads(TORCH_INTEROP_THREADS)
+            except RuntimeError as e:
+                # Only possible before torch starts any inter-op work in this process
+                print(f"⚠ Could not set inter-op threads: {e}")
         
         # Download if needed
-        if not os.path.exists(LOCAL_MODEL_DIR) or len(os.listdir(LOCAL_MODEL_DIR)) < len(REQUIRED_FILES):
-            print("Downloading from Firebase...")
-            if not download_model_from_firebase():
-                print("⚠ Using dummy predictions")
-                return
-        else:
-            print("Using cached model...")
-        
-        # Load model
-        print("Loading tokenizer...")
-        tokenizer = AutoTokenizer.from_pretrained(LOCAL_MODEL_DIR)
-        print("✓ Tokenizer loaded")
+        if not ensure_model_files(STORAGE_FOLDER, LOCAL_MODEL_DIR):
+            return False
         
-        print("Loading model...")
-        model = AutoModelForSequenceClassification.from_pretrained(LOCAL_MODEL_DIR)
-        print("✓ Model loaded")
+        model_registry.add(load_model_slot(DEFAULT_MODEL_NAME, LOCAL_MODEL_DIR, backend))
+        model_registry.activate(DEFAULT_MODEL_NAME)
         
-        print("Creating pipeline...")
-        sentiment_pipeline = pipeline("sentiment-analysis", model=model, tokenizer=tokenizer, device=-1)
-        print("✓ Pipeline ready")
+        model_load_seconds = time.perf_counter() - started
+        print(f"=== Ready! ({model_load_seconds:.1f}s) ===\n")
         
-        print("=== Ready! ===\n")
+        # Bring up the versions in registry.json (and switch the active one) if there are any
+        model_registry.reconcile(load_model_version)
+        return True
     except Exception as e:
         print(f"✗ Loading error: {e}")
-        sentiment_pipeline = None
+        inference_backend = None
+        return False
+
+# Held by the background loader for each attempt. fork() waits for it, so a child never
+# inherits a half-finished load (locks held by the loader thread, half-imported modules)
+load_attempt_lock = threading.Lock()
+_fork_waited = False
+
+def _load_model_until_ready():
+    """Background loader: retry until the model loads"""
+    global model_state, model_error
+    while True:
+        with load_attempt_lock:
+            if load_resources():
+                model_state, model_error = 'ready', None
+                model_ready.set()
+                return
+            model_state, model_error = 'failed', 'Model could not be loaded; retrying'
+        time.sleep(MODEL_LOAD_RETRY_SECONDS)
+        model_state = 'loading'
 
-def predict_sentiment(text):
-    """Predict sentiment"""
-    if sentiment_pipeline is None:
-        return {'sentiment': 'neutral', 'confidence': 0.5, 'scores': {'negative': 0.33, 'neutral': 0.34, 'positive': 0.33}}
+def start_model_loading():
+    """Load the model in the background (default) or before returning"""
+    global model_state, model_error
+    if MODEL_LOADING == 'none':
+        return
+    if MODEL_LOADING == 'sync':
+        if load_resources():
+            model_state = 'ready'
+            model_ready.set()
+        else:
+            model_state, model_error = 'failed', 'Model could not be loaded'
+        return
+    threading.Thread(target=_load_model_until_ready, name='model-loader', daemon=True).start()
+
+def _before_fork():
+    global _fork_waited
+    # The loader itself may fork (e.g. compiler subprocesses) while holding the lock
+    _fork_waited = threading.current_thread().name != 'model-loader'
+    if _fork_waited:
+        load_attempt_lock.acquire()
+
+def _after_fork_in_parent():
+    if _fork_waited:
+        load_attempt_lock.release()
+
+def _after_fork_in_child():
+    """The loader thread does not survive fork(); a child forked before the model was ready starts its own"""
+    global model_state
+    if _fork_waited:
+        load_attempt_lock.release()
+    if MODEL_LOADING == 'background' and not model_ready.is_set():
+        model_state = 'loading'
+        threading.Thread(target=_load_model_until_ready, name='model-loader', daemon=True).start()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(before=_before_fork, after_in_parent=_after_fork_in_parent,
+                        after_in_child=_after_fork_in_child)
+
+def wait_until_ready(timeout=None):
+    """Block until the model is ready; returns False on timeout"""
+    return model_ready.wait(timeout)
+
+def format_prediction(probs, names):
+    """Build the response dict from one review's class probabilities"""
+    scores = dict(zip(names, probs))
+    sentiment = max(scores, key=scores.get)
+    return {'sentiment': sentiment, 'confidence': scores[sentiment], 'scores': scores}
+
+def _split_long(ids, slot):
+    """Fit content token ids into the sequence limit; returns (segments, truncated)"""
+    limit = slot.max_sequence_length - len(slot.special_prefix) - len(slot.special_suffix)
+    if len(ids) <= limit:
+        return [ids], False
+    if LONG_REVIEW_STRATEGY == 'head_tail':
+        return [ids[:limit], ids[-limit:]], True
+    return [ids[:limit]], True
+
+def _token_budget_batches(rows, order, batch_size):
+    """Group row indices (sorted by length) so padded tokens stay within BATCH_TOKEN_BUDGET"""
+    batch = []
+    for r in order:
+        longest = len(rows[r])
+        if batch and (len(batch) >= batch_size or (len(batch) + 1) * longest > BATCH_TOKEN_BUDGET):
+            yield batch
+            batch = []
+        batch.append(r)
+    if batch:
+        yield batch
+
+def supports_embeddings(slot):
+    return hasattr(slot.backend, 'logits_and_embeddings')
+
+def _score_rows(rows, slot, embed=False):
+    """(class probabilities, pooled embeddings or None) for already-tokenized sequences"""
+    import torch
+    with metrics.stage_latency.time(stage='tokenize'):
+        inputs = slot.tokenizer.pad([{'input_ids': row} for row in rows], return_tensors='pt')
+    metrics.batch_size.observe(len(rows))
+    with metrics.stage_latency.time(stage='forward'):
+        if embed and supports_embeddings(slot):
+            logits, embeddings = slot.backend.logits_and_embeddings(inputs)
+            return torch.softmax(logits, dim=-1), embeddings
+        return torch.softmax(slot.backend.logits(inputs), dim=-1), None
+
+def _predict_uncached(texts, batch_size=None, slot=None, embed=False):
+    """Run texts through the model in token-budgeted, length-sorted batches
     
-    try:
-        result = sentiment_pipeline(text)[0]
-        label = result['label'].lower()
-        confidence = result['score']
-        
-        # Map labels
-        sentiment_map = {
-            'positive': 'positive', 'pos': 'positive', 'label_2': 'positive', '2': 'positive',
-            'negative': 'negative', 'neg': 'negative', 'label_0': 'negative', '0': 'negative',
-            'neutral': 'neutral', 'neu': 'neutral', 'label_1': 'neutral', '1': 'neutral'
+    Long reviews are truncated (or split head+tail and averaged) and flagged
+    with 'truncated'. A failing batch is retried one sequence at a time so a bad
+    review only fails itself. With embed, scored results also carry the pooled
+    'embedding' (a unit-length numpy array, averaged over segments) when the
+    backend has one.
+    """
+    import torch
+    
+    slot = slot or model_registry.get()
+    batch_size = batch_size or BATCH_SIZE
+    results = [None] * len(texts)
+    prefix, suffix = slot.special_prefix, slot.special_suffix
+    
+    rows, owners, truncated = [], [], [False] * len(texts)
+    with metrics.stage_latency.time(stage='tokenize'):
+        try:
+            encoded = slot.tokenizer(list(texts), add_special_tokens=False, return_attention_mask=False,
+                                     return_token_type_ids=False)['input_ids']
+        except Exception:
+            encoded = []
+            for i, text in enumerate(texts):
+                try:
+                    encoded.append(slot.tokenizer(text, add_special_tokens=False)['input_ids'])
+                except Exception as e:
+                    encoded.append(None)
+                    results[i] = {'sentiment': 'neutral', 'confidence': 0.0, 'error': str(e)}
+    for i, ids in enumerate(encoded):
+        if ids is None:
+            continue
+        metrics.token_length.observe(len(ids) + len(prefix) + len(suffix))
+        segments, truncated[i] = _split_long(ids, slot)
+        for segment in segments:
+            rows.append(prefix + segment + suffix)
+            owners.append(i)
+    
+    probs = [None] * len(rows)
+    vectors = [None] * len(rows)
+    errors = {}
+    order = sorted(range(len(rows)), key=lambda r: len(rows[r]))
+    for batch in _token_budget_batches(rows, order, batch_size):
+        try:
+            p, e = _score_rows([rows[r] for r in batch], slot, embed)
+            for j, r in enumerate(batch):
+                probs[r] = p[j]
+                vectors[r] = e[j] if e is not None else None
+        except Exception:
+            for r in batch:
+                try:
+                    p, e = _score_rows([rows[r]], slot, embed)
+                    probs[r], vectors[r] = p[0], (e[0] if e is not None else None)
+                except Exception as e:
+                    errors[owners[r]] = str(e)
+    
+    with metrics.stage_latency.time(stage='label_map'):
+        # Average segment probabilities per review in one scatter, then convert to lists once
+        scored = [r for r in range(len(rows)) if probs[r] is not None and owners[r] not in errors]
+        if scored:
+            index = torch.tensor([owners[r] for r in scored])
+            sums = torch.zeros(len(texts), len(slot.label_names)).index_add_(0, index, torch.stack([probs[r].float() for r in scored]))
+            counts = torch.zeros(len(texts)).index_add_(0, index, torch.ones(len(scored)))
+            per_text = (sums / counts.clamp(min=1).unsqueeze(1)).tolist()
+            embedded = None
+            if vectors[scored[0]] is not None:
+                width = vectors[scored[0]].shape[-1]
+                embedded = torch.zeros(len(texts), width).index_add_(0, index, torch.stack([vectors[r].float() for r in scored]))
+                embedded = torch.nn.functional.normalize(embedded / counts.clamp(min=1).unsqueeze(1), dim=1).numpy()
+            for i in sorted(set(index.tolist())):
+                results[i] = format_prediction(per_text[i], slot.label_names)
+                if truncated[i]:
+                    results[i]['truncated'] = True
+                if embedded is not None:
+                    results[i]['embedding'] = embedded[i]
+        for i, error in errors.items():
+            results[i] = {'sentiment': 'neutral', 'confidence': 0.0, 'error': error}
+    
+    return results
+
+def _cache_version(slot):
+    """Results depend on the backend and long-review policy as well as the model"""
+    return f"{slot.version}/{slot.backend.name}/{LONG_REVIEW_STRATEGY}:{slot.max_sequence_length}/r{RESULT_FORMAT_VERSION}"
+
+def _cache_store(text, result, slot):
+    if result_cache is not None and 'error' not in result:
+        result_cache.set(text, _cache_version(slot), result)
+
+def predict_sentiment(text, model_name=None):
+    """Predict sentiment with the active model, or the named loaded version"""
+    return predict_sentiment_batch([text], model_name=model_name)[0]
+
+def predict_sentiment_batch(texts, batch_size=None, model_name=None, embeddings=False):
+    """Predict sentiment for a list of texts, keeping input order
+    
+    Texts are normalized and duplicates collapsed, so each unique text is
+    looked up in the cache and scored at most once. With the embedding index
+    on, near-duplicates of indexed reviews reuse their results next. The rest
+    are tokenized in one call, sorted by token length and run through the
+    model in micro-batches padded only to their longest member, each within
+    BATCH_TOKEN_BUDGET. With embeddings, every result also has the review's
+    pooled 'embedding' as a list (None when the backend cannot produce one).
+    """
+    global deduplicated_reviews
+    if not model_ready.is_set():
+        raise ModelNotReady(model_error or 'Model is loading')
+    if not all(isinstance(text, str) for text in texts):
+        # Non-string texts fail on their own instead of failing the whole batch
+        scored = iter(predict_sentiment_batch([text for text in texts if isinstance(text, str)],
+                                              batch_size, model_name, embeddings))
+        failed = {'sentiment': 'neutral', 'confidence': 0.0, 'error': 'Review text must be a string'}
+        if embeddings:
+            failed['embedding'] = None
+        return [next(scored) if isinstance(text, str) else dict(failed) for text in texts]
+    # Resolve the version once so a swap mid-request cannot mix models
+    slot = model_registry.get(model_name)
+    cache_version = _cache_version(slot)
+    vector_index = embedding_index(slot)
+    
+    unique, index = dedupe([normalize_review(text, TEXT_NORMALIZATION, slot.lowercase) for text in texts])
+    deduplicated_reviews += len(texts) - len(unique)
+    results = [None] * len(unique)
+    vectors = {}
+    
+    misses = []
+    for i, text in enumerate(unique):
+        cached = result_cache.get(text, cache_version) if result_cache is not None else None
+        if cached is not None and embeddings:
+            # A cached result only helps if the index still has its embedding
+            vectors[i] = vector_index.vector_for(text) if vector_index is not None else None
+            if vectors[i] is None:
+                cached = None
+        if cached is not None:
+            results[i] = cached
+        else:
+            misses.append(i)
+    
+    if misses and vector_index is not None and not embeddings:
+        remaining = []
+        for i in misses:
+            near = vector_index.near_duplicate(unique[i])
+            if near is None:
+                remaining.append(i)
+            else:
+                results[i] = near
+                _cache_store(unique[i], near, slot)
+        misses = remaining
+    
+    if misses:
+        # Texts another request is already computing are waited for instead of recomputed;
+        # without an index their embeddings could not be recovered afterwards
+        keys = [(cache_version, unique[i]) for i in misses]
+        position = dict(zip(keys, misses))
+        share = coalescer is not None and (vector_index is not None or not embeddings)
+        owned, waiting = coalescer.claim(keys) if share else (keys, {})
+        error = None
+        try:
+            embed = embeddings or vector_index is not None
+            computed = _predict_uncached([text for _, text in owned], batch_size, slot, embed) if owned else []
+            for key, result in zip(owned, computed):
+                vector = result.pop('embedding', None)
+                if vector is not None:
+                    vectors[position[key]] = vector
+                    if vector_index is not None:
+                        vector_index.add(key[1], vector, result)
+                results[position[key]] = result
+                _cache_store(key[1], result, slot)
+                if share:
+                    coalescer.resolve(key, result)
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            if share:
+                for key in owned:
+                    coalescer.resolve(key, error=error or RuntimeError('Prediction was abandoned'))
+        for key, future in waiting.items():
+            results[position[key]] = future.result()
+            if embeddings:
+                vectors[position[key]] = vector_index.vector_for(key[1])
+    
+    if embeddings:
+        return [{**results[i], 'embedding': vectors[i].tolist() if vectors.get(i) is not None else None}
+                for i in index]
+    return [results[i] for i in index]
+
+embedding_indexes = {}
+embedding_indexes_lock = threading.Lock()
+
+def embedding_index(slot):
+    """The embedding index for a model version, or None when it is off or unsupported"""
+    if not EMBEDDING_INDEX_ENABLED or not supports_embeddings(slot):
+        return None
+    cache_version = _cache_version(slot)
+    with embedding_indexes_lock:
+        vector_index = embedding_indexes.get(cache_version)
+        if vector_index is None:
+            # Results also depend on backend and long-review settings, so those are part of the folder name
+            folder = f"{slot.version}-{hashlib.sha256(cache_version.encode()).hexdigest()[:8]}"
+            vector_index = embedding_indexes[cache_version] = VectorIndex(
+                os.path.join(EMBEDDING_INDEX_DIR, folder), slot.model.config.hidden_size,
+                EMBEDDING_INDEX_MAX_ENTRIES, NEAR_DUPLICATE_BITS, NEAR_DUPLICATE_MIN_CHARS)
+            print(f"✓ Embedding index for {slot.name} ({len(vector_index)} entries)")
+    vector_index.ensure_saver(EMBEDDING_INDEX_SAVE_SECONDS)
+    return vector_index
+
+def save_embedding_indexes():
+    for vector_index in list(embedding_indexes.values()):
+        try:
+            vector_index.save()
+        except Exception as e:
+            print(f"⚠ Could not save embedding index {vector_index.directory}: {e}")
+
+atexit.register(save_embedding_indexes)
+
+def find_similar(text, k=5, model_name=None):
+    """(sentiment result, top-k indexed reviews most similar to text)"""
+    slot = model_registry.get(model_name)
+    vector_index = embedding_index(slot)
+    if vector_index is None:
+        raise ValueError('Similarity search needs EMBEDDING_INDEX_ENABLED=true and a torch backend')
+    result = predict_sentiment_batch([text], model_name=model_name, embeddings=True)[0]
+    vector = result.pop('embedding')
+    if vector is None:
+        return result, []
+    normalized = normalize_review(text, TEXT_NORMALIZATION, slot.lowercase)
+    similar = [{'text': entry['text'], 'similarity': similarity, 'sentiment': entry['result']['sentiment'],
+                'confidence': entry['result']['confidence']}
+               for entry, similarity in vector_index.search(vector, k, exclude_text=normalized)]
+    return result, similar
+
+aspect_patterns = compile_aspects(load_aspects(ASPECT_KEYWORDS_PATH))
+
+def predict_aspects_batch(texts, batch_size=None, model_name=None):
+    """Aspect-level sentiment for a list of texts, keeping input order
+    
+    Every review is split into sentences and contrast clauses. The segments of
+    all reviews are scored in one predict_sentiment_batch call, so repeated
+    segments are deduplicated and cached like whole reviews. Each result has
+    the usual review-level fields plus 'aspects' and 'segments'.
+    """
+    split = [split_segments(text) for text in texts]
+    scored = predict_sentiment_batch([segment for segments in split for segment in segments], batch_size, model_name)
+    
+    results = []
+    start = 0
+    for segments in split:
+        tags = [tag_aspects(segment, aspect_patterns) for segment in segments]
+        results.append(rollup(segments, tags, scored[start:start + len(segments)]))
+        start += len(segments)
+    return results
+
+result_cache = ResultCache(
+    backend=RESULT_CACHE_BACKEND,
+    max_bytes=int(RESULT_CACHE_MAX_MB * 1024 * 1024),
+    ttl=RESULT_CACHE_TTL,
+    path=RESULT_CACHE_PATH
+) if RESULT_CACHE_ENABLED else None
+
+job_manager = JobManager(JOBS_DIR, JOB_WORKERS, JOB_TORCH_THREADS, BATCH_SIZE, JOB_CHUNK_SIZE, JOB_POLL_SECONDS)
+
+metrics.registry.register(metrics.Gauge(
+    'sentiment_model_load_seconds', 'Time taken by load_resources', lambda: model_load_seconds))
+metrics.registry.register(metrics.Gauge(
+    'process_resident_memory_bytes', 'Resident memory of this worker', metrics.resident_memory_bytes))
+metrics.registry.register(metrics.Gauge(
+    'sentiment_deduplicated_reviews_total', 'Reviews answered from a duplicate in the same request',
+    lambda: deduplicated_reviews, kind='counter'))
+metrics.registry.register(metrics.Gauge(
+    'sentiment_result_cache_hits_total', 'Result cache hits',
+    lambda: result_cache.hits if result_cache is not None else None, kind='counter'))
+metrics.registry.register(metrics.Gauge(
+    'sentiment_result_cache_misses_total', 'Result cache misses',
+    lambda: result_cache.misses if result_cache is not None else None, kind='counter'))
+
+rate_limiter = RateLimiter(
+    RATE_LIMIT_REVIEWS_PER_SEC, RATE_LIMIT_BURST, RATE_LIMIT_BACKEND, RATE_LIMIT_PATH
+) if RATE_LIMIT_REVIEWS_PER_SEC > 0 else None
+
+inference_gate = PriorityGate(INFERENCE_CONCURRENCY, SHED_QUEUE_MS) if INFERENCE_CONCURRENCY > 0 else None
+
+coalescer = Coalescer() if COALESCE_INFLIGHT else None
+
+def inference_slot(priority, shed=True):
+    """Context holding an inference slot ('interactive' or 'batch'); may raise Overloaded"""
+    if inference_gate is None:
+        return nullcontext()
+    return inference_gate.enter(priority, shed)
+
+def client_key(api_key, forwarded_for, remote_addr):
+    """Rate limit key: a hash of the API key, else the client IP"""
+    if api_key:
+        return 'key:' + hashlib.sha256(api_key.encode('utf-8')).hexdigest()[:16]
+    if RATE_LIMIT_TRUST_PROXY and forwarded_for:
+        return 'ip:' + forwarded_for.split(',')[0].strip()
+    return f"ip:{remote_addr}"
+
+def _interactive_batch(texts):
+    with inference_slot('interactive'):
+        return predict_sentiment_batch(texts)
+
+micro_batcher = MicroBatcher(_interactive_batch, MICROBATCH_MAX_SIZE, MICROBATCH_MAX_WAIT_MS) if MICROBATCH_ENABLED else None
+
+metrics.registry.register(metrics.Gauge(
+    'sentiment_rate_limited_total', 'Requests rejected by the per-client rate limit',
+    lambda: rate_limiter.limited if rate_limiter is not None else None, kind='counter'))
+metrics.registry.register(metrics.Gauge(
+    'sentiment_shed_total', 'Batch requests shed because the inference queue was slow',
+    lambda: inference_gate.shed if inference_gate is not None else None, kind='counter'))
+metrics.registry.register(metrics.Gauge(
+    'sentiment_coalesced_texts_total', 'Texts answered by another in-flight request',
+    lambda: coalescer.coalesced if coalescer is not None else None, kind='counter'))
+metrics.registry.register(metrics.Gauge(
+    'sentiment_near_duplicate_hits_total', 'Reviews answered from a near-duplicate in the embedding index',
+    lambda: sum(i.near_duplicate_hits for i in list(embedding_indexes.values())) if EMBEDDING_INDEX_ENABLED else None,
+    kind='counter'))
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    job_manager.ensure_runner()
+    if model_ready.is_set():
+        model_registry.ensure_watcher(load_model_version, MODEL_WATCH_SECONDS)
+
+@app.after_request
+def record_request_latency(response):
+    started = g.get('request_started')
+    if started is not None and request.endpoint not in (None, 'metrics_endpoint'):
+        metrics.request_latency.observe(time.perf_counter() - started, endpoint=request.endpoint,
+                                        status=response.status_code)
+    return response
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Prometheus text-format metrics for this worker"""
+    return Response(metrics.registry.render(), mimetype='text/plain; version=0.0.4')
+
+def health_status():
+    """Model, cache and batching status shared by /health in both serving modes"""
+    health = {
+        'status': 'healthy',
+        'ready': model_ready.is_set(),
+        'model_state': model_state,
+        'model_loaded': inference_backend is not None,
+        'pipeline_ready': inference_backend is not None,
+        'backend': inference_backend.name if inference_backend is not None else None,
+        'models': model_registry.info()
+    }
+    if result_cache is not None:
+        health['result_cache'] = result_cache.stats()
+    if micro_batcher is not None:
+        health['micro_batching'] = micro_batcher.stats()
+    if rate_limiter is not None:
+        health['rate_limit'] = rate_limiter.stats()
+    if inference_gate is not None:
+        health['inference_gate'] = inference_gate.stats()
+    if coalescer is not None:
+        health['coalesced_texts'] = coalescer.coalesced
+    if EMBEDDING_INDEX_ENABLED:
+        health['embedding_index'] = {version: i.stats() for version, i in list(embedding_indexes.items())}
+    return health
+
+def readiness():
+    """(payload, status, headers) for the readiness probe and gated routes"""
+    if model_ready.is_set():
+        return {'status': 'ready', 'model_version': model_version}, 200, {}
+    payload = {'success': False, 'status': model_state, 'error': model_error or 'Model is loading'}
+    return payload, 503, {'Retry-After': MODEL_RETRY_AFTER}
+
+def not_ready_response():
+    """503 response while the model is not ready, otherwise None"""
+    if model_ready.is_set():
+        return None
+    payload, status, headers = readiness()
+    return jsonify(payload), status, headers
+
+def runtime_info():
+    """Effective thread, CPU and warm-up settings of this worker"""
+    info = {
+        'pid': os.getpid(),
+        'cpu_count': os.cpu_count(),
+        'cpu_affinity': sorted(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else None,
+        'configured': {
+            'torch_num_threads': TORCH_NUM_THREADS,
+            'torch_interop_threads': TORCH_INTEROP_THREADS,
+            'torch_compile': TORCH_COMPILE,
+            'model_warmup': MODEL_WARMUP,
+        },
+        'models': model_registry.info()['loaded'],
+    }
+    # Only report torch once it is loaded; importing it here would defeat lazy loading
+    torch = sys.modules.get('torch')
+    if torch is not None:
+        info['torch'] = {
+            'version': torch.__version__,
+            'intra_op_threads': torch.get_num_threads(),
+            'inter_op_threads': torch.get_num_interop_threads(),
+            'mkldnn': torch.backends.mkldnn.is_available(),
         }
+    return info
+
+@app.route('/api/runtime', methods=['GET'])
+def runtime_endpoint():
+    return jsonify(runtime_info())
+
+@app.route('/health', methods=['GET'])
+def health_check():
+    return jsonify(health_status())
+
+@app.route('/health/live', methods=['GET'])
+def liveness_check():
+    return jsonify({'status': 'alive'})
+
+@app.route('/health/ready', methods=['GET'])
+def readiness_check():
+    payload, status, headers = readiness()
+    return jsonify(payload), status, headers
+
+def _parity_batches(texts, slot):
+    """Padded, token-budgeted batches of the texts for a parity check"""
+    encoded = slot.tokenizer(list(texts), truncation=True, max_length=slot.max_sequence_length,
+                             return_attention_mask=False, return_token_type_ids=False)['input_ids']
+    order = sorted(range(len(encoded)), key=lambda r: len(encoded[r]))
+    for batch in _token_budget_batches(encoded, order, BATCH_SIZE):
+        yield slot.tokenizer.pad([{'input_ids': encoded[r]} for r in batch], return_tensors='pt')
+
+parity_lock = threading.Lock()
+
+@app.route('/api/backend-parity', methods=['POST'])
+def backend_parity():
+    """Compare the active backend with the fp32 torch model (reloaded unless the backend is torch)"""
+    denied = admin_denied()
+    if denied:
+        return denied
+    not_ready = not_ready_response()
+    if not_ready:
+        return not_ready
+    
+    try:
+        from inference_backend import TorchBackend, parity_check
         
-        sentiment = sentiment_map.get(label, 'neutral')
-        
-        scores = {'negative': 0.0, 'neutral': 0.0, 'positive': 0.0}
-        scores[sentiment] = confidence
-        remaining = (1.0 - confidence) / 2
-        for s in scores:
-            if s != sentiment:
-                scores[s] = remaining
+        data = request.get_json(silent=True) or {}
+        texts = data.get('texts') or PARITY_SAMPLE_REVIEWS
+        if not isinstance(texts, list) or not all(isinstance(t, str) and t for t in texts):
+            return jsonify({'error': 'texts must be a list of non-empty strings'}), 400
+        if len(texts) > PARITY_MAX_TEXTS:
+            return jsonify({'error': f'At most {PARITY_MAX_TEXTS} texts per parity check'}), 400
         
-        return {'sentiment': sentiment, 'confidence': float(confidence), 'scores': scores}
+        slot = model_registry.get(requested_model(data))
+        # One check at a time, so concurrent calls never hold several fp32 copies
+        with parity_lock:
+            if slot.backend.name == 'torch':
+                reference = TorchBackend(slot.model)
+            else:
+                from transformers import AutoModelForSequenceClassification
+                reference = TorchBackend(AutoModelForSequenceClassification.from_pretrained(slot.model_dir).eval())
+            report = parity_check(reference, slot.backend, _parity_batches(texts, slot))
+            del reference
+            gc.collect()
+        return jsonify({'success': True, 'data': report})
+    except InvalidModelName as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except UnknownModel as e:
+        return jsonify({'success': False, 'error': str(e)}), 404
     except Exception as e:
-        return {'sentiment': 'neutral', 'confidence': 0.0, 'error': str(e)}
+        return jsonify({'success': False, 'error': str(e)}), 500
 
-@app.route('/health', methods=['GET'])
-def health_check():
-    return jsonify({
-        'status': 'healthy',
-        'model_loaded': model is not None,
-        'pipeline_ready': sentiment_pipeline is not None
-    })
+def requested_model(data=None):
+    """Model version named by the request ("model" field or X-Model-Version header), if any
+    
+    Raises InvalidModelName (answered with 400) for a malformed name.
+    """
+    if isinstance(data, dict) and data.get('model'):
+        return check_model_name(data['model'])
+    name = request.headers.get('X-Model-Version') or request.args.get('model') or None
+    return name if name is None else check_model_name(name)
+
+def rate_limited(cost):
+    """429 response when the client has used up its review budget, otherwise None"""
+    if rate_limiter is None:
+        return None
+    key = client_key(request.headers.get('X-API-Key'), request.headers.get('X-Forwarded-For'), request.remote_addr)
+    retry_after = rate_limiter.take(key, cost)
+    if not retry_after:
+        return None
+    return jsonify({'success': False, 'error': 'Rate limit exceeded'}), 429, {'Retry-After': str(retry_after)}
+
+def overloaded_response(e):
+    return jsonify({'success': False, 'error': str(e)}), 503, {'Retry-After': str(e.retry_after)}
+
+def wants_compact(data=None):
+    """Compact output requested with "format": "compact" in the body or ?format=compact"""
+    if isinstance(data, dict) and data.get('format'):
+        return data['format'] == 'compact'
+    return request.args.get('format') == 'compact'
+
+def wants_aspects(data=None):
+    """Aspect mode requested with "aspects": true in the body or ?aspects=true"""
+    if isinstance(data, dict) and 'aspects' in data:
+        return data['aspects'] is True
+    return request.args.get('aspects') == 'true'
+
+def wants_embeddings(data=None):
+    """Embeddings requested with "embeddings": true in the body or ?embeddings=true"""
+    if isinstance(data, dict) and 'embeddings' in data:
+        return data['embeddings'] is True
+    return request.args.get('embeddings') == 'true'
+
+def encoded_response(body, mimetype, status=200):
+    """Response for an encoded body, compressed when the client accepts it"""
+    headers = {}
+    if RESPONSE_COMPRESSION:
+        body, headers = serialization.compress(body, request.headers.get('Accept-Encoding'),
+                                               COMPRESSION_MIN_BYTES, COMPRESSION_LEVEL)
+    return Response(body, status=status, mimetype=mimetype, headers=headers)
+
+def json_response(payload, status=200):
+    """JSON response using the fast encoder"""
+    return encoded_response(serialization.dumps(payload), 'application/json', status)
 
 @app.route('/api/analyze-sentiment', methods=['POST'])
 def analyze_sentiment():
+    not_ready = not_ready_response()
+    if not_ready:
+        return not_ready
+    
     try:
-        data = request.get_json()
+        with metrics.stage_latency.time(stage='json_parse'):
+            data = request.get_json()
         if not data or 'text' not in data:
             return jsonify({'error': 'Missing required field: text'}), 400
         
         review_text = data['text']
-        if not review_text or len(review_text.strip()) == 0:
+        if not isinstance(review_text, str) or len(review_text.strip()) == 0:
             return jsonify({'error': 'Review text cannot be empty'}), 400
         
-        result = predict_sentiment(review_text)
-        return jsonify({'success': True, 'data': result, 'original_text': review_text})
+        limited = rate_limited(1)
+        if limited:
+            return limited
+        
+        model_name = requested_model(data)
+        aspects = wants_aspects(data)
+        embeddings = wants_embeddings(data) and not aspects
+        # Requests pinned to a version skip the shared micro-batcher, which serves the active one
+        if micro_batcher is not None and model_name is None and not aspects and not embeddings:
+            result = micro_batcher.predict(review_text)
+        else:
+            with inference_slot('interactive'):
+                if aspects:
+                    result = predict_aspects_batch([review_text], model_name=model_name)[0]
+                else:
+                    result = predict_sentiment_batch([review_text], model_name=model_name, embeddings=embeddings)[0]
+        with metrics.stage_latency.time(stage='serialize'):
+            # Compact output has no place for aspects or embeddings, so those always use the full format
+            if wants_compact(data) and not aspects and not embeddings:
+                response = serialization.compact_result(result)
+            else:
+                response = {'success': True, 'data': result, 'original_text': review_text}
+            if model_name:
+                response['model'] = model_name
+            return json_response(response)
+    except InvalidModelName as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except UnknownModel as e:
+        return jsonify({'success': False, 'error': str(e)}), 404
+    except Overloaded as e:
+        return overloaded_response(e)
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
+def predict_aligned(texts, model_name=None):
+    """One result per text in input order; empty texts are left unscored"""
+    scored = [i for i, text in enumerate(texts) if text.strip()]
+    results = [{'error': 'Review text cannot be empty'}] * len(texts)
+    sentiments = predict_sentiment_batch([texts[i] for i in scored], model_name=model_name)
+    for i, result in zip(scored, sentiments):
+        results[i] = result
+    return results
+
+def batch_analyze_binary():
+    """MessagePack form of /api/batch-analyze for service-to-service callers
+    
+    Texts arrive as one UTF-8 buffer with uint32 offsets, and results go back
+    as packed uint8 labels and float32 scores, so no JSON is parsed or built.
+    Scoring still makes the usual per-review result dicts, which are packed
+    into the arrays at the end. Empty texts keep their position and come back
+    unscored.
+    """
+    with metrics.stage_latency.time(stage='msgpack_parse'):
+        try:
+            texts, ids, options = serialization.decode_msgpack_request(request.get_data())
+        except serialization.BinaryFormatError as e:
+            return jsonify({'error': str(e)}), 400
+    
+    limited = rate_limited(sum(1 for text in texts if text.strip()))
+    if limited:
+        return limited
+    
+    with inference_slot('batch'):
+        results = predict_aligned(texts, requested_model(options))
+    
+    with metrics.stage_latency.time(stage='serialize'):
+        return encoded_response(serialization.encode_msgpack_response(ids, results), serialization.MSGPACK_MIMETYPE)
+
 @app.route('/api/batch-analyze', methods=['POST'])
 def batch_analyze():
+    not_ready = not_ready_response()
+    if not_ready:
+        return not_ready
+    
     try:
-        data = request.get_json()
+        if request.mimetype == serialization.MSGPACK_MIMETYPE:
+            return batch_analyze_binary()
+        
+        with metrics.stage_latency.time(stage='json_parse'):
+            data = request.get_json()
         if not data or 'reviews' not in data:
             return jsonify({'error': 'Missing required field: reviews'}), 400
         
@@ -177,18 +1176,290 @@ def batch_analyze():
         if not isinstance(reviews, list):
             return jsonify({'error': 'Reviews must be a list'}), 400
         
-        results = []
-        for review in reviews:
-            if 'text' in review and review['text']:
-                sentiment_result = predict_sentiment(review['text'])
-                results.append({'id': review.get('id', None), 'sentiment': sentiment_result})
+        valid = [review for review in reviews
+                 if isinstance(review, dict) and isinstance(review.get('text'), str) and review['text']]
+        model_name = requested_model(data)
+        limited = rate_limited(len(valid))
+        if limited:
+            return limited
+        
+        aspects = wants_aspects(data)
+        embeddings = wants_embeddings(data) and not aspects
+        with inference_slot('batch'):
+            texts = [review['text'] for review in valid]
+            if aspects:
+                sentiments = predict_aspects_batch(texts, model_name=model_name)
+            else:
+                sentiments = predict_sentiment_batch(texts, model_name=model_name, embeddings=embeddings)
+        
+        with metrics.stage_latency.time(stage='serialize'):
+            if wants_compact(data) and not aspects and not embeddings:
+                response = serialization.compact_batch([review.get('id', None) for review in valid], sentiments)
+            else:
+                results = [{'id': review.get('id', None), 'sentiment': sentiment_result}
+                           for review, sentiment_result in zip(valid, sentiments)]
+                response = {'success': True, 'count': len(results), 'results': results}
+            if model_name:
+                response['model'] = model_name
+            return json_response(response)
+    except InvalidModelName as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except UnknownModel as e:
+        return jsonify({'success': False, 'error': str(e)}), 404
+    except Overloaded as e:
+        return overloaded_response(e)
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/similar', methods=['POST'])
+def similar_reviews():
+    """Sentiment of a text plus the k most similar reviews in the embedding index"""
+    not_ready = not_ready_response()
+    if not_ready:
+        return not_ready
+    
+    try:
+        data = request.get_json()
+        if not data or not isinstance(data.get('text'), str) or not data['text'].strip():
+            return jsonify({'error': 'Missing required field: text'}), 400
+        k = data.get('k', 5)
+        if not isinstance(k, int) or isinstance(k, bool) or not 1 <= k <= 100:
+            return jsonify({'error': 'k must be an integer between 1 and 100'}), 400
+        
+        limited = rate_limited(1)
+        if limited:
+            return limited
+        
+        model_name = requested_model(data)
+        with inference_slot('interactive'):
+            result, similar = find_similar(data['text'], k, model_name)
+        response = {'success': True, 'data': result, 'similar': similar}
+        if model_name:
+            response['model'] = model_name
+        return json_response(response)
+    except InvalidModelName as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except UnknownModel as e:
+        return jsonify({'success': False, 'error': str(e)}), 404
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except Overloaded as e:
+        return overloaded_response(e)
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+def _ndjson(obj):
+    return serialization.dumps(obj).decode('utf-8') + '\n'
+
+@app.route('/api/batch-analyze-stream', methods=['POST'])
+def batch_analyze_stream():
+    """Score newline-delimited JSON reviews and stream results back as NDJSON
+    
+    Each input line is {"id": ..., "text": ...}. Lines are read incrementally
+    and scored in STREAM_BATCH_SIZE batches, so memory stays flat however
+    large the upload is. Bad lines produce an error line instead of failing
+    the whole stream; the last line is a summary.
+    """
+    not_ready = not_ready_response()
+    if not_ready:
+        return not_ready
+    
+    try:
+        model_name = requested_model()
+        model_registry.get(model_name)
+    except InvalidModelName as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except UnknownModel as e:
+        return jsonify({'success': False, 'error': str(e)}), 404
+    try:
+        if inference_gate is not None:
+            inference_gate.check('batch')
+    except Overloaded as e:
+        return overloaded_response(e)
+    
+    stream = request.stream
+    key = client_key(request.headers.get('X-API-Key'), request.headers.get('X-Forwarded-For'), request.remote_addr)
+    
+    def flush(pending):
+        """NDJSON lines for a batch and how many of its reviews failed"""
+        try:
+            # A stream is slowed down to the client's rate instead of failing part-way
+            while rate_limiter is not None:
+                retry_after = rate_limiter.take(key, len(pending))
+                if not retry_after:
+                    break
+                time.sleep(retry_after)
+            with inference_slot('batch', shed=False):
+                sentiments = predict_sentiment_batch([review['text'] for review in pending], model_name=model_name)
+        except Exception as e:
+            # One failed batch gets error lines; the rest of the stream carries on
+            return ''.join(_ndjson({'id': review.get('id', None), 'error': str(e)}) for review in pending), len(pending)
+        return ''.join(_ndjson({'id': review.get('id', None), 'sentiment': sentiment_result})
+                       for review, sentiment_result in zip(pending, sentiments)), 0
+    
+    def generate():
+        pending = []
+        count = 0
+        errors = 0
+        for line_number, line in enumerate(stream, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                review = json.loads(line)
+            except ValueError as e:
+                errors += 1
+                yield _ndjson({'line': line_number, 'error': f"Invalid JSON: {e}"})
+                continue
+            if not isinstance(review, dict) or not review.get('text'):
+                errors += 1
+                yield _ndjson({'line': line_number, 'error': 'Missing required field: text'})
+                continue
+            if not isinstance(review['text'], str):
+                errors += 1
+                yield _ndjson({'line': line_number, 'error': 'Review text must be a string'})
+                continue
+            
+            pending.append(review)
+            if len(pending) >= STREAM_BATCH_SIZE:
+                lines, failed = flush(pending)
+                yield lines
+                count += len(pending) - failed
+                errors += failed
+                pending = []
+        
+        if pending:
+            lines, failed = flush(pending)
+            yield lines
+            count += len(pending) - failed
+            errors += failed
+        yield _ndjson({'success': True, 'count': count, 'errors': errors})
+    
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+def admin_denied():
+    """403 response unless ADMIN_TOKEN is set and the request carries it"""
+    if not ADMIN_TOKEN:
+        return jsonify({'error': 'Admin routes are disabled; set ADMIN_TOKEN to enable them'}), 403
+    if not hmac.compare_digest(request.headers.get('X-Admin-Token', ''), ADMIN_TOKEN):
+        return jsonify({'error': 'Admin token required'}), 403
+    return None
+
+def valid_model_folder(folder):
+    """True for a relative bucket path under STORAGE_FOLDER (no absolute paths or '..')"""
+    if not isinstance(folder, str) or '\\' in folder or folder.startswith('/'):
+        return False
+    parts = folder.strip('/').split('/')
+    return parts[0] == STORAGE_FOLDER and all(part not in ('', '.', '..') for part in parts)
+
+@app.route('/api/models', methods=['GET'])
+def list_models():
+    """Versions loaded in this worker and the desired state shared by all workers"""
+    return jsonify({'success': True, 'data': {**model_registry.info(), 'desired': model_registry.read_state()}})
+
+@app.route('/api/models', methods=['POST'])
+def deploy_model():
+    """Load a model version in every worker, optionally making it active once warmed up
+    
+    Body: {"name": "v2", "folder": "SentimentAnalysis/v2", "activate": true,
+    "keep_previous": false}. Workers pick the change up within MODEL_WATCH_SECONDS;
+    poll GET /api/models to see when it is loaded.
+    """
+    denied = admin_denied()
+    if denied:
+        return denied
+    
+    data = request.get_json(silent=True) or {}
+    name = data.get('name')
+    if not isinstance(name, str) or not MODEL_NAME_PATTERN.match(name):
+        return jsonify({'error': 'name must be 1-64 letters, digits, ".", "_" or "-"'}), 400
+    
+    if data.get('folder') and not valid_model_folder(data['folder']):
+        return jsonify({'error': f"folder must be a relative path under {STORAGE_FOLDER}/"}), 400
+    spec = {key: data[key] for key in ('folder', 'backend') if data.get(key)}
+    
+    def change(state):
+        if name != DEFAULT_MODEL_NAME or spec:
+            state['models'][name] = spec
+        if data.get('activate', True):
+            previous = state['active']
+            if data.get('keep_previous'):
+                state['models'].setdefault(previous, {})
+            elif previous != name:
+                state['models'].pop(previous, None)
+            state['active'] = name
+    
+    state = model_registry.update_state(change)
+    return jsonify({'success': True, 'data': {'desired': state}}), 202
+
+@app.route('/api/models/<name>', methods=['DELETE'])
+def unload_model(name):
+    """Stop keeping a non-active version loaded"""
+    denied = admin_denied()
+    if denied:
+        return denied
+    if name == model_registry.read_state()['active']:
+        return jsonify({'error': 'Cannot unload the active model; activate another version first'}), 409
+    
+    state = model_registry.update_state(lambda state: state['models'].pop(name, None))
+    return jsonify({'success': True, 'data': {'desired': state}}), 202
+
+@app.route('/api/jobs', methods=['POST'])
+def submit_job():
+    """Queue a bulk sentiment job; body is the same as /api/batch-analyze"""
+    try:
+        data = request.get_json()
+        if not data or 'reviews' not in data:
+            return jsonify({'error': 'Missing required field: reviews'}), 400
+        
+        reviews = data['reviews']
+        if not isinstance(reviews, list):
+            return jsonify({'error': 'Reviews must be a list'}), 400
         
-        return jsonify({'success': True, 'count': len(results), 'results': results})
+        status = job_manager.submit(reviews)
+        return jsonify({'success': True, 'data': status}), 202
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
-# Load model when app starts (for production)
-load_resources()
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    status = job_manager.status(job_id)
+    if status is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify({'success': True, 'data': status})
+
+@app.route('/api/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    status = job_manager.cancel(job_id)
+    if status is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify({'success': True, 'data': status})
+
+@app.route('/api/jobs/<job_id>/results', methods=['GET'])
+def job_results(job_id):
+    """Finished results as NDJSON, or one chunk as JSON with ?chunk=N"""
+    if job_manager.job_dir(job_id) is None:
+        return jsonify({'error': 'Job not found'}), 404
+    
+    paths = job_manager.chunk_paths(job_id)
+    chunk = request.args.get('chunk', type=int)
+    if chunk is not None:
+        if not 0 <= chunk < len(paths):
+            return jsonify({'error': 'Chunk not available yet'}), 404
+        with open(paths[chunk]) as f:
+            results = [json.loads(line) for line in f]
+        return jsonify({'success': True, 'chunk': chunk, 'count': len(results), 'results': results})
+    
+    def generate():
+        for path in paths:
+            with open(path) as f:
+                for line in f:
+                    yield line
+    
+    return Response(generate(), mimetype='application/x-ndjson')
+
+# Start loading the model (in the background unless MODEL_LOADING=sync)
+start_model_loading()
 
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000, debug=True)
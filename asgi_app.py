@@ -0,0 +1,409 @@
+"""
+ASGI serving mode for the sentiment routes
+
+    uvicorn asgi_app:app --workers 2
+
+The event loop only parses requests and writes responses. Inference runs on a
+bounded thread pool:
+  - when ASGI_MAX_PENDING requests are queued or running, new ones get 503 with
+    Retry-After instead of waiting in an unbounded backlog
+  - every request has a deadline (X-Request-Timeout header, default
+    ASGI_REQUEST_TIMEOUT seconds); past it the client gets 504
+  - queued work whose deadline passed or whose client disconnected is dropped
+    before it reaches the model
+Model loading, caching and batching are shared with app.py.
+"""
+
+import asyncio
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs
+
+import app as core
+import serialization
+
+ASGI_INFERENCE_THREADS = int(os.environ.get('ASGI_INFERENCE_THREADS', '2'))
+ASGI_MAX_PENDING = int(os.environ.get('ASGI_MAX_PENDING', '64'))
+ASGI_REQUEST_TIMEOUT = float(os.environ.get('ASGI_REQUEST_TIMEOUT', '30'))
+ASGI_MAX_BODY_MB = float(os.environ.get('ASGI_MAX_BODY_MB', '16'))
+
+
+class DroppedWork(Exception):
+    """Raised for queued work that was abandoned before it started"""
+
+
+class BodyTooLarge(Exception):
+    """Raised when a request body goes over ASGI_MAX_BODY_MB"""
+
+
+class InferenceOffload:
+    """Thread pool with a cap on queued + running work"""
+
+    def __init__(self, threads, max_pending):
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='inference')
+        self.max_pending = max_pending
+        self.pending = 0
+        self.dropped = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def try_submit(self, fn, arg, deadline, abandoned):
+        """Queue fn(arg), or return None when the queue is full"""
+        with self._lock:
+            if self.pending >= self.max_pending:
+                self.rejected += 1
+                return None
+            self.pending += 1
+
+        def run():
+            try:
+                if abandoned.is_set() or time.monotonic() > deadline:
+                    with self._lock:
+                        self.dropped += 1
+                    raise DroppedWork()
+                return fn(arg)
+            finally:
+                with self._lock:
+                    self.pending -= 1
+
+        return asyncio.wrap_future(self.executor.submit(run))
+
+    def stats(self):
+        with self._lock:
+            return {'threads': self.executor._max_workers, 'max_pending': self.max_pending,
+                    'pending': self.pending, 'dropped': self.dropped, 'rejected': self.rejected}
+
+
+offload = InferenceOffload(ASGI_INFERENCE_THREADS, ASGI_MAX_PENDING)
+
+
+def predict_single(args):
+    text, model_name, aspects, embeddings = args
+    if core.micro_batcher is not None and model_name is None and not aspects and not embeddings:
+        return core.micro_batcher.predict(text)
+    with core.inference_slot('interactive'):
+        if aspects:
+            return core.predict_aspects_batch([text], model_name=model_name)[0]
+        return core.predict_sentiment_batch([text], model_name=model_name, embeddings=embeddings)[0]
+
+
+def predict_reviews(args):
+    reviews, model_name, aspects, embeddings = args
+    texts = [review['text'] for review in reviews]
+    with core.inference_slot('batch'):
+        if aspects:
+            sentiments = core.predict_aspects_batch(texts, model_name=model_name)
+        else:
+            sentiments = core.predict_sentiment_batch(texts, model_name=model_name, embeddings=embeddings)
+    return [{'id': review.get('id', None), 'sentiment': sentiment_result}
+            for review, sentiment_result in zip(reviews, sentiments)]
+
+
+def predict_similar(args):
+    text, k, model_name = args
+    with core.inference_slot('interactive'):
+        return core.find_similar(text, k, model_name)
+
+
+def predict_texts(args):
+    texts, model_name = args
+    with core.inference_slot('batch'):
+        return core.predict_aligned(texts, model_name)
+
+
+def _encode_headers(headers):
+    return [(name.lower().encode(), value.encode()) for name, value in headers.items()]
+
+
+async def send_json(send, status, payload, headers=(), accept_encoding=None):
+    await send_body(send, status, serialization.dumps(payload), b'application/json', headers, accept_encoding)
+
+
+async def send_body(send, status, body, content_type, headers=(), accept_encoding=None):
+    if accept_encoding is not None and core.RESPONSE_COMPRESSION:
+        body, extra = serialization.compress(body, accept_encoding, core.COMPRESSION_MIN_BYTES, core.COMPRESSION_LEVEL)
+        headers = [*headers, *_encode_headers(extra)]
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', content_type), (b'content-length', str(len(body)).encode()), *headers],
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def read_body(receive):
+    """Read the request body, or return None when the client went away; may raise BodyTooLarge"""
+    chunks = []
+    size = 0
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return None
+        chunk = message.get('body', b'')
+        size += len(chunk)
+        if size > ASGI_MAX_BODY_MB * 1024 * 1024:
+            raise BodyTooLarge()
+        chunks.append(chunk)
+        if not message.get('more_body'):
+            return b''.join(chunks)
+
+
+def header(scope, name):
+    for key, value in scope.get('headers', []):
+        if key == name:
+            return value.decode('latin-1')
+    return None
+
+
+def requested_model(data, scope):
+    """Model version named by the "model" field or X-Model-Version header, if any"""
+    if isinstance(data, dict) and data.get('model'):
+        return core.check_model_name(data['model'])
+    name = header(scope, b'x-model-version') or None
+    return name if name is None else core.check_model_name(name)
+
+
+def wants_compact(data, scope):
+    """Compact output requested with "format": "compact" in the body or ?format=compact"""
+    if isinstance(data, dict) and data.get('format'):
+        return data['format'] == 'compact'
+    return parse_qs(scope.get('query_string', b'').decode('latin-1')).get('format') == ['compact']
+
+
+def wants_aspects(data, scope):
+    """Aspect mode requested with "aspects": true in the body or ?aspects=true"""
+    if isinstance(data, dict) and 'aspects' in data:
+        return data['aspects'] is True
+    return parse_qs(scope.get('query_string', b'').decode('latin-1')).get('aspects') == ['true']
+
+
+def wants_embeddings(data, scope):
+    """Embeddings requested with "embeddings": true in the body or ?embeddings=true"""
+    if isinstance(data, dict) and 'embeddings' in data:
+        return data['embeddings'] is True
+    return parse_qs(scope.get('query_string', b'').decode('latin-1')).get('embeddings') == ['true']
+
+
+async def rate_limited(send, scope, cost):
+    """Send 429 and return True when the client has used up its review budget"""
+    if core.rate_limiter is None:
+        return False
+    client = scope.get('client') or (None, None)
+    key = core.client_key(header(scope, b'x-api-key'), header(scope, b'x-forwarded-for'), client[0])
+    retry_after = core.rate_limiter.take(key, cost)
+    if not retry_after:
+        return False
+    await send_json(send, 429, {'success': False, 'error': 'Rate limit exceeded'},
+                    headers=[(b'retry-after', str(retry_after).encode())])
+    return True
+
+
+def request_deadline(scope):
+    value = header(scope, b'x-request-timeout')
+    if value is not None:
+        try:
+            return time.monotonic() + min(float(value), ASGI_REQUEST_TIMEOUT)
+        except ValueError:
+            pass
+    return time.monotonic() + ASGI_REQUEST_TIMEOUT
+
+
+async def run_inference(receive, send, fn, arg, deadline):
+    """Offload fn(arg) and wait for it, the deadline or a client disconnect"""
+    abandoned = threading.Event()
+    future = offload.try_submit(fn, arg, deadline, abandoned)
+    if future is None:
+        await send_json(send, 503, {'success': False, 'error': 'Server busy, try again shortly'},
+                        headers=[(b'retry-after', b'1')])
+        return None
+
+    async def watch_disconnect():
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+
+    watcher = asyncio.ensure_future(watch_disconnect())
+    try:
+        done, _ = await asyncio.wait({future, watcher}, timeout=max(0.0, deadline - time.monotonic()),
+                                     return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        watcher.cancel()
+
+    if future not in done:
+        abandoned.set()
+        if watcher in done:
+            return None  # nobody left to answer
+        await send_json(send, 504, {'success': False, 'error': 'Request deadline exceeded'})
+        return None
+    try:
+        return future.result()
+    except DroppedWork:
+        await send_json(send, 504, {'success': False, 'error': 'Request deadline exceeded'})
+        return None
+
+
+async def analyze_sentiment(data, scope, receive, send, deadline):
+    if not data or 'text' not in data:
+        return await send_json(send, 400, {'error': 'Missing required field: text'})
+    review_text = data['text']
+    if not isinstance(review_text, str) or not review_text.strip():
+        return await send_json(send, 400, {'error': 'Review text cannot be empty'})
+
+    if await rate_limited(send, scope, 1):
+        return
+    model_name = requested_model(data, scope)
+    aspects = wants_aspects(data, scope)
+    embeddings = wants_embeddings(data, scope) and not aspects
+    result = await run_inference(receive, send, predict_single, (review_text, model_name, aspects, embeddings), deadline)
+    if result is not None:
+        if wants_compact(data, scope) and not aspects and not embeddings:
+            response = serialization.compact_result(result)
+        else:
+            response = {'success': True, 'data': result, 'original_text': review_text}
+        if model_name:
+            response['model'] = model_name
+        await send_json(send, 200, response, accept_encoding=header(scope, b'accept-encoding'))
+
+
+async def batch_analyze(data, scope, receive, send, deadline):
+    if not data or 'reviews' not in data:
+        return await send_json(send, 400, {'error': 'Missing required field: reviews'})
+    reviews = data['reviews']
+    if not isinstance(reviews, list):
+        return await send_json(send, 400, {'error': 'Reviews must be a list'})
+
+    valid = [review for review in reviews
+             if isinstance(review, dict) and isinstance(review.get('text'), str) and review['text']]
+    if await rate_limited(send, scope, len(valid)):
+        return
+    model_name = requested_model(data, scope)
+    aspects = wants_aspects(data, scope)
+    embeddings = wants_embeddings(data, scope) and not aspects
+    results = await run_inference(receive, send, predict_reviews, (valid, model_name, aspects, embeddings), deadline)
+    if results is not None:
+        if wants_compact(data, scope) and not aspects and not embeddings:
+            response = serialization.compact_batch([r['id'] for r in results], [r['sentiment'] for r in results])
+        else:
+            response = {'success': True, 'count': len(results), 'results': results}
+        if model_name:
+            response['model'] = model_name
+        await send_json(send, 200, response, accept_encoding=header(scope, b'accept-encoding'))
+
+
+async def batch_analyze_binary(body, scope, receive, send, deadline):
+    """MessagePack form of /api/batch-analyze (see core.batch_analyze_binary)"""
+    try:
+        texts, ids, options = serialization.decode_msgpack_request(body)
+    except serialization.BinaryFormatError as e:
+        return await send_json(send, 400, {'error': str(e)})
+
+    if await rate_limited(send, scope, sum(1 for text in texts if text.strip())):
+        return
+    model_name = requested_model(options, scope)
+    if model_name is not None:
+        core.model_registry.get(model_name)
+    results = await run_inference(receive, send, predict_texts, (texts, model_name), deadline)
+    if results is not None:
+        await send_body(send, 200, serialization.encode_msgpack_response(ids, results),
+                        serialization.MSGPACK_MIMETYPE.encode(), accept_encoding=header(scope, b'accept-encoding'))
+
+
+async def similar_reviews(data, scope, receive, send, deadline):
+    if not isinstance(data, dict) or not isinstance(data.get('text'), str) or not data['text'].strip():
+        return await send_json(send, 400, {'error': 'Missing required field: text'})
+    k = data.get('k', 5)
+    if not isinstance(k, int) or isinstance(k, bool) or not 1 <= k <= 100:
+        return await send_json(send, 400, {'error': 'k must be an integer between 1 and 100'})
+
+    if await rate_limited(send, scope, 1):
+        return
+    model_name = requested_model(data, scope)
+    try:
+        found = await run_inference(receive, send, predict_similar, (data['text'], k, model_name), deadline)
+    except ValueError as e:
+        return await send_json(send, 400, {'success': False, 'error': str(e)})
+    if found is not None:
+        result, similar = found
+        response = {'success': True, 'data': result, 'similar': similar}
+        if model_name:
+            response['model'] = model_name
+        await send_json(send, 200, response, accept_encoding=header(scope, b'accept-encoding'))
+
+
+ROUTES = {
+    '/api/analyze-sentiment': analyze_sentiment,
+    '/api/batch-analyze': batch_analyze,
+    '/api/similar': similar_reviews,
+}
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                core.job_manager.ensure_runner()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                offload.executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    if scope['type'] != 'http':
+        return
+    core.job_manager.ensure_runner()
+
+    path, method = scope['path'], scope['method']
+    if path == '/health' and method == 'GET':
+        return await send_json(send, 200, {**core.health_status(), 'offload': offload.stats()})
+    if path == '/api/runtime' and method == 'GET':
+        return await send_json(send, 200, {**core.runtime_info(), 'offload': offload.stats()})
+    if path == '/health/live' and method == 'GET':
+        return await send_json(send, 200, {'status': 'alive'})
+    if path == '/health/ready' and method == 'GET':
+        payload, status, headers = core.readiness()
+        return await send_json(send, status, payload, headers=_encode_headers(headers))
+
+    handler = ROUTES.get(path)
+    if handler is None:
+        return await send_json(send, 404, {'error': 'Not found'})
+    if method != 'POST':
+        return await send_json(send, 405, {'error': 'Method not allowed'})
+    if not core.model_ready.is_set():
+        payload, status, headers = core.readiness()
+        return await send_json(send, status, payload, headers=_encode_headers(headers))
+    core.model_registry.ensure_watcher(core.load_model_version, core.MODEL_WATCH_SECONDS)
+
+    deadline = request_deadline(scope)
+    try:
+        body = await read_body(receive)
+    except BodyTooLarge:
+        return await send_json(send, 413, {'error': f'Request body is larger than {ASGI_MAX_BODY_MB:g} MB'})
+    if body is None:
+        return
+    if not body:
+        return await send_json(send, 400, {'error': 'Request body is empty'})
+    if handler is batch_analyze and (header(scope, b'content-type') or '').split(';')[0].strip() == serialization.MSGPACK_MIMETYPE:
+        handler, data = batch_analyze_binary, body
+    else:
+        try:
+            data = json.loads(body)
+        except ValueError:
+            return await send_json(send, 400, {'error': 'Invalid JSON'})
+
+    try:
+        model_name = requested_model(data, scope)
+        if model_name is not None:
+            core.model_registry.get(model_name)
+        await handler(data, scope, receive, send, deadline)
+    except core.InvalidModelName as e:
+        await send_json(send, 400, {'success': False, 'error': str(e)})
+    except core.UnknownModel as e:
+        await send_json(send, 404, {'success': False, 'error': str(e)})
+    except core.Overloaded as e:
+        await send_json(send, 503, {'success': False, 'error': str(e)},
+                        headers=[(b'retry-after', str(e.retry_after).encode())])
+    except Exception as e:
+        await send_json(send, 500, {'success': False, 'error': str(e)})
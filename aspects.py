@@ -0,0 +1,92 @@
+"""
+Aspect-level sentiment for order reviews
+A review is split into sentences and contrast clauses ("... but ..."). Each
+segment is tagged with the aspects whose keywords it mentions. All segments of
+a request are scored together in one batch, and the segment scores are
+averaged per aspect and, weighted by segment length, for the whole review.
+
+Aspects and keywords come from ASPECT_KEYWORDS_PATH (a JSON object of
+aspect -> keyword list) or DEFAULT_ASPECTS. A keyword also matches its plural
+and -ed/-ing forms ("deliver" matches "delivered").
+"""
+
+import json
+import re
+
+DEFAULT_ASPECTS = {
+    'delivery': ['delivery', 'deliver', 'driver', 'rider', 'courier', 'arrive', 'arrival', 'late', 'on time',
+                 'fast', 'slow', 'quick', 'wait', 'took forever', 'minutes', 'hour'],
+    'food_quality': ['food', 'taste', 'tasty', 'flavor', 'flavour', 'fresh', 'cold', 'hot', 'delicious',
+                     'bland', 'spicy', 'salty', 'sweet', 'portion', 'cooked', 'burger', 'pizza', 'rice',
+                     'chicken', 'noodles', 'coffee', 'meal', 'dish'],
+    'price': ['price', 'cost', 'cheap', 'expensive', 'value', 'worth', 'overpriced', 'affordable', 'fee',
+              'charge', 'refund', 'money'],
+    'packaging': ['packaging', 'package', 'packed', 'container', 'box', 'bag', 'spill', 'leak', 'sealed',
+                  'damaged', 'wrapped'],
+}
+
+# Sentence ends, and clause breaks before contrast words
+_SEGMENT_BREAK = re.compile(r'[.!?;\n]+|,?\s+(?=\b(?:but|however|although|though|whereas|yet|while)\b)',
+                            re.IGNORECASE)
+
+
+def load_aspects(path=None):
+    """Aspect -> keywords from a JSON file, or the defaults"""
+    if not path:
+        return DEFAULT_ASPECTS
+    with open(path) as f:
+        aspects = json.load(f)
+    if not isinstance(aspects, dict) or not all(isinstance(v, list) for v in aspects.values()):
+        raise ValueError(f"{path} must map aspect names to keyword lists")
+    return aspects
+
+
+def compile_aspects(aspects):
+    """One case-insensitive pattern per aspect"""
+    patterns = {}
+    for aspect, keywords in aspects.items():
+        words = '|'.join(re.escape(k.lower()).replace(r'\ ', r'\s+') for k in sorted(keywords, key=len, reverse=True))
+        patterns[aspect] = re.compile(rf"\b(?:{words})(?:s|es|d|ed|ing)?\b", re.IGNORECASE)
+    return patterns
+
+
+def split_segments(text):
+    """Sentences and contrast clauses of a review, without empty pieces"""
+    segments = [s.strip(' ,\t') for s in _SEGMENT_BREAK.split(text)]
+    segments = [s for s in segments if any(c.isalnum() for c in s)]
+    return segments or [text]
+
+
+def tag_aspects(segment, patterns):
+    return [aspect for aspect, pattern in patterns.items() if pattern.search(segment)]
+
+
+def _average(results, weights):
+    """Weighted mean of prediction dicts as one prediction dict"""
+    labels = list(results[0]['scores'])
+    total = sum(weights)
+    scores = {label: sum(r['scores'][label] * w for r, w in zip(results, weights)) / total for label in labels}
+    sentiment = max(scores, key=scores.get)
+    return {'sentiment': sentiment, 'confidence': scores[sentiment], 'scores': scores}
+
+
+def rollup(segments, tags, results):
+    """Review-level result with per-aspect sentiment, from scored segments"""
+    scored = [(s, t, r) for s, t, r in zip(segments, tags, results) if 'error' not in r]
+    if not scored:
+        return {'sentiment': 'neutral', 'confidence': 0.0, 'error': results[0].get('error', 'No scorable text'),
+                'aspects': {}, 'segments': []}
+
+    review = _average([r for _, _, r in scored], [len(s) for s, _, _ in scored])
+    if any(r.get('truncated') for _, _, r in scored):
+        review['truncated'] = True
+
+    by_aspect = {}
+    for _, segment_tags, result in scored:
+        for aspect in segment_tags:
+            by_aspect.setdefault(aspect, []).append(result)
+    review['aspects'] = {aspect: {**_average(found, [1] * len(found)), 'mentions': len(found)}
+                         for aspect, found in by_aspect.items()}
+    review['segments'] = [{'text': s, 'aspects': t, 'sentiment': r['sentiment'], 'confidence': r['confidence']}
+                          for s, t, r in scored]
+    return review
@@ -0,0 +1,147 @@
+"""
+Dynamic micro-batching for single-review predictions
+Collects concurrent requests into one forward pass (use with threaded workers,
+e.g. gunicorn --threads 8). Coalescer lets concurrent requests that need the
+same uncached text share one computation.
+"""
+
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+
+class MicroBatcher:
+    """Queue that groups concurrent predictions into batches"""
+
+    def __init__(self, predict_batch_fn, max_batch_size=16, max_wait_ms=5.0):
+        self.predict_batch_fn = predict_batch_fn
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._worker = None
+        self._worker_pid = None
+        self._stats = {
+            'batches': 0,
+            'items': 0,
+            'batch_sizes': {},
+            'queue_wait_ms_total': 0.0,
+            'queue_wait_ms_max': 0.0,
+        }
+
+    def _ensure_worker(self):
+        """Start the batching thread (again after a fork)"""
+        with self._lock:
+            if self._worker is not None and self._worker_pid == os.getpid() and self._worker.is_alive():
+                return
+            self._queue = queue.Queue()
+            self._worker_pid = os.getpid()
+            self._worker = threading.Thread(target=self._run, name='micro-batcher', daemon=True)
+            self._worker.start()
+
+    def submit(self, text):
+        """Queue a text and return a Future for its result"""
+        self._ensure_worker()
+        future = Future()
+        self._queue.put((text, future, time.perf_counter()))
+        return future
+
+    def predict(self, text, timeout=None):
+        """Queue a text and wait for its result"""
+        return self.submit(text).result(timeout=timeout)
+
+    def _collect(self):
+        """Block for the first item, then gather until full or the wait expires"""
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                if remaining <= 0:
+                    batch.append(self._queue.get_nowait())
+                else:
+                    batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            started = time.perf_counter()
+            self._record(len(batch), [(started - queued) * 1000.0 for _, _, queued in batch])
+
+            texts = [text for text, _, _ in batch]
+            try:
+                results = self.predict_batch_fn(texts)
+            except Exception as e:
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+
+            for (_, future, _), result in zip(batch, results):
+                future.set_result(result)
+
+    def _record(self, size, waits_ms):
+        with self._lock:
+            self._stats['batches'] += 1
+            self._stats['items'] += size
+            self._stats['batch_sizes'][size] = self._stats['batch_sizes'].get(size, 0) + 1
+            self._stats['queue_wait_ms_total'] += sum(waits_ms)
+            self._stats['queue_wait_ms_max'] = max(self._stats['queue_wait_ms_max'], max(waits_ms))
+
+    def stats(self):
+        """Return batch-size and queue-wait metrics"""
+        with self._lock:
+            items = self._stats['items']
+            batches = self._stats['batches']
+            return {
+                'max_batch_size': self.max_batch_size,
+                'max_wait_ms': self.max_wait * 1000.0,
+                'queue_depth': self._queue.qsize(),
+                'batches': batches,
+                'items': items,
+                'avg_batch_size': items / batches if batches else 0.0,
+                'batch_sizes': {str(k): v for k, v in sorted(self._stats['batch_sizes'].items())},
+                'avg_queue_wait_ms': self._stats['queue_wait_ms_total'] / items if items else 0.0,
+                'max_queue_wait_ms': self._stats['queue_wait_ms_max'],
+            }
+
+
+class Coalescer:
+    """Tracks in-flight keys so concurrent callers compute each one once
+
+    claim() splits keys into those the caller must compute (and later resolve)
+    and Futures for keys another caller is already computing. Callers compute
+    everything they own before waiting on others, so waits cannot deadlock.
+    """
+
+    def __init__(self):
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self.coalesced = 0
+
+    def claim(self, keys):
+        owned, waiting = [], {}
+        with self._lock:
+            for key in keys:
+                future = self._inflight.get(key)
+                if future is None:
+                    self._inflight[key] = Future()
+                    owned.append(key)
+                else:
+                    waiting[key] = future
+            self.coalesced += len(waiting)
+        return owned, waiting
+
+    def resolve(self, key, result=None, error=None):
+        with self._lock:
+            future = self._inflight.pop(key, None)
+        if future is None:
+            return
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
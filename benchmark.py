@@ -0,0 +1,275 @@
+"""
+Latency/throughput benchmark for the sentiment API
+Runs /api/analyze-sentiment and /api/batch-analyze against synthetic review
+corpora at several batch sizes and concurrency levels, in-process (Flask test
+client) or over HTTP, and writes the results as JSON for comparing versions.
+
+Examples:
+    python benchmark.py --tiny-model                      # offline, random tiny model
+    python benchmark.py --url http://localhost:5000       # running server
+    python benchmark.py --tiny-model --compare old.json   # show change against a previous run
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+WORDS = (
+    "the food was great good bad terrible amazing delivery late fast slow cold hot fresh "
+    "order rider driver packaging price cheap expensive value portion taste service friendly "
+    "rude app refund missing item spicy salty sweet burger pizza rice chicken noodles coffee "
+    "again never always will would recommend love hate okay fine but and or very really not"
+).split()
+
+# Words per review for each corpus
+CORPORA = {
+    'short': lambda rng: rng.randint(2, 12),
+    'mixed': lambda rng: min(400, max(2, int(rng.lognormvariate(3.0, 0.9)))),
+    'long': lambda rng: rng.randint(80, 300),
+}
+
+
+def make_corpus(kind, size, seed=0):
+    """Deterministic synthetic reviews"""
+    rng = random.Random(f"{kind}-{seed}")
+    return [' '.join(rng.choice(WORDS) for _ in range(CORPORA[kind](rng))) for _ in range(size)]
+
+
+def build_tiny_model(model_dir):
+    """Save a randomly initialized 2-layer BERT classifier with a word-level vocab"""
+    from transformers import BertConfig, BertForSequenceClassification, BertTokenizerFast
+    from model_download import VERSION_MARKER, build_manifest
+
+    os.makedirs(model_dir, exist_ok=True)
+    vocab = ['[PAD]', '[UNK]', '[CLS]', '[SEP]', '[MASK]'] + sorted(set(WORDS))
+    vocab_path = os.path.join(model_dir, 'vocab.txt')
+    with open(vocab_path, 'w') as f:
+        f.write('\n'.join(vocab))
+
+    tokenizer = BertTokenizerFast(vocab_path)
+    config = BertConfig(
+        vocab_size=len(vocab), hidden_size=64, num_hidden_layers=2, num_attention_heads=2,
+        intermediate_size=128, max_position_embeddings=512, num_labels=3,
+        id2label={0: 'negative', 1: 'neutral', 2: 'positive'},
+        label2id={'negative': 0, 'neutral': 1, 'positive': 2},
+    )
+    BertForSequenceClassification(config).save_pretrained(model_dir)
+    tokenizer.save_pretrained(model_dir)
+    special_tokens_path = os.path.join(model_dir, 'special_tokens_map.json')
+    if not os.path.exists(special_tokens_path):
+        with open(special_tokens_path, 'w') as f:
+            json.dump({}, f)
+
+    filenames = ['config.json', 'model.safetensors', 'tokenizer.json',
+                 'tokenizer_config.json', 'special_tokens_map.json', 'vocab.txt']
+    with open(os.path.join(model_dir, VERSION_MARKER), 'w') as f:
+        json.dump(build_manifest(model_dir, filenames, version='tiny-random'), f)
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct / 100.0 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def peak_rss_mb():
+    # ru_maxrss is KB on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+class InProcessClient:
+    def __init__(self):
+        import app
+        self.app = app
+        self._local = threading.local()
+
+    def post(self, path, payload):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = self.app.app.test_client()
+        response = client.post(path, json=payload)
+        if response.status_code != 200:
+            raise Exception(f"{path} returned {response.status_code}")
+        return response.get_json()
+
+    def memory(self):
+        return {'peak_rss_mb': peak_rss_mb()}
+
+    def info(self):
+        return {'model_version': self.app.model_version, 'backend': getattr(self.app.inference_backend, 'name', None)}
+
+
+class HttpClient:
+    def __init__(self, url):
+        self.url = url.rstrip('/')
+
+    def post(self, path, payload):
+        request = urllib.request.Request(
+            self.url + path, data=json.dumps(payload).encode(),
+            headers={'Content-Type': 'application/json'}, method='POST'
+        )
+        with urllib.request.urlopen(request, timeout=300) as response:
+            return json.loads(response.read())
+
+    def memory(self):
+        """RSS of the server worker that answers /metrics (this process would only measure the client)"""
+        try:
+            with urllib.request.urlopen(self.url + '/metrics', timeout=30) as response:
+                for line in response.read().decode().splitlines():
+                    if line.startswith('process_resident_memory_bytes'):
+                        return {'server_rss_mb': float(line.split()[-1]) / (1024 * 1024)}
+        except Exception as e:
+            print(f"⚠ Could not read server memory from /metrics: {e}")
+        return {}
+
+    def info(self):
+        with urllib.request.urlopen(self.url + '/health', timeout=30) as response:
+            health = json.loads(response.read())
+        return {'backend': health.get('backend'), 'health': health}
+
+
+def run_case(client, endpoint, texts, batch_size, concurrency):
+    """Send the corpus as requests of batch_size reviews from concurrency threads"""
+    if endpoint == 'analyze':
+        calls = [('/api/analyze-sentiment', {'text': text}, 1) for text in texts]
+    else:
+        calls = [
+            ('/api/batch-analyze', {'reviews': [{'id': i + j, 'text': t} for j, t in enumerate(texts[i:i + batch_size])]},
+             len(texts[i:i + batch_size]))
+            for i in range(0, len(texts), batch_size)
+        ]
+
+    def send(item):
+        path, payload, _ = item
+        started = time.perf_counter()
+        client.post(path, payload)
+        return (time.perf_counter() - started) * 1000.0
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        latencies = sorted(executor.map(send, calls))
+    elapsed = time.perf_counter() - started
+
+    reviews = sum(count for _, _, count in calls)
+    return {
+        'requests': len(calls),
+        'reviews': reviews,
+        'seconds': elapsed,
+        'p50_ms': percentile(latencies, 50),
+        'p95_ms': percentile(latencies, 95),
+        'p99_ms': percentile(latencies, 99),
+        'mean_ms': sum(latencies) / len(latencies) if latencies else 0.0,
+        'reviews_per_sec': reviews / elapsed if elapsed else 0.0,
+        **client.memory(),
+    }
+
+
+def run_key(run):
+    return (run['endpoint'], run['corpus'], run['batch_size'], run['concurrency'])
+
+
+def compare(previous_path, runs):
+    """Print throughput and p95 changes against a previous results file"""
+    with open(previous_path) as f:
+        previous = {run_key(run): run for run in json.load(f)['runs']}
+    print(f"\nComparison with {previous_path}:")
+    for run in runs:
+        old = previous.get(run_key(run))
+        if old is None:
+            continue
+        throughput = (run['reviews_per_sec'] / old['reviews_per_sec'] - 1) * 100 if old['reviews_per_sec'] else 0.0
+        p95 = (run['p95_ms'] / old['p95_ms'] - 1) * 100 if old['p95_ms'] else 0.0
+        print(f"  {run['endpoint']:8} {run['corpus']:6} b={run['batch_size']:<4} c={run['concurrency']:<3} "
+              f"throughput {throughput:+6.1f}%  p95 {p95:+6.1f}%")
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except Exception:
+        return None
+
+
+def parse_list(value, cast=int):
+    return [cast(v) for v in value.split(',') if v]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the sentiment API')
+    parser.add_argument('--url', help='Benchmark a running server instead of the app in-process')
+    parser.add_argument('--tiny-model', action='store_true', help='Use a randomly initialized tiny model (offline)')
+    parser.add_argument('--endpoints', default='analyze,batch', type=lambda v: parse_list(v, str))
+    parser.add_argument('--corpora', default='short,mixed,long', type=lambda v: parse_list(v, str))
+    parser.add_argument('--reviews', type=int, default=256, help='Reviews per case')
+    parser.add_argument('--batch-sizes', default='8,32,128', type=parse_list)
+    parser.add_argument('--concurrency', default='1,4', type=parse_list)
+    parser.add_argument('--with-cache', action='store_true', help='Keep the result cache enabled (in-process only)')
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--compare', help='Previous results file to compare against')
+    args = parser.parse_args()
+
+    if args.url:
+        client = HttpClient(args.url)
+    else:
+        if not args.with_cache:
+            os.environ['RESULT_CACHE_ENABLED'] = 'false'
+        if args.tiny_model:
+            model_dir = os.path.join(tempfile.mkdtemp(prefix='tiny-model-'), 'model')
+            print(f"Building tiny random model in {model_dir}...")
+            build_tiny_model(model_dir)
+            os.environ['LOCAL_MODEL_DIR'] = model_dir
+        os.environ['MODEL_LOADING'] = 'sync'
+        client = InProcessClient()
+
+    runs = []
+    for corpus in args.corpora:
+        texts = make_corpus(corpus, args.reviews)
+        for endpoint in args.endpoints:
+            batch_sizes = [1] if endpoint == 'analyze' else args.batch_sizes
+            for batch_size in batch_sizes:
+                for concurrency in args.concurrency:
+                    client.post('/api/analyze-sentiment', {'text': texts[0]})  # warm up
+                    result = run_case(client, endpoint, texts, batch_size, concurrency)
+                    run = {'endpoint': endpoint, 'corpus': corpus, 'batch_size': batch_size,
+                           'concurrency': concurrency, **result}
+                    runs.append(run)
+                    rss = run.get('peak_rss_mb', run.get('server_rss_mb'))
+                    print(f"  {endpoint:8} {corpus:6} b={batch_size:<4} c={concurrency:<3} "
+                          f"p50 {run['p50_ms']:8.1f} ms  p95 {run['p95_ms']:8.1f} ms  p99 {run['p99_ms']:8.1f} ms  "
+                          f"{run['reviews_per_sec']:8.1f} reviews/s  rss {'-' if rss is None else f'{rss:.0f} MB'}")
+
+    results = {
+        'meta': {
+            'timestamp': time.time(),
+            'git_commit': git_commit(),
+            'mode': 'http' if args.url else 'in-process',
+            'tiny_model': args.tiny_model,
+            'python': platform.python_version(),
+            'cpu_count': os.cpu_count(),
+            **client.info(),
+        },
+        'runs': runs,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"\n✓ Results written to {args.output}")
+
+    if args.compare:
+        compare(args.compare, runs)
+
+
+if __name__ == '__main__':
+    main()
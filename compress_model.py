@@ -0,0 +1,329 @@
+"""
+Offline compression of the serving model
+Builds a smaller sequence classifier from an existing model folder (by default
+the cached model in LOCAL_MODEL_DIR) and saves it in the same REQUIRED_FILES
+layout, so load_resources can serve it unchanged.
+
+Methods:
+  - distill: keep --layers evenly spaced encoder layers of the teacher
+  - prune: drop the least active feed-forward neurons in every layer,
+    keeping --keep-ffn of them (measured on the labeled file)
+
+Either way the student is then trained on a labeled review file against the
+teacher's softened predictions plus the true labels. A held-out part of the
+file is used to report accuracy for teacher and student next to their
+forward-pass latency on the benchmark corpus.
+
+Examples:
+    python compress_model.py labeled.csv small_model --layers 3
+    python compress_model.py labeled.jsonl pruned_model --method prune --keep-ffn 0.5 --label-column rating
+"""
+
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import time
+
+# The app module is only used for its settings and file helpers here
+os.environ['MODEL_LOADING'] = 'none'
+import app
+from benchmark import make_corpus, percentile
+from model_download import VERSION_MARKER, build_manifest
+from score_file import read_records
+
+# Files taken over from the source model as they are
+TOKENIZER_FILES = [f for f in app.REQUIRED_FILES if f not in ('config.json', 'model.safetensors')]
+
+
+def load_labeled(path, text_column, label_column, label2id):
+    """(texts, label ids) from a CSV/JSONL/Parquet file; labels are names or indices"""
+    names = {name.lower(): index for name, index in label2id.items()}
+    texts, labels = [], []
+    for row in read_records(path, text_column, label_column, 1000):
+        text, label = row.get(text_column), row.get(label_column)
+        if not isinstance(text, str) or not text.strip() or label is None or label == '':
+            continue
+        label = str(label).strip()
+        if label.lower() in names:
+            labels.append(names[label.lower()])
+        elif label.isdigit() and int(label) < len(label2id):
+            labels.append(int(label))
+        else:
+            raise SystemExit(f"Unknown label {label!r} (expected one of {', '.join(label2id)} or an index)")
+        texts.append(text)
+    return texts, labels
+
+
+def encoder_layers(model):
+    """The ModuleList of transformer layers (BERT/RoBERTa-style or DistilBERT)"""
+    base = getattr(model, model.base_model_prefix)
+    for path in ('encoder.layer', 'transformer.layer'):
+        module = base
+        for attr in path.split('.'):
+            module = getattr(module, attr, None)
+        if module is not None:
+            return module
+    raise SystemExit(f"Unsupported architecture for compression: {type(model).__name__}")
+
+
+def ffn_pair(layer):
+    """(input, output) Linear modules of a layer's feed-forward block"""
+    if hasattr(layer, 'intermediate'):
+        return layer.intermediate.dense, layer.output.dense
+    return layer.ffn.lin1, layer.ffn.lin2
+
+
+def distill_layers(model, count):
+    """Keep count evenly spaced layers, always including the last one"""
+    import torch
+    layers = encoder_layers(model)
+    total = len(layers)
+    if not 0 < count < total:
+        raise SystemExit(f"--layers must be between 1 and {total - 1}")
+    keep = [round((i + 1) * total / count) - 1 for i in range(count)]
+    layers_parent = getattr(model, model.base_model_prefix)
+    container = layers_parent.encoder if hasattr(layers_parent, 'encoder') else layers_parent.transformer
+    container.layer = torch.nn.ModuleList(layers[i] for i in keep)
+    model.config.num_hidden_layers = count
+    return keep
+
+
+def ffn_importance(model, tokenizer, texts, max_length, batch_size):
+    """Mean absolute activation of every feed-forward neuron, per layer"""
+    import torch
+    totals = [None] * len(encoder_layers(model))
+    hooks = []
+
+    def record(index):
+        def hook(module, inputs, output):
+            activity = output.detach().abs().sum(dim=(0, 1))
+            totals[index] = activity if totals[index] is None else totals[index] + activity
+        return hook
+
+    for index, layer in enumerate(encoder_layers(model)):
+        hooks.append(ffn_pair(layer)[0].register_forward_hook(record(index)))
+    try:
+        with torch.inference_mode():
+            for start in range(0, len(texts), batch_size):
+                model(**tokenizer(texts[start:start + batch_size], padding=True, truncation=True,
+                                  max_length=max_length, return_tensors='pt'))
+    finally:
+        for hook in hooks:
+            hook.remove()
+    return totals
+
+
+def prune_ffn(model, importance, keep_fraction):
+    """Keep the same number of most active feed-forward neurons in every layer"""
+    import torch
+    inner, _ = ffn_pair(encoder_layers(model)[0])
+    keep = max(1, int(round(inner.out_features * keep_fraction)))
+    for layer, scores in zip(encoder_layers(model), importance):
+        first, second = ffn_pair(layer)
+        index = torch.topk(scores, keep).indices.sort().values
+        pruned_first = torch.nn.Linear(first.in_features, keep)
+        pruned_first.weight.data = first.weight.data[index].clone()
+        pruned_first.bias.data = first.bias.data[index].clone()
+        pruned_second = torch.nn.Linear(keep, second.out_features)
+        pruned_second.weight.data = second.weight.data[:, index].clone()
+        pruned_second.bias.data = second.bias.data.clone()
+        if hasattr(layer, 'intermediate'):
+            layer.intermediate.dense, layer.output.dense = pruned_first, pruned_second
+        else:
+            layer.ffn.lin1, layer.ffn.lin2 = pruned_first, pruned_second
+    # BERT-style configs call it intermediate_size, DistilBERT hidden_dim
+    setattr(model.config, 'intermediate_size' if hasattr(model.config, 'intermediate_size') else 'hidden_dim', keep)
+    return keep
+
+
+def logits_for(model, tokenizer, texts, max_length, batch_size):
+    import torch
+    model.eval()
+    outputs = []
+    with torch.inference_mode():
+        for start in range(0, len(texts), batch_size):
+            encoded = tokenizer(texts[start:start + batch_size], padding=True, truncation=True,
+                                max_length=max_length, return_tensors='pt')
+            outputs.append(model(**encoded).logits)
+    return torch.cat(outputs)
+
+
+def train_student(student, tokenizer, texts, labels, teacher_logits, args):
+    """Distillation: KL to the teacher's softened outputs plus cross-entropy on labels"""
+    import torch
+    import torch.nn.functional as F
+    optimizer = torch.optim.AdamW(student.parameters(), lr=args.learning_rate)
+    labels = torch.tensor(labels)
+    order = list(range(len(texts)))
+    rng = random.Random(args.seed)
+    t = args.temperature
+    for epoch in range(args.epochs):
+        student.train()
+        rng.shuffle(order)
+        total = 0.0
+        for start in range(0, len(order), args.batch_size):
+            batch = order[start:start + args.batch_size]
+            encoded = tokenizer([texts[i] for i in batch], padding=True, truncation=True,
+                                max_length=args.max_length, return_tensors='pt')
+            logits = student(**encoded).logits
+            soft = F.kl_div(F.log_softmax(logits / t, dim=-1), F.softmax(teacher_logits[batch] / t, dim=-1),
+                            reduction='batchmean') * t * t
+            loss = args.alpha * soft + (1 - args.alpha) * F.cross_entropy(logits, labels[batch])
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+            total += loss.item() * len(batch)
+        print(f"  epoch {epoch + 1}/{args.epochs}: loss {total / len(order):.4f}")
+    student.eval()
+
+
+def evaluate(model, tokenizer, texts, labels, max_length, batch_size, reference=None):
+    """Accuracy on texts, and agreement with reference predictions when given"""
+    predicted = logits_for(model, tokenizer, texts, max_length, batch_size).argmax(dim=-1).tolist()
+    result = {'accuracy': sum(p == y for p, y in zip(predicted, labels)) / len(labels) if labels else 0.0}
+    if reference is not None:
+        result['teacher_agreement'] = sum(p == r for p, r in zip(predicted, reference)) / len(reference)
+    return result, predicted
+
+
+def measure_latency(model, tokenizer, reviews, max_length):
+    """Forward-pass latency on the benchmark's mixed corpus at batch size 1 and 32"""
+    import torch
+    texts = make_corpus('mixed', reviews)
+    result = {}
+    with torch.inference_mode():
+        for batch_size in (1, 32):
+            timings = []
+            started = time.perf_counter()
+            for start in range(0, len(texts), batch_size):
+                encoded = tokenizer(texts[start:start + batch_size], padding=True, truncation=True,
+                                    max_length=max_length, return_tensors='pt')
+                t0 = time.perf_counter()
+                model(**encoded)
+                timings.append((time.perf_counter() - t0) * 1000.0)
+            elapsed = time.perf_counter() - started
+            timings.sort()
+            result[f"b{batch_size}_p50_ms"] = percentile(timings, 50)
+            result[f"b{batch_size}_p95_ms"] = percentile(timings, 95)
+            result[f"b{batch_size}_reviews_per_sec"] = len(texts) / elapsed
+    return result
+
+
+def save_model(student, source_dir, output_dir, method):
+    """Write the student in the REQUIRED_FILES layout with a version marker"""
+    os.makedirs(output_dir, exist_ok=True)
+    student.save_pretrained(output_dir, safe_serialization=True)
+    for filename in TOKENIZER_FILES:
+        shutil.copyfile(os.path.join(source_dir, filename), os.path.join(output_dir, filename))
+    manifest = build_manifest(output_dir, app.REQUIRED_FILES)
+    manifest['version'] = f"{method}-{manifest['version']}"
+    with open(os.path.join(output_dir, VERSION_MARKER), 'w') as f:
+        json.dump(manifest, f)
+    return manifest['version']
+
+
+def model_summary(model, model_dir=None):
+    summary = {'layers': len(encoder_layers(model)), 'parameters': sum(p.numel() for p in model.parameters())}
+    if model_dir:
+        summary['size_mb'] = os.path.getsize(os.path.join(model_dir, 'model.safetensors')) / (1024 * 1024)
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Distill or prune the serving model into a smaller one')
+    parser.add_argument('labeled', help='CSV, JSONL or Parquet file of labeled reviews')
+    parser.add_argument('output', help='Folder for the compressed model')
+    parser.add_argument('--model-dir', default=app.LOCAL_MODEL_DIR, help='Teacher model folder (default: LOCAL_MODEL_DIR)')
+    parser.add_argument('--method', choices=('distill', 'prune'), default='distill')
+    parser.add_argument('--layers', type=int, default=None, help='Encoder layers to keep when distilling (default: half)')
+    parser.add_argument('--keep-ffn', type=float, default=0.5, help='Fraction of feed-forward neurons kept when pruning')
+    parser.add_argument('--text-column', default='text')
+    parser.add_argument('--label-column', default='label')
+    parser.add_argument('--eval-fraction', type=float, default=0.2, help='Share of the file held out for accuracy')
+    parser.add_argument('--epochs', type=int, default=3)
+    parser.add_argument('--batch-size', type=int, default=16)
+    parser.add_argument('--learning-rate', type=float, default=5e-5)
+    parser.add_argument('--temperature', type=float, default=2.0, help='Softmax temperature for the teacher targets')
+    parser.add_argument('--alpha', type=float, default=0.5, help='Weight of the teacher loss against the label loss')
+    parser.add_argument('--max-length', type=int, default=app.MAX_SEQUENCE_LENGTH)
+    parser.add_argument('--benchmark-reviews', type=int, default=256, help='Benchmark corpus size for latency')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    import torch
+    from transformers import AutoModelForSequenceClassification, AutoTokenizer
+    torch.manual_seed(args.seed)
+    if app.TORCH_NUM_THREADS > 0:
+        torch.set_num_threads(app.TORCH_NUM_THREADS)
+
+    if not app.ensure_model_files(app.STORAGE_FOLDER, args.model_dir):
+        raise SystemExit(f"No model files in {args.model_dir}")
+    print(f"Loading teacher from {args.model_dir}...")
+    tokenizer = AutoTokenizer.from_pretrained(args.model_dir, use_fast=True)
+    teacher = AutoModelForSequenceClassification.from_pretrained(args.model_dir).eval()
+    student = AutoModelForSequenceClassification.from_pretrained(args.model_dir)
+    args.max_length = min(args.max_length, getattr(teacher.config, 'max_position_embeddings', args.max_length))
+
+    texts, labels = load_labeled(args.labeled, args.text_column, args.label_column, teacher.config.label2id)
+    order = list(range(len(texts)))
+    random.Random(args.seed).shuffle(order)
+    held_out = int(len(order) * args.eval_fraction)
+    if held_out < 1 or held_out >= len(order):
+        raise SystemExit(f"Need labeled rows for both training and evaluation (found {len(texts)})")
+    train_texts = [texts[i] for i in order[held_out:]]
+    train_labels = [labels[i] for i in order[held_out:]]
+    eval_texts = [texts[i] for i in order[:held_out]]
+    eval_labels = [labels[i] for i in order[:held_out]]
+    print(f"✓ {len(texts)} labeled reviews ({len(train_texts)} train, {len(eval_texts)} held out)")
+
+    if args.method == 'distill':
+        count = args.layers or max(1, len(encoder_layers(student)) // 2)
+        keep = distill_layers(student, count)
+        print(f"✓ Student keeps teacher layers {keep}")
+    else:
+        importance = ffn_importance(student, tokenizer, train_texts, args.max_length, args.batch_size)
+        keep = prune_ffn(student, importance, args.keep_ffn)
+        print(f"✓ Pruned feed-forward blocks to {keep} neurons per layer")
+
+    print("Training student...")
+    teacher_logits = logits_for(teacher, tokenizer, train_texts, args.max_length, args.batch_size)
+    train_student(student, tokenizer, train_texts, train_labels, teacher_logits, args)
+
+    version = save_model(student, args.model_dir, args.output, args.method)
+    print(f"✓ Saved {args.output} (version {version})")
+
+    # Evaluate the saved copy, loaded the way the server loads it
+    student = AutoModelForSequenceClassification.from_pretrained(args.output).eval()
+    teacher_eval, teacher_predictions = evaluate(teacher, tokenizer, eval_texts, eval_labels, args.max_length, args.batch_size)
+    student_eval, _ = evaluate(student, tokenizer, eval_texts, eval_labels, args.max_length, args.batch_size,
+                               reference=teacher_predictions)
+    report = {
+        'method': args.method,
+        'version': version,
+        'labeled_file': os.path.abspath(args.labeled),
+        'held_out': len(eval_texts),
+        'teacher': {**model_summary(teacher, args.model_dir), **teacher_eval,
+                    **measure_latency(teacher, tokenizer, args.benchmark_reviews, args.max_length)},
+        'student': {**model_summary(student, args.output), **student_eval,
+                    **measure_latency(student, tokenizer, args.benchmark_reviews, args.max_length)},
+    }
+    with open(os.path.join(args.output, 'compression_report.json'), 'w') as f:
+        json.dump(report, f, indent=2)
+
+    print(f"\n{'':8} {'layers':>6} {'params':>11} {'size MB':>8} {'accuracy':>9} "
+          f"{'b=1 p50 ms':>11} {'b=32 reviews/s':>15}")
+    for name in ('teacher', 'student'):
+        row = report[name]
+        print(f"{name:8} {row['layers']:>6} {row['parameters']:>11,} {row['size_mb']:>8.1f} {row['accuracy']:>9.3f} "
+              f"{row['b1_p50_ms']:>11.2f} {row['b32_reviews_per_sec']:>15.1f}")
+    if 'teacher_agreement' in report['student']:
+        print(f"Student agrees with the teacher on {report['student']['teacher_agreement']:.1%} of held-out reviews")
+    print(f"\n✓ Report written to {os.path.join(args.output, 'compression_report.json')}")
+    print(f"Serve it with LOCAL_MODEL_DIR={args.output}, or upload it as a model version")
+
+
+if __name__ == '__main__':
+    sys.exit(main())
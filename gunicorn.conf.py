@@ -0,0 +1,68 @@
+"""
+Gunicorn settings (loaded automatically by `gunicorn app:app`)
+
+With PRELOAD_MODEL=true (or --preload) the model is loaded once in the master
+and workers are forked from it, sharing the weights copy-on-write. Torch
+intra-op threads are split between workers so they do not oversubscribe the
+cores. With CPU_AFFINITY=true each worker is also pinned to its own share of
+the cores. Both use the final worker count, so -w on the command line counts.
+"""
+
+import gc
+import os
+import sys
+
+workers = int(os.environ.get('WEB_CONCURRENCY', '1'))
+threads = int(os.environ.get('GUNICORN_THREADS', '1'))
+preload_app = os.environ.get('PRELOAD_MODEL', 'false').lower() == 'true'
+cpu_affinity = os.environ.get('CPU_AFFINITY', 'false').lower() == 'true'
+
+# An explicit TORCH_NUM_THREADS wins over the per-worker split
+torch_threads_override = os.environ.get('TORCH_NUM_THREADS')
+
+
+def on_starting(server):
+    """Let a preloading master finish loading the model before it forks workers
+    
+    Runs after the app was imported, so it also covers --preload on the command
+    line. If the first attempt fails, workers are forked anyway and each keeps
+    retrying on its own.
+    """
+    if not server.cfg.preload_app:
+        return
+    import app
+    while not app.wait_until_ready(1):
+        if app.model_state == 'failed' or app.MODEL_LOADING == 'none':
+            return
+
+
+def pre_fork(server, worker):
+    # Keep the garbage collector from touching (and so copying) preloaded objects
+    if server.cfg.preload_app:
+        gc.freeze()
+
+
+def pin_worker(worker, worker_count):
+    """Pin the worker to a contiguous slice of the available cores"""
+    cores = sorted(os.sched_getaffinity(0))
+    per_worker = max(1, len(cores) // worker_count)
+    # worker.age keeps counting across restarts; wrap it so replacements reuse a slice
+    start = ((worker.age - 1) % worker_count) * per_worker % len(cores)
+    os.sched_setaffinity(0, cores[start:start + per_worker])
+
+
+def post_fork(server, worker):
+    # server.cfg has the final settings; module-level values miss -w and GUNICORN_CMD_ARGS
+    worker_count = max(1, server.cfg.workers)
+    if cpu_affinity and hasattr(os, 'sched_setaffinity'):
+        pin_worker(worker, worker_count)
+    torch_threads = int(torch_threads_override or max(1, (os.cpu_count() or 1) // worker_count))
+    # Read by app.py on import; a preloaded app already has it, so its copy is updated too
+    os.environ['TORCH_NUM_THREADS'] = str(torch_threads)
+    if 'app' in sys.modules and hasattr(sys.modules['app'], 'TORCH_NUM_THREADS'):
+        sys.modules['app'].TORCH_NUM_THREADS = torch_threads
+    try:
+        import torch
+        torch.set_num_threads(torch_threads)
+    except ImportError:
+        pass
@@ -0,0 +1,144 @@
+"""
+Inference backends for the sentiment model
+  - torch: the fp32 PyTorch model
+  - torch-int8: dynamically quantized Linear layers (int8 weights)
+  - onnx: exported graph run by ONNX Runtime with all graph optimizations
+Every backend maps a tokenized batch to logits. The torch backends can also
+return the mean-pooled last hidden state of the same pass as an embedding,
+and can run the model through torch.compile; compilation happens on the
+first batches (the warm-up), and disable_compile() falls back to eager mode.
+"""
+
+import os
+
+import numpy as np
+import torch
+
+BACKENDS = ('torch', 'torch-int8', 'onnx')
+
+
+class TorchBackend:
+    name = 'torch'
+
+    def __init__(self, model, compile=False):
+        self.model = model
+        self.compiled = torch.compile(model, dynamic=True) if compile else None
+
+    def logits(self, inputs):
+        with torch.inference_mode():
+            runner = self.model if self.compiled is None else self.compiled
+            return runner(**inputs).logits
+
+    def logits_and_embeddings(self, inputs):
+        """Logits plus the attention-masked mean of the last hidden state"""
+        with torch.inference_mode():
+            runner = self.model if self.compiled is None else self.compiled
+            output = runner(**inputs, output_hidden_states=True)
+            hidden = output.hidden_states[-1]
+            mask = inputs['attention_mask'].unsqueeze(-1).to(hidden.dtype)
+            return output.logits, (hidden * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1)
+
+    def disable_compile(self):
+        self.compiled = None
+
+
+class QuantizedTorchBackend(TorchBackend):
+    name = 'torch-int8'
+
+    def __init__(self, model, compile=False):
+        quantize_dynamic = getattr(torch, 'ao', torch).quantization.quantize_dynamic
+        # from_pretrained may leave every tensor pointing into the mapped weights file, and any
+        # one left over keeps the whole file resident. The packed Linear layers hold on to their
+        # biases, so those are copied first and the unquantized tensors (embeddings, layer norms)
+        # after; quantizing in place then drops the fp32 Linear weights instead of a deep copy.
+        for module in model.modules():
+            if isinstance(module, torch.nn.Linear) and module.bias is not None:
+                module.bias.data = module.bias.data.clone()
+        model = quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+        for tensor in list(model.parameters()) + list(model.buffers()):
+            tensor.data = tensor.data.clone()
+        super().__init__(model, compile)
+
+
+class OnnxBackend:
+    name = 'onnx'
+
+    def __init__(self, onnx_path, num_threads=0, prepack_weights=False):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads > 0:
+            options.intra_op_num_threads = num_threads
+        if not prepack_weights:
+            # Prepacked MatMul weights are kept next to the originals (about 40% more memory)
+            options.add_session_config_entry('session.disable_prepacking', '1')
+        self.session = ort.InferenceSession(onnx_path, options, providers=['CPUExecutionProvider'])
+        self.input_names = [i.name for i in self.session.get_inputs()]
+
+    def logits(self, inputs):
+        input_ids = np.asarray(inputs['input_ids'], dtype=np.int64)
+        # token_type_ids may be left out by callers; the torch model defaults them to zeros too
+        feed = {name: np.asarray(inputs[name], dtype=np.int64) if name in inputs else np.zeros_like(input_ids)
+                for name in self.input_names}
+        return torch.from_numpy(self.session.run(None, feed)[0])
+
+
+def export_onnx(model, tokenizer, onnx_path):
+    """Export the model to ONNX with dynamic batch and sequence axes"""
+    sample = tokenizer(['export sample'], return_tensors='pt')
+    input_names = list(sample.keys())
+    dynamic_axes = {name: {0: 'batch', 1: 'sequence'} for name in input_names}
+    dynamic_axes['logits'] = {0: 'batch'}
+
+    class LogitsOnly(torch.nn.Module):
+        def __init__(self, wrapped):
+            super().__init__()
+            self.wrapped = wrapped
+
+        def forward(self, *args):
+            return self.wrapped(**dict(zip(input_names, args))).logits
+
+    os.makedirs(os.path.dirname(onnx_path), exist_ok=True)
+    tmp_path = f"{onnx_path}.tmp"
+    export_args = (LogitsOnly(model).eval(), tuple(sample[name] for name in input_names), tmp_path)
+    export_kwargs = dict(input_names=input_names, output_names=['logits'], dynamic_axes=dynamic_axes, opset_version=17)
+    with torch.inference_mode():
+        try:
+            torch.onnx.export(*export_args, dynamo=False, **export_kwargs)
+        except TypeError:  # torch < 2.5 has no dynamo flag
+            torch.onnx.export(*export_args, **export_kwargs)
+    os.replace(tmp_path, onnx_path)
+
+
+def create_backend(name, model, tokenizer, export_dir, num_threads=0, compile=False, onnx_prepack=False):
+    """Build the named backend, exporting the ONNX graph on first use"""
+    if name == 'torch':
+        return TorchBackend(model, compile)
+    if name == 'torch-int8':
+        return QuantizedTorchBackend(model, compile)
+    if name == 'onnx':
+        onnx_path = os.path.join(export_dir, 'model.onnx')
+        if not os.path.exists(onnx_path):
+            print(f"Exporting ONNX model to {onnx_path}...")
+            export_onnx(model, tokenizer, onnx_path)
+        return OnnxBackend(onnx_path, num_threads, onnx_prepack)
+    raise ValueError(f"Unknown inference backend: {name} (expected one of {', '.join(BACKENDS)})")
+
+
+def parity_check(reference, candidate, batches):
+    """Compare a backend with the fp32 reference on the same tokenized batches"""
+    expected, actual = [], []
+    for inputs in batches:
+        expected.append(torch.softmax(reference.logits(inputs).float(), dim=-1))
+        actual.append(torch.softmax(candidate.logits(inputs).float(), dim=-1))
+    expected, actual = torch.cat(expected), torch.cat(actual)
+    agree = (expected.argmax(dim=-1) == actual.argmax(dim=-1)).float()
+    diff = (expected - actual).abs()
+    return {
+        'backend': candidate.name,
+        'samples': len(expected),
+        'label_agreement': float(agree.mean()),
+        'max_abs_prob_diff': float(diff.max()),
+        'mean_abs_prob_diff': float(diff.mean()),
+    }
@@ -0,0 +1,317 @@
+"""
+Background sentiment jobs for bulk runs
+A job is a folder under JOBS_DIR:
+    input.jsonl        submitted reviews, one per line
+    status.json        state, progress and timestamps
+    results/NNNNN.jsonl  finished result chunks
+    cancel             present once cancellation was requested
+    .lock              held by the process running the job
+Jobs run in a separate process pool (one model per process), so web workers
+stay free for interactive traffic. State lives on disk, so any web worker can
+answer status, result and cancel calls.
+
+One web worker per host is the runner: it holds JOBS_DIR/.runner.lock and owns
+the pool, so JOB_WORKERS is a host-wide limit. The runner picks up every queued
+job, including jobs left unfinished by a stopped worker, and replaces the pool
+when a job process dies. If the runner stops, another worker takes over. The
+per-job lock makes sure only one process runs each job, and finished chunks
+are not scored twice.
+"""
+
+import json
+import multiprocessing
+import os
+import re
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+JOB_ID_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+UNFINISHED_STATES = ('queued', 'running')
+RUNNER_LOCK_NAME = '.runner.lock'
+# A job whose process dies this many times (e.g. killed for running out of memory) is failed
+MAX_JOB_CRASHES = 3
+
+
+def _write_json_atomic(path, data):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def _read_json(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def _update_status(job_dir, **changes):
+    status = _read_json(os.path.join(job_dir, 'status.json'))
+    status.update(changes, updated=time.time())
+    _write_json_atomic(os.path.join(job_dir, 'status.json'), status)
+    return status
+
+
+def _claim(job_dir):
+    """Open and lock the job's lock file, or None when another process holds it"""
+    lock_file = open(os.path.join(job_dir, '.lock'), 'a')
+    if fcntl is not None:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return None
+    return lock_file
+
+
+def _is_claimed(job_dir):
+    lock_file = _claim(job_dir)
+    if lock_file is None:
+        return True
+    lock_file.close()
+    return False
+
+
+def _init_job_process(torch_threads):
+    """Load the model once per pool process"""
+    os.environ['TORCH_NUM_THREADS'] = str(torch_threads)
+    os.environ['MICROBATCH_ENABLED'] = 'false'
+    os.environ['MODEL_LOADING'] = 'sync'
+    import app  # noqa: F401  (loads the model on import)
+
+
+def run_job(job_dir, batch_size, chunk_size):
+    """Run a job unless another process already does or it has finished"""
+    lock_file = _claim(job_dir)
+    if lock_file is None:
+        return
+    with lock_file:
+        if _read_json(os.path.join(job_dir, 'status.json'))['state'] in UNFINISHED_STATES:
+            _run_job(job_dir, batch_size, chunk_size)
+
+
+def _run_job(job_dir, batch_size, chunk_size):
+    """Score a job's input in chunks, skipping chunks that already exist"""
+    import app
+
+    cancel_path = os.path.join(job_dir, 'cancel')
+    results_dir = os.path.join(job_dir, 'results')
+    os.makedirs(results_dir, exist_ok=True)
+
+    if os.path.exists(cancel_path):
+        _update_status(job_dir, state='cancelled')
+        return
+    _update_status(job_dir, state='running', started=time.time())
+
+    try:
+        processed = 0
+        chunk_index = 0
+        with open(os.path.join(job_dir, 'input.jsonl')) as f:
+            while True:
+                reviews = [json.loads(line) for _, line in zip(range(chunk_size), f)]
+                if not reviews:
+                    break
+                if os.path.exists(cancel_path):
+                    _update_status(job_dir, state='cancelled', processed=processed)
+                    return
+
+                chunk_path = os.path.join(results_dir, f"{chunk_index:05d}.jsonl")
+                if not os.path.exists(chunk_path):
+                    sentiments = app.predict_sentiment_batch([review['text'] for review in reviews], batch_size=batch_size)
+                    tmp_path = f"{chunk_path}.tmp"
+                    with open(tmp_path, 'w') as out:
+                        for review, sentiment_result in zip(reviews, sentiments):
+                            out.write(json.dumps({'id': review.get('id', None), 'sentiment': sentiment_result}) + '\n')
+                    os.replace(tmp_path, chunk_path)
+
+                processed += len(reviews)
+                chunk_index += 1
+                _update_status(job_dir, processed=processed, chunks=chunk_index)
+
+        _update_status(job_dir, state='completed', finished=time.time())
+    except Exception as e:
+        _update_status(job_dir, state='failed', error=str(e), finished=time.time())
+
+
+class JobManager:
+    """Submit, track and cancel bulk sentiment jobs"""
+
+    def __init__(self, jobs_dir, workers=1, torch_threads=1, batch_size=32, chunk_size=1000, poll_interval=1.0):
+        self.jobs_dir = jobs_dir
+        self.workers = workers
+        self.torch_threads = torch_threads
+        self.batch_size = batch_size
+        self.chunk_size = chunk_size
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._runner_pid = None
+        self._runner_lock = None
+        self._pool = None
+        self._futures = {}
+        self._crashes = {}
+
+    def ensure_runner(self):
+        """Start (once per process) the thread that runs jobs while this process is the host's runner"""
+        if self._runner_pid == os.getpid():
+            return
+        with self._lock:
+            if self._runner_pid == os.getpid():
+                return
+            # Nothing from a parent process carries over: its pool and lock belong to it
+            self._runner_pid = os.getpid()
+            self._runner_lock = None
+            self._pool = None
+            self._futures = {}
+        threading.Thread(target=self._run, name='job-runner', daemon=True).start()
+
+    def _run(self):
+        while True:
+            try:
+                if self._become_runner():
+                    self._dispatch()
+            except Exception as e:
+                print(f"⚠ Job runner error: {e}")
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+
+    def _become_runner(self):
+        """True once this process holds the host-wide runner lock (always without fcntl)"""
+        if self._runner_lock is not None:
+            return True
+        os.makedirs(self.jobs_dir, exist_ok=True)
+        lock_file = open(os.path.join(self.jobs_dir, RUNNER_LOCK_NAME), 'a')
+        if fcntl is not None:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                lock_file.close()
+                return False
+        self._runner_lock = lock_file
+        print(f"✓ Running bulk jobs for this host (pid {os.getpid()})")
+        return True
+
+    def _get_pool(self):
+        # Created by the runner only, so preloaded gunicorn masters and other workers never start one
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_job_process,
+                initargs=(self.torch_threads,)
+            )
+        return self._pool
+
+    def _replace_pool(self):
+        print("⚠ A job process died; starting a new job pool")
+        self._pool.shutdown(wait=False, cancel_futures=True)
+        self._pool = None
+        self._futures = {}
+
+    def _dispatch(self):
+        """Submit unfinished jobs that no process is running"""
+        broken = False
+        for job_id, future in list(self._futures.items()):
+            if future.done():
+                del self._futures[job_id]
+                if isinstance(future.exception(), BrokenProcessPool):
+                    broken = True
+                    # Every job in a broken pool fails; only the ones that had started count as crashed
+                    if self._job_state(job_id) == 'running':
+                        self._crashes[job_id] = self._crashes.get(job_id, 0) + 1
+        if broken:
+            self._replace_pool()
+
+        for job_id in self._unfinished():
+            job_dir = os.path.join(self.jobs_dir, job_id)
+            if job_id in self._futures or _is_claimed(job_dir):
+                continue
+            if self._crashes.get(job_id, 0) >= MAX_JOB_CRASHES:
+                _update_status(job_dir, state='failed', finished=time.time(),
+                               error=f"Job process died {MAX_JOB_CRASHES} times")
+                continue
+            try:
+                self._futures[job_id] = self._get_pool().submit(run_job, job_dir, self.batch_size, self.chunk_size)
+            except BrokenProcessPool:
+                self._replace_pool()
+                return
+
+    def _job_state(self, job_id):
+        try:
+            return _read_json(os.path.join(self.jobs_dir, job_id, 'status.json')).get('state')
+        except (OSError, ValueError):
+            return None
+
+    def _unfinished(self):
+        """Ids of queued or running jobs, oldest first"""
+        unfinished = []
+        for job_id in os.listdir(self.jobs_dir):
+            if not JOB_ID_PATTERN.match(job_id):
+                continue
+            try:
+                status = _read_json(os.path.join(self.jobs_dir, job_id, 'status.json'))
+            except (OSError, ValueError):
+                continue
+            if status.get('state') in UNFINISHED_STATES:
+                unfinished.append((status.get('created', 0), job_id))
+        return [job_id for _, job_id in sorted(unfinished)]
+
+    def job_dir(self, job_id):
+        if not JOB_ID_PATTERN.match(job_id or ''):
+            return None
+        path = os.path.join(self.jobs_dir, job_id)
+        return path if os.path.isdir(path) else None
+
+    def submit(self, reviews):
+        """Store the reviews and queue the job for the runner; returns its status"""
+        job_id = uuid.uuid4().hex
+        job_dir = os.path.join(self.jobs_dir, job_id)
+        os.makedirs(job_dir)
+
+        total = 0
+        with open(os.path.join(job_dir, 'input.jsonl'), 'w') as f:
+            for review in reviews:
+                if isinstance(review, dict) and isinstance(review.get('text'), str) and review['text']:
+                    f.write(json.dumps({'id': review.get('id', None), 'text': review['text']}) + '\n')
+                    total += 1
+
+        now = time.time()
+        status = {
+            'job_id': job_id, 'state': 'queued', 'total': total, 'processed': 0,
+            'chunks': 0, 'chunk_size': self.chunk_size, 'created': now, 'updated': now,
+        }
+        _write_json_atomic(os.path.join(job_dir, 'status.json'), status)
+        # Picked up at once if this process is the runner, otherwise within poll_interval
+        self._wake.set()
+        return status
+
+    def status(self, job_id):
+        job_dir = self.job_dir(job_id)
+        if job_dir is None:
+            return None
+        status = _read_json(os.path.join(job_dir, 'status.json'))
+        status['progress'] = status['processed'] / status['total'] if status['total'] else 1.0
+        status['cancel_requested'] = os.path.exists(os.path.join(job_dir, 'cancel'))
+        return status
+
+    def cancel(self, job_id):
+        job_dir = self.job_dir(job_id)
+        if job_dir is None:
+            return None
+        open(os.path.join(job_dir, 'cancel'), 'w').close()
+        return self.status(job_id)
+
+    def chunk_paths(self, job_id):
+        """Paths of finished result chunks, in order"""
+        results_dir = os.path.join(self.job_dir(job_id), 'results')
+        if not os.path.isdir(results_dir):
+            return []
+        names = sorted(n for n in os.listdir(results_dir) if n.endswith('.jsonl'))
+        return [os.path.join(results_dir, n) for n in names]
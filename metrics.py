@@ -0,0 +1,122 @@
+"""
+Minimal Prometheus-style metrics (text exposition format, no extra dependency)
+Values are per process; every sample carries a `pid` label so scrapes from
+different gunicorn workers can be told apart.
+"""
+
+import bisect
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512)
+TOKEN_LENGTH_BUCKETS = (8, 16, 32, 64, 128, 256, 512, 1024)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{k}="{v}"' for k, v in labels) + '}'
+
+
+class Histogram:
+    def __init__(self, name, help_text, buckets, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets)
+        self.labelnames = tuple(labelnames)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(n, '') for n in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def render(self, base_labels):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {k: ([*v[0]], v[1], v[2]) for k, v in self._series.items()}
+        for key, (counts, total, count) in sorted(series.items()):
+            labels = base_labels + list(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{_format_labels(labels + [('le', bound)])} {cumulative}")
+            lines.append(f"{self.name}_bucket{_format_labels(labels + [('le', '+Inf')])} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {count}")
+        return lines
+
+
+class Gauge:
+    """Value read from a callback at scrape time"""
+
+    def __init__(self, name, help_text, callback, kind='gauge'):
+        self.name = name
+        self.help = help_text
+        self.callback = callback
+        self.kind = kind
+
+    def render(self, base_labels):
+        value = self.callback()
+        if value is None:
+            return []
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}",
+                f"{self.name}{_format_labels(base_labels)} {value}"]
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        base_labels = [('pid', os.getpid())]
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render(base_labels))
+        return '\n'.join(lines) + '\n'
+
+
+def resident_memory_bytes():
+    """Current RSS from /proc, falling back to the peak from getrusage"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+registry = Registry()
+
+request_latency = registry.register(Histogram(
+    'sentiment_request_duration_seconds', 'Request latency by endpoint', LATENCY_BUCKETS, ('endpoint', 'status')))
+stage_latency = registry.register(Histogram(
+    'sentiment_stage_duration_seconds',
+    'Time per processing stage (json_parse, msgpack_parse, tokenize, forward, label_map, serialize)', LATENCY_BUCKETS, ('stage',)))
+batch_size = registry.register(Histogram(
+    'sentiment_batch_size', 'Reviews per forward pass', BATCH_SIZE_BUCKETS))
+token_length = registry.register(Histogram(
+    'sentiment_token_length', 'Tokens per review', TOKEN_LENGTH_BUCKETS))
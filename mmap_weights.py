@@ -0,0 +1,50 @@
+"""
+Memory-map safetensors weights into a loaded model
+Parameters end up backed by a private (copy-on-write) mapping of the weights
+file, so every worker on the host shares the same page-cache pages instead of
+holding its own copy.
+"""
+
+import json
+import mmap
+import struct
+
+import torch
+
+SAFETENSORS_DTYPES = {
+    'F64': torch.float64, 'F32': torch.float32, 'F16': torch.float16, 'BF16': torch.bfloat16,
+    'I64': torch.int64, 'I32': torch.int32, 'I16': torch.int16, 'I8': torch.int8,
+    'U8': torch.uint8, 'BOOL': torch.bool,
+}
+
+
+def mmap_safetensors(path):
+    """Return a {name: tensor} dict whose storage is a mapping of the file"""
+    with open(path, 'rb') as f:
+        header_size = struct.unpack('<Q', f.read(8))[0]
+        header = json.loads(f.read(header_size))
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+
+    data_start = 8 + header_size
+    tensors = {}
+    for name, info in header.items():
+        if name == '__metadata__':
+            continue
+        dtype = SAFETENSORS_DTYPES[info['dtype']]
+        begin, end = info['data_offsets']
+        count = (end - begin) // torch.empty((), dtype=dtype).element_size()
+        flat = torch.frombuffer(mapped, dtype=dtype, count=count, offset=data_start + begin) if count else torch.empty(0, dtype=dtype)
+        tensors[name] = flat.view(info['shape'])
+    return tensors
+
+
+def share_model_weights(model, path):
+    """Swap the model's parameters for memory-mapped ones; returns the number of tensors mapped"""
+    tensors = mmap_safetensors(path)
+    state = model.state_dict()
+    mapped = {}
+    for name, tensor in tensors.items():
+        if name in state and state[name].shape == tensor.shape and state[name].dtype == tensor.dtype:
+            mapped[name] = tensor
+    model.load_state_dict(mapped, strict=False, assign=True)
+    return len(mapped)
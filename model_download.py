@@ -0,0 +1,275 @@
+"""
+Parallel, resumable and verified model download
+Files are fetched in byte-range chunks on a thread pool into <name>.part files,
+checked against a manifest of sizes and hashes, then atomically renamed into
+place. A version marker written last lets restarts skip the download.
+
+Generate the manifest for a model folder before uploading it:
+    python model_download.py cached_model
+"""
+
+import base64
+import hashlib
+import json
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+MANIFEST_NAME = 'manifest.json'
+VERSION_MARKER = '.model_version.json'
+LOCK_NAME = '.download.lock'
+
+
+class LocalBucket:
+    """Directory that behaves like a Firebase Storage bucket (for local runs and testing)"""
+
+    def __init__(self, root):
+        self.root = root
+        self.name = root
+
+    def blob(self, name):
+        return LocalBlob(os.path.join(self.root, name))
+
+
+class LocalBlob:
+    def __init__(self, path):
+        self.path = path
+        self.size = None
+        self.md5_hash = None
+
+    def exists(self):
+        return os.path.isfile(self.path)
+
+    def reload(self):
+        if not self.exists():
+            raise FileNotFoundError(self.path)
+        self.size = os.path.getsize(self.path)
+        self.md5_hash = base64.b64encode(file_digest(self.path, 'md5')).decode()
+
+    def download_as_bytes(self, start=None, end=None):
+        with open(self.path, 'rb') as f:
+            if start is None:
+                return f.read()
+            f.seek(start)
+            return f.read(end - start + 1)
+
+
+def file_digest(path, algorithm='sha256'):
+    """Hash a file in 1 MB blocks"""
+    digest = hashlib.new(algorithm)
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.digest()
+
+
+def build_manifest(model_dir, filenames, version=None):
+    """Describe model files by size and sha256"""
+    files = {}
+    for filename in filenames:
+        path = os.path.join(model_dir, filename)
+        files[filename] = {'size': os.path.getsize(path), 'sha256': file_digest(path).hex()}
+    return {'version': version or manifest_version(files), 'files': files}
+
+
+def manifest_version(files):
+    """Derive a version string from the file hashes"""
+    digest = hashlib.sha256()
+    for filename in sorted(files):
+        entry = files[filename]
+        digest.update(f"{filename}:{entry['size']}:{entry.get('sha256') or entry.get('md5')}\n".encode())
+    return digest.hexdigest()[:16]
+
+
+def fetch_manifest(bucket, folder, filenames):
+    """Read the remote manifest, or build one from blob metadata (size and md5)"""
+    manifest_blob = bucket.blob(f"{folder}/{MANIFEST_NAME}")
+    if manifest_blob.exists():
+        manifest = json.loads(manifest_blob.download_as_bytes())
+        missing = [f for f in filenames if f not in manifest.get('files', {})]
+        if missing:
+            raise Exception(f"Manifest is missing entries for: {', '.join(missing)}")
+        manifest.setdefault('version', manifest_version(manifest['files']))
+        return manifest
+
+    files = {}
+    for filename in filenames:
+        blob = bucket.blob(f"{folder}/{filename}")
+        blob.reload()
+        files[filename] = {'size': blob.size, 'md5': base64.b64decode(blob.md5_hash).hex() if blob.md5_hash else None}
+    return {'version': manifest_version(files), 'files': files}
+
+
+def read_version_marker(model_dir):
+    """Return the installed manifest, or None"""
+    try:
+        with open(os.path.join(model_dir, VERSION_MARKER)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def cache_is_valid(model_dir, filenames, verify_hashes=False):
+    """Check that the version marker covers every file and sizes (optionally hashes) match"""
+    marker = read_version_marker(model_dir)
+    if not marker:
+        return False
+    for filename in filenames:
+        entry = marker.get('files', {}).get(filename)
+        path = os.path.join(model_dir, filename)
+        if entry is None or not os.path.isfile(path) or os.path.getsize(path) != entry['size']:
+            return False
+        if verify_hashes and not _hash_matches(path, entry):
+            return False
+    return True
+
+
+def _hash_matches(path, entry):
+    if entry.get('sha256'):
+        return file_digest(path, 'sha256').hex() == entry['sha256']
+    if entry.get('md5'):
+        return file_digest(path, 'md5').hex() == entry['md5']
+    return True
+
+
+def _write_json_atomic(path, data):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class _PartialFile:
+    """A preallocated .part file plus the set of chunks already written"""
+
+    def __init__(self, local_path, size, chunk_size):
+        self.local_path = local_path
+        self.part_path = f"{local_path}.part"
+        self.progress_path = f"{local_path}.part.json"
+        self.size = size
+        self.chunk_size = chunk_size
+        self.lock = threading.Lock()
+        self.done = set()
+
+        progress = None
+        if os.path.exists(self.part_path) and os.path.exists(self.progress_path):
+            try:
+                with open(self.progress_path) as f:
+                    progress = json.load(f)
+            except (OSError, ValueError):
+                progress = None
+        if progress and progress.get('size') == size and progress.get('chunk_size') == chunk_size:
+            self.done = set(progress['done'])
+        else:
+            with open(self.part_path, 'wb') as f:
+                f.truncate(size)
+            self._save()
+
+        self.fd = os.open(self.part_path, os.O_RDWR)
+
+    def pending(self):
+        count = max(1, -(-self.size // self.chunk_size))
+        return [i for i in range(count) if i not in self.done]
+
+    def write(self, index, data):
+        os.pwrite(self.fd, data, index * self.chunk_size)
+        with self.lock:
+            self.done.add(index)
+            self._save()
+
+    def _save(self):
+        _write_json_atomic(self.progress_path, {'size': self.size, 'chunk_size': self.chunk_size, 'done': sorted(self.done)})
+
+    def finish(self, entry):
+        """Verify the part file and move it into place"""
+        os.fsync(self.fd)
+        os.close(self.fd)
+        if os.path.getsize(self.part_path) != self.size or not _hash_matches(self.part_path, entry):
+            self.discard()
+            raise Exception(f"Checksum mismatch for {os.path.basename(self.local_path)}")
+        os.replace(self.part_path, self.local_path)
+        os.remove(self.progress_path)
+
+    def discard(self):
+        for path in (self.part_path, self.progress_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def _download_chunk(blob, partial, index):
+    start = index * partial.chunk_size
+    end = min(start + partial.chunk_size, partial.size) - 1
+    data = blob.download_as_bytes(start=start, end=end) if partial.size else b''
+    if len(data) != end - start + 1:
+        raise Exception(f"Short read for {os.path.basename(partial.local_path)} chunk {index}")
+    partial.write(index, data)
+
+
+def download_model(bucket, folder, model_dir, filenames, workers=8, chunk_size=8 * 1024 * 1024):
+    """Download and verify model files, returning the installed manifest"""
+    os.makedirs(model_dir, exist_ok=True)
+
+    with open(os.path.join(model_dir, LOCK_NAME), 'w') as lock_file:
+        # Only one process downloads; the others wait and reuse its result
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+
+        if cache_is_valid(model_dir, filenames):
+            return read_version_marker(model_dir)
+
+        manifest = fetch_manifest(bucket, folder, filenames)
+        marker_path = os.path.join(model_dir, VERSION_MARKER)
+        if os.path.exists(marker_path):
+            os.remove(marker_path)
+
+        partials = {}
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = []
+            for filename in filenames:
+                entry = manifest['files'][filename]
+                local_path = os.path.join(model_dir, filename)
+                if os.path.isfile(local_path) and os.path.getsize(local_path) == entry['size'] and _hash_matches(local_path, entry):
+                    print(f"  ✓ {filename} (already present)")
+                    continue
+                partial = _PartialFile(local_path, entry['size'], chunk_size)
+                partials[filename] = partial
+                blob = bucket.blob(f"{folder}/{filename}")
+                if partial.done:
+                    print(f"  Resuming {filename} ({len(partial.done)} chunks already downloaded)...")
+                else:
+                    print(f"  Downloading {filename}...")
+                futures.extend(executor.submit(_download_chunk, blob, partial, i) for i in partial.pending())
+            try:
+                for future in futures:
+                    future.result()
+            except Exception:
+                # Keep the .part files so the next attempt resumes
+                for future in futures:
+                    future.cancel()
+                executor.shutdown(wait=True)
+                for partial in partials.values():
+                    os.close(partial.fd)
+                raise
+
+        for filename, partial in partials.items():
+            partial.finish(manifest['files'][filename])
+            print(f"  ✓ {filename}")
+
+        _write_json_atomic(marker_path, manifest)
+        return manifest
+
+
+if __name__ == '__main__':
+    model_dir = sys.argv[1] if len(sys.argv) > 1 else 'cached_model'
+    filenames = sorted(f for f in os.listdir(model_dir) if f != MANIFEST_NAME and not f.startswith('.') and not f.endswith(('.part', '.part.json')))
+    manifest = build_manifest(model_dir, filenames)
+    _write_json_atomic(os.path.join(model_dir, MANIFEST_NAME), manifest)
+    print(f"✓ Wrote {MANIFEST_NAME} for version {manifest['version']}")
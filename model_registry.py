@@ -0,0 +1,197 @@
+"""
+Loaded model versions and hot swapping
+Each worker keeps its loaded versions in a ModelRegistry. The desired state
+(which versions to keep loaded and which one is active) lives in a JSON file
+that every worker watches, so one admin call updates all of them:
+    {"active": "v2", "models": {"v2": {"folder": "SentimentAnalysis/v2"}}}
+A new version is loaded and warmed up next to the current one, then made
+active with a single reference swap. In-flight requests keep the version they
+started with, and versions that are no longer wanted are unloaded.
+"""
+
+import gc
+import json
+import os
+import re
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+MODEL_NAME_PATTERN = re.compile(r'^[A-Za-z0-9_-][A-Za-z0-9._-]{0,63}$')
+
+
+class UnknownModel(Exception):
+    """Raised when a request names a model version that is not loaded"""
+
+
+class InvalidModelName(ValueError):
+    """Raised when a request names a model version that could never be valid"""
+
+
+def check_model_name(name):
+    """name unchanged, or InvalidModelName unless it matches MODEL_NAME_PATTERN"""
+    if not isinstance(name, str) or not MODEL_NAME_PATTERN.match(name):
+        raise InvalidModelName('model must be 1-64 letters, digits, ".", "_" or "-"')
+    return name
+
+
+class ModelSlot:
+    """One loaded model version and everything needed to run it"""
+
+    def __init__(self, name, version, model, tokenizer, backend, special_prefix, special_suffix,
+                 label_names, max_sequence_length, lowercase=False, model_dir=None):
+        self.name = name
+        self.version = version
+        self.model = model
+        self.tokenizer = tokenizer
+        self.backend = backend
+        self.special_prefix = special_prefix
+        self.special_suffix = special_suffix
+        self.label_names = label_names
+        self.max_sequence_length = max_sequence_length
+        self.lowercase = lowercase
+        self.model_dir = model_dir
+        self.loaded_at = time.time()
+        self.warmup_seconds = None
+
+    def info(self):
+        return {'name': self.name, 'version': self.version, 'backend': self.backend.name,
+                'compiled': getattr(self.backend, 'compiled', None) is not None,
+                'loaded_at': self.loaded_at, 'warmup_seconds': self.warmup_seconds}
+
+
+class ModelRegistry:
+    def __init__(self, state_path, default_name, on_activate=None):
+        self.state_path = state_path
+        self.default_name = default_name
+        self.on_activate = on_activate
+        self._slots = {}
+        self._active = None
+        self._lock = threading.Lock()
+        self._reconcile_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._watcher_pid = None
+
+    # Loaded versions
+
+    def get(self, name=None):
+        """The named slot, or the active one"""
+        if name is None:
+            slot = self._active
+            if slot is None:
+                raise UnknownModel('No active model')
+            return slot
+        slot = self._slots.get(name)
+        if slot is None:
+            raise UnknownModel(f"Unknown model: {name}")
+        return slot
+
+    def add(self, slot):
+        with self._lock:
+            self._slots[slot.name] = slot
+
+    def activate(self, name):
+        with self._lock:
+            slot = self._slots[name]
+            self._active = slot
+        if self.on_activate:
+            self.on_activate(slot)
+        print(f"✓ Active model: {name} ({slot.version})")
+
+    def remove(self, name):
+        with self._lock:
+            if self._active is not None and self._active.name == name:
+                raise ValueError('Cannot unload the active model')
+            self._slots.pop(name, None)
+        gc.collect()
+        print(f"✓ Unloaded model: {name}")
+
+    def active_name(self):
+        return self._active.name if self._active is not None else None
+
+    def info(self):
+        with self._lock:
+            slots = [slot.info() for slot in self._slots.values()]
+        return {'active': self.active_name(), 'loaded': slots}
+
+    # Desired state shared by all workers
+
+    def read_state(self):
+        try:
+            with open(self.state_path) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            state = {}
+        state.setdefault('active', self.default_name)
+        state.setdefault('models', {})
+        return state
+
+    def update_state(self, change):
+        """Apply change(state) to the state file under an exclusive lock; returns the new state"""
+        directory = os.path.dirname(self.state_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(f"{self.state_path}.lock", 'w') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            state = self.read_state()
+            change(state)
+            tmp_path = f"{self.state_path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(state, f, indent=2)
+            os.replace(tmp_path, self.state_path)
+        self._wake.set()
+        return state
+
+    def reconcile(self, load_fn):
+        """Load wanted versions, switch the active one and unload the rest
+        Returns False if a version failed to load, so the caller can retry.
+        """
+        with self._reconcile_lock:
+            state = self.read_state()
+            wanted = set(state['models']) | {state['active']}
+
+            complete = True
+            for name in sorted(wanted - set(self._slots)):
+                try:
+                    self.add(load_fn(name, state['models'].get(name, {})))
+                except Exception as e:
+                    print(f"✗ Could not load model {name}: {e}")
+                    complete = False
+
+            if state['active'] in self._slots and self.active_name() != state['active']:
+                self.activate(state['active'])
+
+            for name in set(self._slots) - wanted:
+                if name != self.active_name():
+                    self.remove(name)
+            return complete
+
+    def ensure_watcher(self, load_fn, interval):
+        """Start (once per process) a thread that reconciles when the state file changes"""
+        if self._watcher_pid == os.getpid():
+            return
+        with self._lock:
+            if self._watcher_pid == os.getpid():
+                return
+            self._watcher_pid = os.getpid()
+
+        def watch():
+            last_mtime = None
+            complete = True
+            while True:
+                try:
+                    mtime = os.path.getmtime(self.state_path)
+                except OSError:
+                    mtime = None
+                if mtime != last_mtime or not complete:
+                    last_mtime = mtime
+                    complete = self.reconcile(load_fn)
+                self._wake.wait(interval)
+                self._wake.clear()
+
+        threading.Thread(target=watch, name='model-watcher', daemon=True).start()
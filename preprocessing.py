@@ -0,0 +1,53 @@
+"""
+Review text normalization and in-request deduplication
+Texts are normalized before they reach the tokenizer, and texts that
+normalize to the same string are scored once and the result fanned back out.
+Modes (TEXT_NORMALIZATION):
+  - whitespace: unicode NFC and collapsed whitespace; the tokenizer splits on
+    whitespace anyway, so predictions do not change
+  - legacy: lowercase and letters only, like preprocess_text in app_backup.py
+  - none: texts are used as given (exact duplicates are still collapsed)
+Case is folded too when the model's tokenizer lowercases its input itself.
+"""
+
+import re
+import unicodedata
+
+NORMALIZATION_MODES = ('whitespace', 'legacy', 'none')
+
+_NON_LETTERS = re.compile(r'[^a-zA-Z\s]')
+
+
+def tokenizer_lowercases(tok):
+    """True when the tokenizer maps 'A' and 'a' to the same ids (uncased models)"""
+    try:
+        return tok('Good', add_special_tokens=False)['input_ids'] == tok('good', add_special_tokens=False)['input_ids']
+    except Exception:
+        return False
+
+
+def normalize_review(text, mode='whitespace', lowercase=False):
+    """Text as it is sent to the model"""
+    if mode == 'none':
+        return text
+    if mode == 'legacy':
+        text = _NON_LETTERS.sub('', text.lower())
+    else:
+        text = unicodedata.normalize('NFC', text)
+        if lowercase:
+            text = text.lower()
+    return ' '.join(text.split())
+
+
+def dedupe(texts):
+    """(unique texts in first-seen order, index into them for every input)"""
+    positions = {}
+    unique = []
+    index = []
+    for text in texts:
+        position = positions.get(text)
+        if position is None:
+            position = positions[text] = len(unique)
+            unique.append(text)
+        index.append(position)
+    return unique, index
@@ -0,0 +1,212 @@
+"""
+Content-addressed result cache for sentiment predictions
+Keys are a hash of the normalized review text and the model version, so a
+new model never serves stale results. Two backends:
+  - memory: per-process LRU bounded in bytes
+  - sqlite: one file shared by every gunicorn worker on the host
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+
+def normalize_text(text):
+    """Normalize review text for cache lookups (unicode form and whitespace)"""
+    return ' '.join(unicodedata.normalize('NFC', text).split())
+
+
+def cache_key(text, model_version):
+    """Hash of the model version and normalized text"""
+    payload = f"{model_version}\0{normalize_text(text)}".encode('utf-8')
+    return hashlib.sha256(payload).hexdigest()
+
+
+class MemoryBackend:
+    """In-process LRU store bounded by total value size"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._data = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key, ttl):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            value, created = entry
+            if ttl and time.time() - created > ttl:
+                del self._data[key]
+                self._bytes -= len(value)
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old[0])
+            self._data[key] = (value, time.time())
+            self._bytes += len(value)
+            while self._bytes > self.max_bytes and self._data:
+                _, (evicted, _) = self._data.popitem(last=False)
+                self._bytes -= len(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def info(self):
+        with self._lock:
+            return {'entries': len(self._data), 'bytes': self._bytes, 'max_bytes': self.max_bytes}
+
+
+class SQLiteBackend:
+    """SQLite store shared across processes, trimmed in least-recently-used order"""
+
+    TRIM_EVERY = 100
+
+    def __init__(self, path, max_bytes):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        self._writes = 0
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = self._conn()
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS results ('
+            'key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, '
+            'created REAL NOT NULL, accessed REAL NOT NULL)'
+        )
+        conn.execute('CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed)')
+        conn.commit()
+
+    def _conn(self):
+        # sqlite connections must not cross threads or forks
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5.0)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, key, ttl):
+        conn = self._conn()
+        row = conn.execute('SELECT value, created FROM results WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        value, created = row
+        now = time.time()
+        if ttl and now - created > ttl:
+            conn.execute('DELETE FROM results WHERE key = ?', (key,))
+            conn.commit()
+            return None
+        conn.execute('UPDATE results SET accessed = ? WHERE key = ?', (now, key))
+        conn.commit()
+        return value
+
+    def set(self, key, value):
+        conn = self._conn()
+        now = time.time()
+        conn.execute(
+            'INSERT OR REPLACE INTO results (key, value, size, created, accessed) VALUES (?, ?, ?, ?, ?)',
+            (key, value, len(value), now, now)
+        )
+        conn.commit()
+        self._writes += 1
+        if self._writes % self.TRIM_EVERY == 0:
+            self._trim(conn)
+
+    def _trim(self, conn):
+        total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM results').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        excess = total - self.max_bytes
+        stale = []
+        for key, size in conn.execute('SELECT key, size FROM results ORDER BY accessed'):
+            stale.append((key,))
+            excess -= size
+            if excess <= 0:
+                break
+        conn.executemany('DELETE FROM results WHERE key = ?', stale)
+        conn.commit()
+
+    def clear(self):
+        conn = self._conn()
+        conn.execute('DELETE FROM results')
+        conn.commit()
+
+    def info(self):
+        entries, total = self._conn().execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results').fetchone()
+        return {'entries': entries, 'bytes': total, 'max_bytes': self.max_bytes, 'path': self.path}
+
+
+class ResultCache:
+    """Prediction cache with hit/miss counters"""
+
+    def __init__(self, backend='memory', max_bytes=64 * 1024 * 1024, ttl=None, path='cache/results.sqlite3'):
+        if backend == 'sqlite':
+            self.backend = SQLiteBackend(path, max_bytes)
+        elif backend == 'memory':
+            self.backend = MemoryBackend(max_bytes)
+        else:
+            raise ValueError(f"Unknown result cache backend: {backend}")
+        self.backend_name = backend
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, text, model_version):
+        """Return the cached result for text, or None"""
+        try:
+            value = self.backend.get(cache_key(text, model_version), self.ttl)
+        except Exception:
+            value = None
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return json.loads(value)
+
+    def set(self, text, model_version, result):
+        """Store a prediction result"""
+        try:
+            self.backend.set(cache_key(text, model_version), json.dumps(result, separators=(',', ':')))
+        except Exception as e:
+            print(f"✗ Result cache write failed: {e}")
+
+    def clear(self):
+        self.backend.clear()
+
+    def stats(self):
+        """Return hit/miss counters and backend usage"""
+        with self._lock:
+            hits, misses = self.hits, self.misses
+        lookups = hits + misses
+        stats = {
+            'backend': self.backend_name,
+            'ttl_seconds': self.ttl,
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': hits / lookups if lookups else 0.0,
+        }
+        try:
+            stats.update(self.backend.info())
+        except Exception as e:
+            stats['error'] = str(e)
+        return stats
@@ -0,0 +1,210 @@
+"""
+Offline bulk scoring of review files
+Reads CSV, JSONL or Parquet in streaming chunks, scores the chunks on a pool
+of processes (one model per process, torch threads split between them) and
+appends results to a JSONL or CSV file in input order.
+
+Progress is recorded next to the output in <output>.progress.json after each
+chunk is written. Running the same command again resumes after the last
+finished chunk.
+
+Examples:
+    python score_file.py reviews.csv scored.jsonl
+    python score_file.py dump.parquet scored.csv --text-column body --id-column review_id --workers 4
+"""
+
+import argparse
+import csv
+import itertools
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+# Input file types by extension
+READERS = ('csv', 'jsonl', 'parquet')
+
+
+def file_format(path):
+    ext = os.path.splitext(path)[1].lower().lstrip('.')
+    return {'ndjson': 'jsonl', 'json': 'jsonl', 'pq': 'parquet'}.get(ext, ext)
+
+
+def read_records(path, text_column, id_column, chunk_size):
+    """Yield input rows as dicts without loading the whole file"""
+    kind = file_format(path)
+    if kind == 'csv':
+        with open(path, newline='', encoding='utf-8') as f:
+            yield from csv.DictReader(f)
+    elif kind == 'jsonl':
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+    elif kind == 'parquet':
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise SystemExit('Reading Parquet needs pyarrow (pip install pyarrow)')
+        parquet = pq.ParquetFile(path)
+        columns = [c for c in (text_column, id_column) if c in parquet.schema_arrow.names]
+        for batch in parquet.iter_batches(batch_size=chunk_size, columns=columns):
+            yield from batch.to_pylist()
+    else:
+        raise SystemExit(f"Unsupported input type: {path} (expected one of {', '.join(READERS)})")
+
+
+def _init_worker(torch_threads):
+    """Load the model once per pool process"""
+    os.environ['TORCH_NUM_THREADS'] = str(torch_threads)
+    os.environ['MICROBATCH_ENABLED'] = 'false'
+    os.environ['MODEL_LOADING'] = 'sync'
+    import app
+    if not app.model_ready.is_set():
+        raise RuntimeError('Model could not be loaded')
+
+
+def _score_chunk(texts, batch_size):
+    import app
+    return app.predict_sentiment_batch(texts, batch_size=batch_size)
+
+
+class ResultWriter:
+    """Appends result rows as JSONL or CSV"""
+
+    def __init__(self, path, offset):
+        self.path = path
+        self.csv = file_format(path) == 'csv'
+        self.columns = None
+        mode = 'r+' if offset else 'w'
+        self.file = open(path, mode, newline='', encoding='utf-8')
+        # Drop anything written after the last recorded chunk
+        self.file.seek(offset)
+        self.file.truncate()
+        if self.csv and offset:
+            with open(path, newline='', encoding='utf-8') as f:
+                self.columns = next(csv.reader(f))
+
+    def write(self, review_id, result):
+        if not self.csv:
+            self.file.write(json.dumps({'id': review_id, 'sentiment': result}) + '\n')
+            return
+        if self.columns is None:
+            self.columns = ['id', 'sentiment', 'confidence'] + [f"score_{label}" for label in result.get('scores', {})] + ['truncated', 'error']
+            csv.writer(self.file).writerow(self.columns)
+        row = {'id': review_id, 'sentiment': result.get('sentiment'), 'confidence': result.get('confidence'),
+               'truncated': result.get('truncated', False), 'error': result.get('error', '')}
+        row.update({f"score_{label}": score for label, score in result.get('scores', {}).items()})
+        csv.writer(self.file).writerow([row.get(column, '') for column in self.columns])
+
+    def commit(self):
+        """Flush to disk; returns the offset a resumed run continues from"""
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        return self.file.tell()
+
+    def close(self):
+        self.file.close()
+
+
+def load_progress(progress_path, identity):
+    """Chunks and output offset already done for this exact input, else a fresh start"""
+    try:
+        with open(progress_path) as f:
+            progress = json.load(f)
+    except (OSError, ValueError):
+        return {'chunks': 0, 'reviews': 0, 'skipped': 0, 'offset': 0}
+    if progress.get('identity') != identity:
+        raise SystemExit(f"{progress_path} belongs to a different input or settings; use --restart to start over")
+    return progress
+
+
+def save_progress(progress_path, progress):
+    tmp_path = f"{progress_path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(progress, f)
+    os.replace(tmp_path, progress_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Score a file of reviews offline')
+    parser.add_argument('input', help='CSV, JSONL or Parquet file')
+    parser.add_argument('output', help='Results file (.jsonl or .csv)')
+    parser.add_argument('--text-column', default='text')
+    parser.add_argument('--id-column', default='id')
+    parser.add_argument('--workers', type=int, default=max(1, (os.cpu_count() or 1) // 2),
+                        help='Scoring processes, each with its own model')
+    parser.add_argument('--torch-threads', type=int, default=0, help='Torch threads per process (default: cores / workers)')
+    parser.add_argument('--chunk-size', type=int, default=2000, help='Reviews per chunk sent to a process')
+    parser.add_argument('--batch-size', type=int, default=None, help='Reviews per forward pass (default: BATCH_SIZE)')
+    parser.add_argument('--restart', action='store_true', help='Ignore earlier progress and overwrite the output')
+    args = parser.parse_args()
+
+    torch_threads = args.torch_threads or max(1, (os.cpu_count() or 1) // args.workers)
+    # One-off texts gain nothing from the result cache
+    os.environ.setdefault('RESULT_CACHE_ENABLED', 'false')
+
+    stat = os.stat(args.input)
+    identity = {'input': os.path.abspath(args.input), 'size': stat.st_size, 'mtime': stat.st_mtime,
+                'chunk_size': args.chunk_size, 'text_column': args.text_column, 'id_column': args.id_column}
+    progress_path = f"{args.output}.progress.json"
+    if args.restart and os.path.exists(progress_path):
+        os.remove(progress_path)
+    progress = load_progress(progress_path, identity)
+    progress['identity'] = identity
+    if progress['chunks']:
+        print(f"Resuming after {progress['chunks']} chunks ({progress['reviews']} reviews)")
+
+    records = read_records(args.input, args.text_column, args.id_column, args.chunk_size)
+    chunks = iter(lambda: list(itertools.islice(records, args.chunk_size)), [])
+    chunks = itertools.islice(chunks, progress['chunks'], None)
+
+    writer = ResultWriter(args.output, progress['offset'])
+    pool = ProcessPoolExecutor(max_workers=args.workers, mp_context=multiprocessing.get_context('spawn'),
+                               initializer=_init_worker, initargs=(torch_threads,))
+    print(f"Scoring with {args.workers} processes x {torch_threads} torch threads...")
+
+    started = time.perf_counter()
+    scored_this_run = 0
+    pending = []  # (ids, rows skipped, future) in input order
+    try:
+        while True:
+            # Keep a couple of chunks queued per process, and write finished ones in order
+            while len(pending) < args.workers * 2:
+                chunk = next(chunks, None)
+                if chunk is None:
+                    break
+                rows = [row for row in chunk if isinstance(row.get(args.text_column), str) and row[args.text_column].strip()]
+                ids = [row.get(args.id_column) for row in rows]
+                pending.append((ids, len(chunk) - len(rows), pool.submit(_score_chunk, [row[args.text_column] for row in rows], args.batch_size)))
+            if not pending:
+                break
+
+            ids, skipped, future = pending.pop(0)
+            for review_id, result in zip(ids, future.result()):
+                writer.write(review_id, result)
+            progress['offset'] = writer.commit()
+            progress['chunks'] += 1
+            progress['reviews'] += len(ids)
+            progress['skipped'] += skipped
+            save_progress(progress_path, progress)
+
+            scored_this_run += len(ids)
+            elapsed = time.perf_counter() - started
+            print(f"  {progress['reviews']} reviews scored ({scored_this_run / elapsed:.0f} reviews/s)")
+    except KeyboardInterrupt:
+        print(f"\nInterrupted; run the same command again to resume after chunk {progress['chunks']}")
+        pool.shutdown(wait=False, cancel_futures=True)
+        writer.close()
+        sys.exit(130)
+
+    pool.shutdown()
+    writer.close()
+    print(f"\n✓ {progress['reviews']} reviews written to {args.output} "
+          f"({progress['skipped']} rows without text skipped)")
+
+
+if __name__ == '__main__':
+    main()
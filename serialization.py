@@ -0,0 +1,223 @@
+"""
+Response encoding for the prediction routes
+  - JSON is encoded with orjson when it is installed (several times faster
+    than the json module), else with compact json.dumps
+  - compact mode drops echoed text and sends each result as a label index
+    and a score array, with the label names listed once
+  - gzip or deflate is applied when the client accepts it and the body is
+    large enough to benefit
+  - the MessagePack batch format carries texts as one UTF-8 buffer plus a
+    uint32 offsets array, and returns label indices and float32 scores as
+    packed arrays (needs the msgpack package)
+"""
+
+import gzip
+import json
+import zlib
+
+import numpy as np
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def dumps(obj):
+    """JSON-encode obj to bytes"""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, separators=(',', ':')).encode('utf-8')
+
+
+def result_labels(results):
+    """Label names in score order, taken from the first scored result"""
+    for result in results:
+        if result.get('scores'):
+            return list(result['scores'])
+    return []
+
+
+def _compact_one(result, labels):
+    """(label index, score array) for one prediction dict"""
+    scores = result.get('scores')
+    if not scores:
+        return None, None
+    return labels.index(result['sentiment']), [scores.get(label) for label in labels]
+
+
+def compact_result(result):
+    """Single-review response body in compact form"""
+    labels = result_labels([result])
+    label, scores = _compact_one(result, labels)
+    payload = {'success': True, 'labels': labels, 'label': label, 'scores': scores}
+    if result.get('truncated'):
+        payload['truncated'] = True
+    if 'error' in result:
+        payload['error'] = result['error']
+    return payload
+
+
+def compact_batch(ids, results):
+    """Batch response body in compact (column) form
+
+    label and scores are parallel to ids; truncated lists the positions of
+    shortened reviews and errors maps positions to error messages.
+    """
+    labels = result_labels(results)
+    label_column, score_column, truncated, errors = [], [], [], {}
+    for i, result in enumerate(results):
+        label, scores = _compact_one(result, labels)
+        label_column.append(label)
+        score_column.append(scores)
+        if result.get('truncated'):
+            truncated.append(i)
+        if 'error' in result:
+            errors[i] = result['error']
+    payload = {'success': True, 'count': len(results), 'labels': labels, 'ids': ids,
+               'label': label_column, 'scores': score_column}
+    if truncated:
+        payload['truncated'] = truncated
+    if errors:
+        payload['errors'] = errors
+    return payload
+
+
+def negotiate_encoding(accept_encoding):
+    """Preferred supported content coding from an Accept-Encoding header, or None"""
+    offered = {}
+    for part in (accept_encoding or '').lower().split(','):
+        name, _, params = part.strip().partition(';')
+        quality = 1.0
+        if params.strip().startswith('q='):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                quality = 0.0
+        offered[name.strip()] = quality
+    for coding in ('gzip', 'deflate'):
+        if offered.get(coding, offered.get('*', 0.0)) > 0:
+            return coding
+    return None
+
+
+def compress(body, accept_encoding, min_bytes, level):
+    """(body, extra headers) with gzip/deflate applied when accepted and worthwhile"""
+    coding = negotiate_encoding(accept_encoding) if len(body) >= min_bytes else None
+    if coding == 'gzip':
+        body = gzip.compress(body, compresslevel=level, mtime=0)
+    elif coding == 'deflate':
+        body = zlib.compress(body, level)
+    headers = {'Vary': 'Accept-Encoding'}
+    if coding:
+        headers['Content-Encoding'] = coding
+    return body, headers
+
+
+MSGPACK_MIMETYPE = 'application/x-msgpack'
+
+# Label index of reviews that were not scored (empty text or an error)
+NO_LABEL = 255
+
+
+class BinaryFormatError(ValueError):
+    """Raised for a malformed MessagePack batch request"""
+
+
+def _msgpack():
+    try:
+        import msgpack
+    except ImportError:
+        raise BinaryFormatError('MessagePack support needs the msgpack package (pip install msgpack)')
+    return msgpack
+
+
+def encode_msgpack_request(texts, ids=None, **options):
+    """Build a MessagePack batch request (for clients)"""
+    encoded = [text.encode('utf-8') for text in texts]
+    offsets = np.zeros(len(encoded) + 1, dtype='<u4')
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    request = {'texts': b''.join(encoded), 'offsets': offsets.tobytes(), **options}
+    if ids is not None:
+        request['ids'] = ids
+    return _msgpack().packb(request, use_bin_type=True)
+
+
+def decode_msgpack_request(body):
+    """(texts, ids, options) from a MessagePack batch request
+
+    texts is one UTF-8 buffer and offsets holds len(texts) + 1 little-endian
+    uint32 positions into it. ids is optional: a list, or packed little-endian
+    int64 values that are echoed back packed.
+    """
+    try:
+        request = _msgpack().unpackb(body, raw=False)
+    except BinaryFormatError:
+        raise
+    except Exception as e:
+        raise BinaryFormatError(f"Invalid MessagePack: {str(e) or type(e).__name__}")
+    if not isinstance(request, dict) or not isinstance(request.get('texts'), bytes) \
+            or not isinstance(request.get('offsets'), bytes):
+        raise BinaryFormatError('Request must be a map with binary texts and offsets')
+
+    buffer = memoryview(request.pop('texts'))
+    offsets = np.frombuffer(request.pop('offsets'), dtype='<u4')
+    if len(offsets) == 0 or offsets[0] != 0 or offsets[-1] != len(buffer) or np.any(np.diff(offsets.astype(np.int64)) < 0):
+        raise BinaryFormatError('offsets must start at 0, never decrease and end at len(texts)')
+    try:
+        texts = [str(buffer[start:end], 'utf-8') for start, end in zip(offsets[:-1].tolist(), offsets[1:].tolist())]
+    except UnicodeDecodeError as e:
+        raise BinaryFormatError(f"texts is not valid UTF-8: {e}")
+
+    ids = request.pop('ids', None)
+    if isinstance(ids, bytes):
+        if len(ids) % 8:
+            raise BinaryFormatError('Packed ids must be a whole number of int64 values')
+        ids = np.frombuffer(ids, dtype='<i8')
+    elif ids is not None and not isinstance(ids, list):
+        raise BinaryFormatError('ids must be a list or packed int64 values')
+    if ids is not None and len(ids) != len(texts):
+        raise BinaryFormatError('ids must have one entry per text')
+    if request.get('model') is not None and not isinstance(request['model'], str):
+        raise BinaryFormatError('model must be a string')
+    return texts, ids, request
+
+
+def encode_msgpack_response(ids, results, labels=None):
+    """Pack batch results: uint8 label indices and row-major float32 scores
+
+    Unscored reviews have label NO_LABEL and NaN scores, and appear in errors.
+    """
+    labels = labels or result_labels(results)
+    label_column = np.full(len(results), NO_LABEL, dtype='u1')
+    scores = np.full((len(results), len(labels)), np.nan, dtype='<f4')
+    truncated = np.zeros(len(results), dtype='u1')
+    errors = {}
+    for i, result in enumerate(results):
+        if result.get('scores'):
+            label_column[i] = labels.index(result['sentiment'])
+            scores[i] = [result['scores'][label] for label in labels]
+        if result.get('truncated'):
+            truncated[i] = 1
+        if 'error' in result:
+            errors[i] = result['error']
+    response = {
+        'success': True, 'count': len(results), 'labels': labels,
+        'label': label_column.tobytes(), 'scores': scores.tobytes(), 'truncated': truncated.tobytes(),
+    }
+    if ids is not None:
+        response['ids'] = ids.astype('<i8').tobytes() if isinstance(ids, np.ndarray) else list(ids)
+    if errors:
+        response['errors'] = errors
+    return _msgpack().packb(response, use_bin_type=True)
+
+
+def decode_msgpack_response(body):
+    """Unpack a batch response into numpy arrays (for clients)"""
+    response = _msgpack().unpackb(body, raw=False, strict_map_key=False)
+    response['label'] = np.frombuffer(response['label'], dtype='u1')
+    response['scores'] = np.frombuffer(response['scores'], dtype='<f4').reshape(response['count'], len(response['labels']))
+    response['truncated'] = np.frombuffer(response['truncated'], dtype='u1').astype(bool)
+    if isinstance(response.get('ids'), bytes):
+        response['ids'] = np.frombuffer(response['ids'], dtype='<i8')
+    return response
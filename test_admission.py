@@ -0,0 +1,166 @@
+"""
+Tests for admission (PriorityGate ordering and shedding, RateLimiter buckets)
+Run with: python -m pytest test_admission.py
+"""
+
+import os
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+import admission
+from admission import MemoryBuckets, Overloaded, PriorityGate, RateLimiter, SQLiteBuckets
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError('timed out waiting for the gate')
+        time.sleep(0.005)
+
+
+class PriorityGateTest(unittest.TestCase):
+    def start(self, gate, priority, served):
+        """Thread that takes a slot of the given priority and records when it got it"""
+        def run():
+            with gate.enter(priority, shed=False):
+                served.append(priority)
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        return thread
+
+    def test_interactive_goes_ahead_of_queued_batch_work(self):
+        gate = PriorityGate(1)
+        served = []
+        holder = gate.enter('batch')
+        holder.__enter__()
+        batch = self.start(gate, 'batch', served)
+        wait_for(lambda: gate.stats()['waiting']['batch'] == 1)
+        interactive = self.start(gate, 'interactive', served)
+        wait_for(lambda: gate.stats()['waiting']['interactive'] == 1)
+
+        holder.__exit__(None, None, None)
+        batch.join(5)
+        interactive.join(5)
+        self.assertEqual(served, ['interactive', 'batch'])
+        self.assertEqual(gate.stats()['active'], 0)
+
+    def test_batch_is_shed_only_while_work_is_queued(self):
+        gate = PriorityGate(1, shed_after_ms=10)
+        gate.queue_wait_ms = 500.0
+        # Slow past admissions alone do not shed an idle gate
+        gate.check('batch')
+        with gate.enter('batch'):
+            pass
+        self.assertEqual(gate.shed, 0)
+
+        gate.queue_wait_ms = 500.0
+        served = []
+        holder = gate.enter('interactive')
+        holder.__enter__()
+        waiter = self.start(gate, 'interactive', served)
+        wait_for(lambda: gate.stats()['waiting']['interactive'] == 1)
+        with self.assertRaises(Overloaded) as raised:
+            gate.check('batch')
+        self.assertEqual(raised.exception.retry_after, 1)
+        with self.assertRaises(Overloaded):
+            with gate.enter('batch'):
+                pass
+        gate.check('interactive')
+        self.assertEqual(gate.shed, 2)
+
+        holder.__exit__(None, None, None)
+        waiter.join(5)
+        self.assertEqual(served, ['interactive'])
+
+    def test_no_threshold_never_sheds(self):
+        gate = PriorityGate(1)
+        gate.queue_wait_ms = 10000.0
+        gate._waiting['interactive'] = 3
+        gate.check('batch')
+        self.assertEqual(gate.shed, 0)
+
+
+class BucketsTest(unittest.TestCase):
+    """Shared checks for both bucket stores; `now` is passed in, so no sleeping"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.stores = {'memory': MemoryBuckets(),
+                       'sqlite': SQLiteBuckets(os.path.join(self.tmp.name, 'rate_limits.sqlite3'))}
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_burst_then_refill(self):
+        for name, buckets in self.stores.items():
+            with self.subTest(store=name):
+                self.assertEqual(buckets.take('a', 5, 1.0, 5, 100.0), (True, 0))
+                self.assertFalse(buckets.take('a', 1, 1.0, 5, 100.0)[0])
+                self.assertTrue(buckets.take('a', 2, 1.0, 5, 102.0)[0])
+                # Other clients have their own bucket
+                self.assertTrue(buckets.take('b', 5, 1.0, 5, 102.0)[0])
+
+    def test_request_larger_than_burst_leaves_bucket_in_debt(self):
+        for name, buckets in self.stores.items():
+            with self.subTest(store=name):
+                self.assertEqual(buckets.take('a', 20, 1.0, 5, 100.0), (True, -15))
+                allowed, tokens = buckets.take('a', 1, 1.0, 5, 110.0)
+                self.assertFalse(allowed)
+                self.assertEqual(tokens, -5)
+                self.assertTrue(buckets.take('a', 1, 1.0, 5, 116.0)[0])
+
+    def test_memory_store_drops_least_recent_clients(self):
+        buckets = MemoryBuckets(max_clients=2)
+        buckets.take('a', 5, 1.0, 5, 100.0)
+        buckets.take('b', 1, 1.0, 5, 100.0)
+        buckets.take('c', 1, 1.0, 5, 100.0)
+        # 'a' was forgotten, so it starts again from a full bucket
+        self.assertTrue(buckets.take('a', 5, 1.0, 5, 100.0)[0])
+
+
+class RateLimiterTest(unittest.TestCase):
+    def limiter(self, rate=2.0, burst=10):
+        limiter = RateLimiter(rate, burst)
+        self.now = 1000.0
+        patcher = mock.patch.object(admission.time, 'time', lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return limiter
+
+    def test_retry_after_covers_the_missing_tokens(self):
+        limiter = self.limiter()
+        self.assertEqual(limiter.take('a', 10), 0)
+        self.assertEqual(limiter.take('a', 3), 2)
+        self.now += 1.0
+        self.assertEqual(limiter.take('a', 3), 1)
+        self.now += 0.5
+        self.assertEqual(limiter.take('a', 3), 0)
+        self.assertEqual(limiter.limited, 2)
+
+    def test_retry_after_includes_debt(self):
+        limiter = self.limiter()
+        self.assertEqual(limiter.take('a', 50), 0)
+        # 40 reviews of debt plus one review, at 2 per second
+        self.assertEqual(limiter.take('a', 1), 21)
+        # More than the burst only ever waits for a full bucket
+        self.now += 20.5
+        self.assertEqual(limiter.take('a', 100), 5)
+        self.now += 5.0
+        self.assertEqual(limiter.take('a', 100), 0)
+
+    def test_zero_cost_is_charged_as_one(self):
+        limiter = self.limiter(burst=1)
+        self.assertEqual(limiter.take('a', 0), 0)
+        self.assertEqual(limiter.take('a', 0), 1)
+
+    def test_unknown_backend(self):
+        with self.assertRaises(ValueError):
+            RateLimiter(1.0, 1, backend='redis')
+
+
+if __name__ == '__main__':
+    unittest.main()
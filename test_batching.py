@@ -0,0 +1,86 @@
+"""
+Tests for batching.Coalescer (sharing in-flight predictions between callers)
+Run with: python -m pytest test_batching.py
+"""
+
+import threading
+import unittest
+
+from batching import Coalescer
+
+
+class CoalescerTest(unittest.TestCase):
+    def test_second_caller_waits_for_the_owner(self):
+        coalescer = Coalescer()
+        owned, waiting = coalescer.claim(['a', 'b'])
+        self.assertEqual((owned, waiting), (['a', 'b'], {}))
+
+        owned, waiting = coalescer.claim(['b', 'c'])
+        self.assertEqual(owned, ['c'])
+        self.assertEqual(list(waiting), ['b'])
+        self.assertFalse(waiting['b'].done())
+        self.assertEqual(coalescer.coalesced, 1)
+
+        coalescer.resolve('b', {'sentiment': 'positive'})
+        self.assertEqual(waiting['b'].result(timeout=1), {'sentiment': 'positive'})
+
+    def test_error_reaches_every_waiter(self):
+        coalescer = Coalescer()
+        coalescer.claim(['a'])
+        waiters = [coalescer.claim(['a'])[1]['a'] for _ in range(3)]
+
+        coalescer.resolve('a', error=ValueError('model failed'))
+        for future in waiters:
+            with self.assertRaisesRegex(ValueError, 'model failed'):
+                future.result(timeout=1)
+        self.assertEqual(coalescer.coalesced, 3)
+
+    def test_error_from_owner_thread(self):
+        """The owner's failure is raised in a waiter blocked in another thread"""
+        coalescer = Coalescer()
+        claimed = threading.Event()
+        waiter_claimed = threading.Event()
+
+        def owner():
+            owned, _ = coalescer.claim(['a'])
+            claimed.set()
+            waiter_claimed.wait(5)
+            error = None
+            try:
+                raise RuntimeError('forward pass failed')
+            except RuntimeError as e:
+                error = e
+            finally:
+                for key in owned:
+                    coalescer.resolve(key, error=error)
+
+        thread = threading.Thread(target=owner)
+        thread.start()
+        claimed.wait(5)
+        owned, waiting = coalescer.claim(['a'])
+        self.assertEqual(owned, [])
+        waiter_claimed.set()
+        with self.assertRaisesRegex(RuntimeError, 'forward pass failed'):
+            waiting['a'].result(timeout=5)
+        thread.join(5)
+
+    def test_resolved_key_can_be_claimed_again(self):
+        coalescer = Coalescer()
+        coalescer.claim(['a'])
+        coalescer.resolve('a', error=RuntimeError('failed'))
+        owned, waiting = coalescer.claim(['a'])
+        self.assertEqual((owned, waiting), (['a'], {}))
+
+    def test_late_resolve_is_ignored(self):
+        # Owners resolve every claimed key again in a finally block; the first result wins
+        coalescer = Coalescer()
+        coalescer.claim(['a'])
+        future = coalescer.claim(['a'])[1]['a']
+        coalescer.resolve('a', 'done')
+        coalescer.resolve('a', error=RuntimeError('Prediction was abandoned'))
+        self.assertEqual(future.result(timeout=1), 'done')
+        coalescer.resolve('never-claimed', 'ignored')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+"""
+Tests for model_download against a local fake bucket (LocalBucket)
+Run with: python -m pytest test_model_download.py
+"""
+
+import json
+import os
+import tempfile
+import unittest
+
+from model_download import (MANIFEST_NAME, VERSION_MARKER, LocalBlob, LocalBucket, build_manifest,
+                            download_model, read_version_marker)
+
+FOLDER = 'SentimentAnalysis'
+FILES = ['config.json', 'model.safetensors']
+CHUNK = 1024
+
+
+class FlakyBlob(LocalBlob):
+    """Fails every ranged read at or after fail_from; records the chunk starts it served"""
+
+    def __init__(self, path, reads, fail_from=None):
+        super().__init__(path)
+        self.reads = reads
+        self.fail_from = fail_from
+
+    def download_as_bytes(self, start=None, end=None):
+        if self.fail_from is not None and start is not None and start >= self.fail_from:
+            raise ConnectionError('connection reset')
+        if start is not None:
+            self.reads.append((os.path.basename(self.path), start))
+        return super().download_as_bytes(start, end)
+
+
+class FlakyBucket(LocalBucket):
+    def __init__(self, root, fail_from=None):
+        super().__init__(root)
+        self.fail_from = fail_from
+        self.reads = []
+
+    def blob(self, name):
+        return FlakyBlob(os.path.join(self.root, name), self.reads, self.fail_from)
+
+
+class UnreachableBucket(LocalBucket):
+    def blob(self, name):
+        raise AssertionError(f"bucket was contacted for {name}")
+
+
+class DownloadTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.bucket_root = os.path.join(self.tmp.name, 'bucket')
+        self.model_dir = os.path.join(self.tmp.name, 'cached_model')
+        source = os.path.join(self.bucket_root, FOLDER)
+        os.makedirs(source)
+        with open(os.path.join(source, 'config.json'), 'w') as f:
+            json.dump({'model_type': 'bert'}, f)
+        with open(os.path.join(source, 'model.safetensors'), 'wb') as f:
+            f.write(os.urandom(10 * CHUNK + 100))
+        self.source = source
+        self.write_manifest(build_manifest(source, FILES))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def write_manifest(self, manifest):
+        with open(os.path.join(self.source, MANIFEST_NAME), 'w') as f:
+            json.dump(manifest, f)
+
+    def read(self, directory, filename):
+        with open(os.path.join(directory, filename), 'rb') as f:
+            return f.read()
+
+    def download(self, bucket):
+        return download_model(bucket, FOLDER, self.model_dir, FILES, workers=1, chunk_size=CHUNK)
+
+    def test_interrupted_download_resumes_from_part_file(self):
+        with self.assertRaises(ConnectionError):
+            self.download(FlakyBucket(self.bucket_root, fail_from=5 * CHUNK))
+        part = os.path.join(self.model_dir, 'model.safetensors')
+        self.assertTrue(os.path.exists(f"{part}.part"))
+        with open(f"{part}.part.json") as f:
+            self.assertEqual(json.load(f)['done'], [0, 1, 2, 3, 4])
+        self.assertIsNone(read_version_marker(self.model_dir))
+
+        bucket = FlakyBucket(self.bucket_root)
+        manifest = self.download(bucket)
+        resumed = sorted(start for name, start in bucket.reads if name == 'model.safetensors')
+        self.assertEqual(resumed, [i * CHUNK for i in range(5, 11)])
+        self.assertEqual(self.read(self.model_dir, 'model.safetensors'), self.read(self.source, 'model.safetensors'))
+        self.assertFalse(os.path.exists(f"{part}.part"))
+        self.assertFalse(os.path.exists(f"{part}.part.json"))
+        self.assertEqual(read_version_marker(self.model_dir)['version'], manifest['version'])
+
+    def test_checksum_mismatch_discards_part_file(self):
+        manifest = build_manifest(self.source, FILES)
+        manifest['files']['model.safetensors']['sha256'] = '0' * 64
+        self.write_manifest(manifest)
+
+        with self.assertRaisesRegex(Exception, 'Checksum mismatch for model.safetensors'):
+            self.download(LocalBucket(self.bucket_root))
+        part = os.path.join(self.model_dir, 'model.safetensors')
+        self.assertFalse(os.path.exists(part))
+        self.assertFalse(os.path.exists(f"{part}.part"))
+        self.assertFalse(os.path.exists(f"{part}.part.json"))
+        self.assertFalse(os.path.exists(os.path.join(self.model_dir, VERSION_MARKER)))
+
+    def test_version_marker_skips_download(self):
+        first = self.download(LocalBucket(self.bucket_root))
+        self.assertEqual(self.download(UnreachableBucket(self.bucket_root)), first)
+
+
+if __name__ == '__main__':
+    unittest.main()
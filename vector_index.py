@@ -0,0 +1,294 @@
+"""
+Embedding index for near-duplicate review lookup
+Keeps, for every review the model has scored, its pooled sentence embedding
+(unit length), a 64-bit SimHash of the text and the sentiment result.
+  - near_duplicate(): finds a stored text whose SimHash differs in at most
+    max_distance bits, so a near-repeat reuses the stored result without a
+    forward pass. Lookups go through four 16-bit bands; texts within 3 bits
+    always share at least one band exactly.
+  - search(): top-k cosine similarity over the embeddings
+
+Saved entries are memory-mapped from <directory>/vectors-<generation>.npy, so
+all workers on a host share one copy in the page cache. New entries stay in
+memory until save(), which merges them (under a file lock) with whatever
+other workers saved into a new generation. The files are written and read
+back outside the in-memory lock, so lookups keep running during a save.
+"""
+
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+SIMHASH_BANDS = 4
+BAND_BITS = 64 // SIMHASH_BANDS
+MANIFEST_NAME = 'current.json'
+_BIT_SHIFTS = np.arange(64, dtype=np.uint64)
+
+
+def canonical(text):
+    """Lowercased words only, so punctuation and spacing do not matter"""
+    return ' '.join(re.findall(r'\w+', text.lower()))
+
+
+def simhash(text):
+    """64-bit SimHash over character trigrams of the canonical text"""
+    words = canonical(text)
+    grams = {words[i:i + 3] for i in range(max(1, len(words) - 2))}
+    hashes = np.array([int.from_bytes(hashlib.blake2b(g.encode(), digest_size=8).digest(), 'little') for g in grams],
+                      dtype=np.uint64)
+    bits = (hashes[:, None] >> _BIT_SHIFTS) & np.uint64(1)
+    votes = bits.sum(axis=0) * 2 > len(hashes)
+    return int(np.bitwise_or.reduce(votes.astype(np.uint64) << _BIT_SHIFTS))
+
+
+def text_key(text):
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def _band_add(bands, row, h):
+    for band, buckets in enumerate(bands):
+        buckets.setdefault((h >> (band * BAND_BITS)) & 0xFFFF, []).append(row)
+
+
+class VectorIndex:
+    """Persisted embedding + SimHash index for one model version"""
+
+    def __init__(self, directory, dim, max_entries=100000, max_distance=3, min_chars=40):
+        self.directory = directory
+        self.dim = dim
+        self.max_entries = max_entries
+        self.max_distance = min(max_distance, SIMHASH_BANDS - 1)
+        self.min_chars = min_chars
+        self.near_duplicate_hits = 0
+        self._lock = threading.RLock()
+        self._save_lock = threading.Lock()
+        self._saver = None
+        self._saver_pid = None
+        self._full_warned = False
+        with self._file_lock(exclusive=False):
+            self._load(self._read_state(self._read_generation()))
+
+    @contextmanager
+    def _file_lock(self, exclusive):
+        """Cross-process lock, so generations are not swapped while being read (none on Windows)"""
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, '.lock'), 'a') as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            yield
+
+    def _path(self, kind, generation):
+        extension = 'jsonl' if kind == 'entries' else 'npy'
+        return os.path.join(self.directory, f"{kind}-{generation}.{extension}")
+
+    def _read_generation(self):
+        try:
+            with open(os.path.join(self.directory, MANIFEST_NAME)) as f:
+                return json.load(f)['generation']
+        except (OSError, ValueError, KeyError):
+            return 0
+
+    def _read_saved(self, generation):
+        """(vectors, hashes, entries) of a saved generation; vectors are memory-mapped"""
+        if not generation:
+            return np.empty((0, self.dim), dtype=np.float32), np.empty(0, dtype=np.uint64), []
+        vectors = np.load(self._path('vectors', generation), mmap_mode='r')
+        if vectors.shape[1] != self.dim:
+            raise ValueError(f"Index in {self.directory} has {vectors.shape[1]}-d vectors, expected {self.dim}")
+        hashes = np.load(self._path('simhash', generation))
+        with open(self._path('entries', generation)) as f:
+            entries = [json.loads(line) for line in f]
+        return vectors, hashes, entries
+
+    def _read_state(self, generation):
+        """Everything _load() needs for a saved generation, read without holding self._lock"""
+        vectors, saved_hashes, entries = self._read_saved(generation)
+        hashes = [int(h) for h in saved_hashes]
+        keys = {entry['key']: row for row, entry in enumerate(entries)}
+        bands = [{} for _ in range(SIMHASH_BANDS)]
+        for row, h in enumerate(hashes):
+            _band_add(bands, row, h)
+        return generation, vectors, hashes, entries, keys, bands
+
+    def _load(self, state):
+        self.generation, self._saved, self._hashes, self._entries, self._keys, self._bands = state
+        self._pending = []
+        self._stacked = None
+
+    def _append(self, entry, vector, h):
+        row = len(self._entries)
+        self._entries.append(entry)
+        self._pending.append(vector)
+        self._hashes.append(h)
+        self._keys[entry['key']] = row
+        _band_add(self._bands, row, h)
+        self._stacked = None
+
+    def _swap_in(self, state, since):
+        """Switch to a freshly read generation, keeping the entries added from row `since` on"""
+        with self._lock:
+            later = [(self._entries[row], self._vector(row), self._hashes[row])
+                     for row in range(since, len(self._entries))]
+            self._load(state)
+            for entry, vector, h in later:
+                if entry['key'] not in self._keys and len(self._entries) < self.max_entries:
+                    self._append(entry, vector, h)
+
+    def _vector(self, row):
+        saved = len(self._saved)
+        return self._saved[row] if row < saved else self._pending[row - saved]
+
+    def __len__(self):
+        return len(self._entries)
+
+    def add(self, text, vector, result):
+        """Store a scored text; returns False for known texts, failed results or a full index"""
+        if 'error' in result:
+            return False
+        key = text_key(text)
+        h = simhash(text)
+        vector = np.asarray(vector, dtype=np.float32)
+        vector = vector / max(float(np.linalg.norm(vector)), 1e-12)
+        with self._lock:
+            if key in self._keys:
+                return False
+            if len(self._entries) >= self.max_entries:
+                if not self._full_warned:
+                    print(f"⚠ Embedding index {self.directory} is full ({self.max_entries} entries)")
+                    self._full_warned = True
+                return False
+            self._append({'key': key, 'text': text, 'result': result}, vector, h)
+        return True
+
+    def vector_for(self, text):
+        """Stored embedding of exactly this text, or None"""
+        with self._lock:
+            row = self._keys.get(text_key(text))
+            return None if row is None else np.array(self._vector(row))
+
+    def near_duplicate(self, text):
+        """Stored result of a near-identical text (flagged near_duplicate), or None"""
+        if len(text) < self.min_chars or self.max_distance < 0:
+            return None
+        h = simhash(text)
+        with self._lock:
+            candidates = set()
+            for band, buckets in enumerate(self._bands):
+                candidates.update(buckets.get((h >> (band * BAND_BITS)) & 0xFFFF, ()))
+            best, best_distance = None, self.max_distance + 1
+            for row in candidates:
+                distance = bin(h ^ self._hashes[row]).count('1')
+                if distance < best_distance:
+                    best, best_distance = row, distance
+            if best is None:
+                return None
+            self.near_duplicate_hits += 1
+            return {**self._entries[best]['result'], 'near_duplicate': True}
+
+    def search(self, vector, k=5, exclude_text=None):
+        """Top-k stored entries by cosine similarity to vector, as (entry, similarity)"""
+        query = np.asarray(vector, dtype=np.float32)
+        query = query / max(float(np.linalg.norm(query)), 1e-12)
+        with self._lock:
+            if self._pending and self._stacked is None:
+                self._stacked = np.stack(self._pending)
+            parts = [self._saved] + ([self._stacked] if self._pending else [])
+            entries = self._entries
+        similarity = np.concatenate([part @ query for part in parts]) if entries else np.empty(0, dtype=np.float32)
+        exclude = text_key(exclude_text) if exclude_text is not None else None
+        order = np.argsort(-similarity)[:k + 1] if len(similarity) <= 4 * (k + 1) \
+            else np.argpartition(-similarity, k)[:k + 1]
+        found = sorted(((entries[row], float(similarity[row])) for row in order.tolist()
+                        if entries[row]['key'] != exclude), key=lambda pair: -pair[1])
+        return found[:k]
+
+    def save(self):
+        """Merge new entries with the saved index on disk and reload it; returns the number written"""
+        with self._save_lock:
+            # Snapshot under the lock; entries added while the files are written are kept by _swap_in()
+            with self._lock:
+                saved = len(self._saved)
+                total = len(self._entries)
+                loaded = self.generation
+                if total > saved:
+                    new_entries = self._entries[saved:]
+                    new_vectors = self._stacked if self._stacked is not None else np.stack(self._pending)
+                    new_hashes = self._hashes[saved:]
+                    base_vectors, base_hashes, base_entries = self._saved, np.array(self._hashes[:saved], dtype=np.uint64), self._entries[:saved]
+            if total == saved:
+                # Pick up what other workers saved
+                if self._read_generation() != loaded:
+                    with self._file_lock(exclusive=False):
+                        state = self._read_state(self._read_generation())
+                    self._swap_in(state, saved)
+                return 0
+            with self._file_lock(exclusive=True):
+                # Another worker may have saved since this one loaded
+                generation = self._read_generation()
+                if generation != loaded:
+                    base_vectors, base_hashes, base_entries = self._read_saved(generation)
+                    known = {entry['key'] for entry in base_entries}
+                    keep = [i for i, entry in enumerate(new_entries) if entry['key'] not in known]
+                    new_entries = [new_entries[i] for i in keep]
+                    new_vectors, new_hashes = new_vectors[keep], [new_hashes[i] for i in keep]
+                room = max(0, self.max_entries - len(base_entries))
+                new_entries, new_vectors, new_hashes = new_entries[:room], new_vectors[:room], new_hashes[:room]
+
+                target = generation + 1
+                np.save(self._path('vectors', target), np.concatenate([base_vectors, new_vectors]).astype(np.float32))
+                np.save(self._path('simhash', target), np.concatenate([base_hashes, np.array(new_hashes, dtype=np.uint64)]))
+                with open(self._path('entries', target), 'w') as f:
+                    for entry in base_entries + new_entries:
+                        f.write(json.dumps(entry) + '\n')
+                tmp_path = os.path.join(self.directory, f"{MANIFEST_NAME}.tmp")
+                with open(tmp_path, 'w') as f:
+                    json.dump({'generation': target, 'entries': len(base_entries) + len(new_entries), 'dim': self.dim}, f)
+                os.replace(tmp_path, os.path.join(self.directory, MANIFEST_NAME))
+                self._swap_in(self._read_state(target), total)
+                # Mapped copies stay readable in other workers until they reload. Windows
+                # refuses to delete a mapped file; it is left behind there
+                for kind in ('vectors', 'simhash', 'entries'):
+                    old_path = self._path(kind, generation)
+                    if generation and os.path.exists(old_path):
+                        try:
+                            os.remove(old_path)
+                        except OSError:
+                            pass
+            return len(new_entries)
+
+    def ensure_saver(self, interval):
+        """Start the periodic save thread (again after a fork)"""
+        if interval <= 0:
+            return
+        with self._lock:
+            if self._saver is not None and self._saver_pid == os.getpid() and self._saver.is_alive():
+                return
+            self._saver_pid = os.getpid()
+            self._saver = threading.Thread(target=self._save_periodically, args=(interval,),
+                                           name='embedding-index-saver', daemon=True)
+            self._saver.start()
+
+    def _save_periodically(self, interval):
+        while True:
+            time.sleep(interval)
+            try:
+                self.save()
+            except Exception as e:
+                print(f"⚠ Could not save embedding index {self.directory}: {e}")
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'saved': len(self._saved), 'pending': len(self._pending),
+                    'generation': self.generation, 'max_entries': self.max_entries, 'dim': self.dim,
+                    'near_duplicate_hits': self.near_duplicate_hits}